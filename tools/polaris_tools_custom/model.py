@@ -47,6 +47,9 @@ class CustomModel(Model):
             self.position[1] = y coordinate
             self.position[2] = z coordinate
 
+            If the functions also work with a (N, 3) array of positions (e.g. by using
+            self.position[..., 0]), set self.vectorized = True to speed up the grid creation.
+
             Define also the following routines if necessary:
                 dust_density_distribution(self), gas_temperature(self),
                 dust_temperature(self), velocity_field(
@@ -108,6 +111,11 @@ class CustomDisk(Model):
         self.parameter['ref_scale_height'] = 10. * self.math.const['au']
         self.parameter['alpha'] = 0.9 # Andrews et al. 2010, https://ui.adsabs.harvard.edu/abs/2010ApJ...723.1241A/abstract
         self.parameter['beta'] = 1.1 # Woitke et al. 2019, http://adsabs.harvard.edu/abs/2019PASP..131f4301W
+        # The model functions can calculate many positions at once
+        self.vectorized = True
+        # The disk is symmetric around the z-axis and to the midplane
+        self.axisymmetric = True
+        self.mirror_symmetric = True
 
     def update_parameter(self, extra_parameter):
         """Use this function to set model parameter with the extra parameters.
@@ -31,6 +31,14 @@ class Model:
         self.octree_parameter = {
             'sidelength': None,
             'max_tree_level': 5,
+            # Merge the children if their density differs less than this from the parent (relative)
+            'refinement_limit': 0.1,
+            # Refine nodes with more gas mass [kg] or a larger optical depth (opacity of the dust [m^2/kg])
+            'max_cell_mass': None,
+            'max_optical_depth': None,
+            'opacity': None,
+            # Refine nodes if the magnetic field or velocity of the children differs more than this (relative)
+            'gradient_limit': None,
         }
 
         #: dict: Includes parameters for the spherical grid
@@ -80,6 +88,27 @@ class Model:
 
         self.position = None
         self.volume = None
+        self.cell_IDs = None
+
+        #: bool: The model functions (gas_density_distribution, magnetic_field, ...) can handle
+        #: many positions at once. If True, self.position is a (N, 3) array and self.volume
+        #: a (N,) array while the grid is created (see get_batch_data).
+        self.vectorized = False
+
+        #: bool: All quantities are symmetric around the z-axis and the vector fields rotate
+        #: with phi (e.g. Kepler rotation or toroidal fields). Spherical and cylindrical grids
+        #: then evaluate the model only in the first phi cell of each ring.
+        self.axisymmetric = False
+
+        #: bool: All quantities are mirror symmetric to the midplane (z = 0). Spherical and
+        #: cylindrical grids then evaluate the model only on one side of the midplane.
+        self.mirror_symmetric = False
+
+        #: dict: Factors of the vector components that are mirrored to the other side of the midplane
+        self.mirror_signs = {
+            'velocity_field': [1., 1., -1.],
+            'magnetic_field': [1., 1., -1.],
+        }
 
     def init_position(self, node, cell_IDs=None):
         """Initialise the grid position to calculate the necessary cell data.
@@ -93,6 +122,128 @@ class Model:
         self.position = node.parameter['position']
         self.volume = node.parameter['volume']
 
+    def init_positions(self, positions, volumes, cell_IDs=None):
+        """Initialise many grid positions at once to calculate the cell data of all of them
+        with one call of each model function (only used if self.vectorized is True).
+
+        Args:
+            positions (ndarray): (N, 3) cartesian positions of the cells.
+            volumes (ndarray): (N,) volumes of the cells.
+            cell_IDs (ndarray): (N, 3) cell_IDs of the cells (alternative to the grid position).
+                Spherical -> [i_r, i_t, i_p]
+                Cylindrical -> [i_r, i_p, i_z]
+        """
+        self.position = positions
+        self.volume = volumes
+        self.cell_IDs = cell_IDs
+
+    def get_batch_data(self, quantities, positions, volumes, cell_IDs=None, nodes=None):
+        """Calculates cell quantities for many cells at once.
+
+        Notes:
+            If self.vectorized is True, each model function is called only once with
+            the positions of all cells (see init_positions). Otherwise, init_position
+            and the accessors are called for each cell separately.
+
+        Args:
+            quantities (List[str]): Names of the accessors without 'get_'
+                (e.g. 'gas_density_distribution', 'magnetic_field').
+            positions (ndarray): (N, 3) cartesian positions of the cells.
+            volumes (ndarray): (N,) volumes of the cells.
+            cell_IDs (ndarray): (N, 3) cell_IDs of the cells.
+            nodes (NodeStore): Grid nodes that are passed to init_position if the model
+                is not vectorized (created from positions and volumes if None).
+
+        Returns:
+            dict: Array with the cell index as first dimension for each quantity
+            (None if the quantity is not defined by the model).
+        """
+        if self.vectorized:
+            self.init_positions(positions, volumes, cell_IDs)
+            return {quantity: getattr(self, 'get_' + quantity + '_batch')() for quantity in quantities}
+
+        # Fallback for models that only handle one position at a time
+        if nodes is None:
+            from polaris_tools_modules.grid import NodeStore
+            nodes = NodeStore(self.parameter['grid_type'], {'position': positions, 'volume': volumes})
+        values = {quantity: [] for quantity in quantities}
+        for i_cell, node in enumerate(nodes):
+            self.init_position(node, None if cell_IDs is None else list(cell_IDs[i_cell]))
+            for quantity in quantities:
+                values[quantity].append(getattr(self, 'get_' + quantity)())
+        batch_data = {}
+        for quantity in quantities:
+            if len(values[quantity]) > 0 and values[quantity][0] is None:
+                batch_data[quantity] = None
+            else:
+                batch_data[quantity] = np.reshape(np.array(values[quantity], dtype=float),
+                                                  (len(nodes),) + self.get_quantity_shape(quantity))
+        return batch_data
+
+    def get_quantity_shape(self, quantity):
+        """Shape of a cell quantity in one cell.
+
+        Args:
+            quantity (str): Name of the accessor without 'get_'.
+
+        Returns:
+            tuple: () for scalars, (3,) for vector fields and the shape of
+            gas_mass / dust_mass for the density distributions.
+        """
+        if quantity == 'gas_density_distribution':
+            return np.shape(self.parameter['gas_mass'])
+        elif quantity == 'dust_density_distribution':
+            return np.shape(self.parameter['dust_mass'])
+        elif quantity in ['magnetic_field', 'velocity_field']:
+            return (3,)
+        return ()
+
+    def to_batch_array(self, value, quantity):
+        """Converts the return value of a vectorized model function into an array
+        with the cell index as first dimension.
+
+        Notes:
+            Lists are interpreted as components (e.g. [v_x, v_y, v_z] with arrays or floats),
+            arrays with the cell index first (e.g. (N, 3)). Values that are the same for
+            all cells (e.g. gas_density = 1.) are repeated for each cell.
+
+        Args:
+            value: Return value of the model function.
+            quantity (str): Name of the accessor without 'get_'.
+
+        Returns:
+            ndarray: Quantity in each cell (None if value is None).
+        """
+        if value is None:
+            return None
+        nr_cells = np.shape(self.position)[0]
+        shape = self.get_quantity_shape(quantity)
+        array = self.stack_components(value)
+        if array.shape == shape:
+            return np.tile(array, (nr_cells,) + (1,) * len(shape))
+        if isinstance(value, (list, tuple)) and array.shape == shape + (nr_cells,):
+            return np.moveaxis(array, -1, 0)
+        if array.shape == (nr_cells,) + shape:
+            return array
+        if array.shape == shape + (nr_cells,):
+            return np.moveaxis(array, -1, 0)
+        raise ValueError('the ' + quantity + ' function provides an array of shape ' + str(array.shape) +
+                         ' for ' + str(nr_cells) + ' positions!')
+
+    @staticmethod
+    def stack_components(value):
+        """Converts nested lists of floats and arrays into one array.
+
+        Args:
+            value: Float, array or (nested) list of both.
+
+        Returns:
+            ndarray: Array with the list dimensions first.
+        """
+        if isinstance(value, (list, tuple)):
+            return np.stack(np.broadcast_arrays(*[Model.stack_components(v) for v in value]))
+        return np.asarray(value, dtype=float)
+
     def get_gas_temperature(self):
         """The gas temperature can be modified by the code here if neccessary.
 
@@ -177,6 +328,92 @@ class Model:
         """
         return self.dust_size_param()
 
+    def get_gas_temperature_batch(self):
+        """Batched version of get_gas_temperature (see init_positions).
+
+        Returns:
+            ndarray: (N,) gas temperatures.
+        """
+        return self.to_batch_array(self.gas_temperature(), 'gas_temperature')
+
+    def get_dust_temperature_batch(self):
+        """Batched version of get_dust_temperature (see init_positions).
+
+        Returns:
+            ndarray: (N,) dust temperatures.
+        """
+        return self.to_batch_array(self.dust_temperature(), 'dust_temperature')
+
+    def get_gas_density_distribution_batch(self):
+        """Batched version of get_gas_density_distribution (see init_positions).
+
+        Returns:
+            ndarray: (N,) gas densities or (N, ...) in the shape of self.parameter['gas_mass'].
+        """
+        gas_density = self.to_batch_array(self.gas_density_distribution(), 'gas_density_distribution')
+        if gas_density is not None and self.tmp_parameter['relative_gas_densities'] is not None:
+            return np.multiply(gas_density, self.tmp_parameter['relative_gas_densities'])
+        return gas_density
+
+    def get_dust_density_distribution_batch(self):
+        """Batched version of get_dust_density_distribution (see init_positions).
+
+        Returns:
+            ndarray: (N,) dust densities or (N, ...) in the shape of self.parameter['dust_mass'].
+        """
+        dust_density = self.to_batch_array(self.dust_density_distribution(), 'dust_density_distribution')
+        if dust_density is not None and self.tmp_parameter['relative_dust_densities'] is not None:
+            return np.multiply(dust_density, self.tmp_parameter['relative_dust_densities'])
+        return dust_density
+
+    def get_velocity_field_batch(self):
+        """Batched version of get_velocity_field (see init_positions).
+
+        Returns:
+            ndarray: (N, 3) velocities.
+        """
+        return self.to_batch_array(self.velocity_field(), 'velocity_field')
+
+    def get_magnetic_field_batch(self):
+        """Batched version of get_magnetic_field (see init_positions).
+
+        Returns:
+            ndarray: (N, 3) magnetic field strengths.
+        """
+        return self.to_batch_array(self.magnetic_field(), 'magnetic_field')
+
+    def get_dust_id_batch(self):
+        """Batched version of get_dust_id (see init_positions).
+
+        Returns:
+            ndarray: (N,) dust IDs.
+        """
+        return self.to_batch_array(self.dust_id(), 'dust_id')
+
+    def get_dust_min_size_batch(self):
+        """Batched version of get_dust_min_size (see init_positions).
+
+        Returns:
+            ndarray: (N,) minimum grain sizes.
+        """
+        return self.to_batch_array(self.dust_min_size(), 'dust_min_size')
+
+    def get_dust_max_size_batch(self):
+        """Batched version of get_dust_max_size (see init_positions).
+
+        Returns:
+            ndarray: (N,) maximum grain sizes.
+        """
+        return self.to_batch_array(self.dust_max_size(), 'dust_max_size')
+
+    def get_dust_size_param_batch(self):
+        """Batched version of get_dust_size_param (see init_positions).
+
+        Returns:
+            ndarray: (N,) size distribution parameters.
+        """
+        return self.to_batch_array(self.dust_size_param(), 'dust_size_param')
+
     def get_dz(self, radius):
         """Calculates the width of each vertical cell border depending on the radial position.
 
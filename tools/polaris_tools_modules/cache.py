@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import inspect
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+class FileCache:
+    """Content-addressed cache of numpy arrays in a directory (one .npz file per key).
+
+    Notes:
+        Files are written to a temporary file first and renamed afterwards, so that
+        multiple processes (e.g. the runs of a parameter sweep on the same node)
+        can share the same cache directory. Loading a file updates its modification
+        time, which is used to evict the least recently used files.
+    """
+
+    #: str: Version of the cached content (change it if the cached arrays change)
+    version = '1'
+
+    def __init__(self, cache_dir, max_size=None, max_age=None):
+        """Initialisation of the cache.
+
+        Args:
+            cache_dir (str): Directory of the cache files.
+            max_size (float): Maximum size of all cache files [bytes].
+            max_age (float): Maximum time since the last usage of a cache file [s].
+        """
+        #: str: Directory of the cache files
+        self.cache_dir = cache_dir
+        #: float: Maximum size of all cache files [bytes]
+        self.max_size = max_size
+        #: float: Maximum time since the last usage of a cache file [s]
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def update_hash(content_hash, value):
+        """Adds a value to a hash (dicts, lists and arrays are added by their content).
+
+        Args:
+            content_hash: Hash object of hashlib.
+            value: Value to add.
+        """
+        if isinstance(value, dict):
+            content_hash.update(b'dict')
+            for key in sorted(value.keys(), key=str):
+                FileCache.update_hash(content_hash, key)
+                FileCache.update_hash(content_hash, value[key])
+        elif isinstance(value, (list, tuple)):
+            content_hash.update(b'list' + str(len(value)).encode())
+            for item in value:
+                FileCache.update_hash(content_hash, item)
+        elif isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            content_hash.update(('array' + value.dtype.str + str(value.shape)).encode())
+            content_hash.update(value.tobytes())
+        else:
+            content_hash.update((type(value).__name__ + repr(value)).encode())
+
+    @classmethod
+    def get_key(cls, *values):
+        """Calculates the key of the cache file from its defining values.
+
+        Args:
+            values: Values that define the content of the cache file.
+
+        Returns:
+            str: Hexadecimal SHA-256 hash of the values.
+        """
+        content_hash = hashlib.sha256(cls.version.encode())
+        cls.update_hash(content_hash, list(values))
+        return content_hash.hexdigest()
+
+    def get_filename(self, key):
+        """Path of the cache file of a key.
+
+        Args:
+            key (str): Key of the cache file.
+
+        Returns:
+            str: Path of the cache file.
+        """
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load_arrays(self, key):
+        """Loads the arrays of a key.
+
+        Args:
+            key (str): Key of the cache file.
+
+        Returns:
+            dict: Arrays of the cache file (None if the key is not cached).
+        """
+        filename = self.get_filename(key)
+        try:
+            with np.load(filename) as cache_file:
+                arrays = {name: cache_file[name] for name in cache_file.files}
+            os.utime(filename)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def save_arrays(self, key, arrays):
+        """Saves arrays for a key and evicts old cache files afterwards.
+
+        Args:
+            key (str): Key of the cache file.
+            arrays (dict): Arrays to save.
+        """
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.tmp', delete=False) as tmp_file:
+            np.savez(tmp_file, **arrays)
+        # Temporary files are only readable by the owner
+        os.chmod(tmp_file.name, 0o644)
+        os.replace(tmp_file.name, self.get_filename(key))
+        self.evict()
+
+    def evict(self):
+        """Removes cache files that are too old or the least recently used ones
+        if the cache is too large.
+        """
+        cache_files = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                continue
+            cache_files.append((stat.st_mtime, stat.st_size, filename))
+        cache_files.sort()
+        total_size = sum(size for _, size, _ in cache_files)
+        for mtime, size, filename in cache_files:
+            too_old = self.max_age is not None and time.time() - mtime > self.max_age
+            too_large = self.max_size is not None and total_size > self.max_size
+            if not too_old and not too_large:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+class GridFingerprint:
+    """Sidecar file next to a grid file with the fingerprint of the model that created it.
+
+    Notes:
+        The fingerprint is a hash of the source code of the PolarisTools modules and the
+        model, the resolved model parameters and the options of polaris-gen. The sidecar
+        also stores the size and checksum of the grid file to detect changed files.
+    """
+
+    #: List: Options of polaris-gen that do not change the grid file
+    ignored_options = ['jobs', 'geometry_cache', 'cache_size', 'cache_age', 'sweep', 'force', 'convert', 'patch']
+
+    def __init__(self, grid_filename):
+        """Initialisation of the sidecar.
+
+        Args:
+            grid_filename (str): Path to the grid file.
+        """
+        #: str: Path to the grid file
+        self.grid_filename = grid_filename
+        #: str: Path to the sidecar file
+        self.filename = grid_filename + '.fingerprint.json'
+
+    @classmethod
+    def get_fingerprint(cls, model, parse_args):
+        """Calculates the fingerprint of a grid.
+
+        Args:
+            model: Model used for the grid (with the parameters set by the options).
+            parse_args: Options of polaris-gen.
+
+        Returns:
+            str: Hexadecimal SHA-256 hash.
+        """
+        module_names = sorted(set([name for name in sys.modules.keys() if name.startswith('polaris_tools')] +
+                                  [model_class.__module__ for model_class in type(model).__mro__[:-1]]))
+        sources = {}
+        for module_name in module_names:
+            try:
+                sources[module_name] = inspect.getsource(sys.modules[module_name])
+            except (OSError, TypeError):
+                sources[module_name] = None
+        options = {key: value for key, value in vars(parse_args).items() if key not in cls.ignored_options}
+        return FileCache.get_key(sources, type(model).__name__, model.parameter, model.spherical_parameter,
+                                 model.cylindrical_parameter, model.octree_parameter, model.tmp_parameter, options)
+
+    def get_checksum(self, block_size=16777216):
+        """Calculates the checksum of the grid file.
+
+        Args:
+            block_size (int): Number of bytes read at once.
+
+        Returns:
+            str: Hexadecimal SHA-256 hash of the grid file.
+        """
+        checksum = hashlib.sha256()
+        with open(self.grid_filename, 'rb') as grid_file:
+            for block in iter(lambda: grid_file.read(block_size), b''):
+                checksum.update(block)
+        return checksum.hexdigest()
+
+    def load(self):
+        """Loads the content of the sidecar.
+
+        Returns:
+            dict: Fingerprint, size, checksum and additional information (None if not available).
+        """
+        try:
+            with open(self.filename, 'r') as sidecar_file:
+                return json.load(sidecar_file)
+        except (OSError, ValueError):
+            return None
+
+    def matches(self, fingerprint):
+        """Checks if the grid file was created with the same fingerprint and is unchanged.
+
+        Args:
+            fingerprint (str): Fingerprint of the grid that should be created.
+
+        Returns:
+            bool: True if the grid file does not need to be created again.
+        """
+        sidecar = self.load()
+        if sidecar is None or sidecar.get('fingerprint') != fingerprint:
+            return False
+        try:
+            if os.path.getsize(self.grid_filename) != sidecar.get('size'):
+                return False
+        except OSError:
+            return False
+        return self.get_checksum() == sidecar.get('checksum')
+
+    def save(self, fingerprint, **info):
+        """Saves the fingerprint and the checksum of the grid file.
+
+        Args:
+            fingerprint (str): Fingerprint of the created grid.
+            info: Additional information stored in the sidecar (e.g. the masses of the grid).
+        """
+        sidecar = dict(info, fingerprint=fingerprint, size=os.path.getsize(self.grid_filename),
+                       checksum=self.get_checksum())
+        with open(self.filename, 'w') as sidecar_file:
+            json.dump(sidecar, sidecar_file, indent=4)
+
+    def remove(self):
+        """Removes the sidecar (e.g. before the grid file is overwritten).
+        """
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
@@ -1,16 +1,29 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import multiprocessing
 import struct
-from sys import stdout
+from collections import deque
+from multiprocessing import shared_memory, resource_tracker
+from sys import stdout, version_info
 
 import numpy as np
+from polaris_tools_modules.cache import FileCache
+from polaris_tools_modules.grid_file import GridWriter, GridFile, OcTreeFile
+from polaris_tools_modules.grid_index import SphericalIndex, CylindricalIndex, OcTreeIndex
+from polaris_tools_modules.octree import LinearOcTree
 
 
 class Grid:
     """This is the base class to create various grids based on the models defined in model.py.
     """
 
+    #: dict: Geometries of the last grids created in this process (see init_geometry)
+    geometry_memory = {}
+
+    #: int: Maximum number of geometries in geometry_memory
+    geometry_memory_size = 4
+
     def __init__(self, model, path, parse_args):
         """Initialisation of grid parameters.
 
@@ -77,34 +90,384 @@ class Grid:
             else:
                 self.data_length += 1
 
-    def update_mass_measurement(self, node, remove=False):
-        """Updates the total mass for normalization and allows the definition
-        of custom regions to track their mass too.
+        #: int: Position of the cell data in the grid file
+        self.data_offset = None
+
+        #: int: Number of processes to calculate the cells
+        self.jobs = 1
+        if self.parse_args is not None and self.parse_args.jobs is not None:
+            self.jobs = self.parse_args.jobs
+
+        #: FileCache: Cache of the cell positions and volumes (see init_geometry)
+        self.geometry_cache = None
+        if self.parse_args is not None and self.parse_args.geometry_cache is not None:
+            self.geometry_cache = FileCache(self.parse_args.geometry_cache,
+                                            max_size=self.parse_args.cache_size * 1e6,
+                                            max_age=self.parse_args.cache_age * 86400.)
+        #: dict: Positions and volumes of all cells with the offset of each chunk
+        self.geometry = None
+        #: bool: Keep the geometry in memory for the next grids (see geometry_memory)
+        self.keep_geometry = self.parse_args is not None and self.parse_args.sweep is not None
+        #: str: Equalize the mass or the optical depth per cell with the cell borders (see optimize_cell_borders)
+        self.border_optimization = None
+        if self.parse_args is not None and self.parse_args.optimize_borders is not None:
+            self.border_optimization = self.parse_args.optimize_borders
+
+        #: List: Model accessors (without 'get_') in the order of the cell data
+        self.quantities = []
+        if self.nr_gas_densities > 0:
+            self.quantities.append('gas_density_distribution')
+        if self.nr_dust_densities > 0:
+            self.quantities.append('dust_density_distribution')
+        for quantity in ['dust_temperature', 'gas_temperature', 'magnetic_field', 'velocity_field',
+                         'dust_id', 'dust_min_size', 'dust_max_size', 'dust_size_param']:
+            if getattr(self.data, 'get_' + quantity)() is not None:
+                self.quantities.append(quantity)
+
+        #: dict: Raw densities of each region (if the regions are normalized individually)
+        self.region_densities = {}
+        if self.model.parameter['gas_mass'] is not None and not isinstance(self.model.parameter['gas_mass'], float):
+            for quantity in ['gas_density_distribution', 'dust_density_distribution']:
+                if quantity in self.quantities and len(self.data.get_quantity_shape(quantity)) > 1:
+                    self.region_densities[quantity] = []
+
+    def get_cell_quantities(self, positions, volumes, cell_IDs=None, nodes=None):
+        """Calculates the quantities of many cells at once with the batched model accessors.
 
         Args:
-            node: A grid cell.
-            remove (bool): Remove the density instead of adding?
+            positions (ndarray): (N, 3) cartesian positions of the cells.
+            volumes (ndarray): (N,) volumes of the cells.
+            cell_IDs (ndarray): (N, 3) indices of the cells (used for external purpose).
+                Spherical -> [i_r, i_t, i_p]
+                Cylindrical -> [i_r, i_p, i_z]
+            nodes (NodeStore): Grid nodes for models that are not vectorized.
+
+        Returns:
+            dict: Array of each quantity with the cell index as first dimension.
         """
-        if self.nr_gas_densities > 0:
-            gas_mass = np.multiply(
-                node.parameter['gas_density'], node.parameter['volume'])
+        return self.data.get_batch_data(self.quantities, positions, volumes, cell_IDs, nodes)
+
+    def get_cell_data(self, quantities):
+        """Combines the cell quantities to the cell data written to the grid.
+
+        Args:
+            quantities (dict): Cell quantities (see get_cell_quantities).
+
+        Returns:
+            ndarray: (N, data_length) cell data in the order of the quantity IDs (see get_quantity_ids).
+        """
+        columns = []
+        for quantity in self.quantities:
+            value = np.asarray(quantities[quantity], dtype=float)
+            if quantity in ['gas_density_distribution', 'dust_density_distribution']:
+                # Sum the regions of each density distribution
+                value = np.sum(value, axis=tuple(range(2, value.ndim)))
+            columns.append(value.reshape(len(value), int(np.prod(value.shape[1:]))))
+        return np.hstack(columns)
+
+    def calculate_cells(self, positions, volumes, cell_IDs=None, extents=None, symmetry=None):
+        """Calculates the data of many cells at once.
+
+        Args:
+            positions (ndarray): (N, 3) cartesian positions of the cells.
+            volumes (ndarray): (N,) volumes of the cells.
+            cell_IDs (ndarray): (N, 3) indices of the cells (used for external purpose).
+            extents (ndarray): (N, 6) borders of the cells (used for models that are not vectorized).
+            symmetry (tuple): Evaluate the model only in the cells that are used
+                by the other cells (see get_symmetry).
+
+        Returns:
+            dict: Arrays with the cell data ('data') and the raw densities of the regions
+            (see region_densities) and the gas and dust mass of the cells.
+        """
+        if symmetry is None:
+            quantities = self.get_cell_quantities(positions, volumes, cell_IDs,
+                                                  nodes=self.create_nodes(positions, volumes, extents))
+        else:
+            evaluated, source = np.unique(symmetry[0], return_inverse=True)
+            quantities = self.get_cell_quantities(
+                positions[evaluated], volumes[evaluated], None if cell_IDs is None else cell_IDs[evaluated],
+                nodes=self.create_nodes(positions[evaluated], volumes[evaluated],
+                                        None if extents is None else extents[evaluated]))
+            quantities = self.apply_symmetry(quantities, source, symmetry[1], symmetry[2])
+        arrays = {'data': self.get_cell_data(quantities)}
+        for quantity in self.region_densities.keys():
+            arrays[quantity] = np.asarray(quantities[quantity], dtype=float)
+        gas_mass, dust_mass = self.get_mass_batch(quantities, volumes)
+        return {'arrays': arrays, 'gas_mass': gas_mass, 'dust_mass': dust_mass}
+
+    def get_symmetry(self, i_p, i_v, phi, n_v, mirror=True):
+        """Finds the cells of a ring (or shell) whose model quantities are the same
+        as in other cells due to the symmetry of the model.
+
+        Notes:
+            The cells need to be ordered with the vertical index (theta or z) running fastest.
+
+        Args:
+            i_p (ndarray): Phi index of each cell.
+            i_v (ndarray): Vertical index of each cell (theta or z).
+            phi (ndarray): Phi angle of the midpoint of each cell.
+            n_v (int): Number of cells in vertical direction.
+            mirror (bool): Are the vertical cell borders mirror symmetric to the midplane?
+
+        Returns:
+            tuple: Index of the cell used for each cell, rotation angle around the z-axis
+            and if the cell is mirrored at the midplane (None without symmetry).
+        """
+        mirror = mirror and self.model.mirror_symmetric
+        if not self.model.axisymmetric and not mirror:
+            return None
+        source_p = np.zeros_like(i_p) if self.model.axisymmetric else i_p
+        source_v = np.minimum(i_v, n_v - 1 - i_v) if mirror else i_v
+        source = source_p * n_v + source_v
+        return source, phi - phi[source], source_v != i_v
+
+    def apply_symmetry(self, quantities, source, angles, mirrored):
+        """Copies the quantities of the evaluated cells to all cells.
+
+        Args:
+            quantities (dict): Cell quantities of the evaluated cells (see get_cell_quantities).
+            source (ndarray): Index of the evaluated cell for each cell.
+            angles (ndarray): Rotation angle around the z-axis of each cell.
+            mirrored (ndarray): Is the cell mirrored at the midplane?
+
+        Returns:
+            dict: Cell quantities of all cells.
+        """
+        quantities = {key: None if value is None else np.asarray(value)[source] for key, value in quantities.items()}
+        cos_angles = np.cos(angles)
+        sin_angles = np.sin(angles)
+        for quantity in ['velocity_field', 'magnetic_field']:
+            vector = quantities.get(quantity)
+            if vector is None:
+                continue
+            vector = np.where(mirrored[:, np.newaxis], vector * np.asarray(self.model.mirror_signs[quantity]), vector)
+            # Vector fields rotate with the phi angle around the z-axis
+            quantities[quantity] = np.column_stack((vector[:, 0] * cos_angles - vector[:, 1] * sin_angles,
+                                                    vector[:, 0] * sin_angles + vector[:, 1] * cos_angles,
+                                                    vector[:, 2]))
+        return quantities
+
+    def add_cells(self, cells):
+        """Adds the mass and the region densities of cells that were written to the grid.
+
+        Args:
+            cells (dict): Calculated cells (see calculate_cells).
+        """
+        self.add_mass(cells['gas_mass'], cells['dust_mass'])
+        self.store_region_densities(cells['arrays'])
+
+    def write_cell_data(self, grid_file, positions, volumes, cell_IDs=None, extents=None):
+        """Calculates and writes the data of many cells at once (double precision).
+
+        Args:
+            grid_file: Input grid file (tmp_grid).
+            positions (ndarray): (N, 3) cartesian positions of the cells.
+            volumes (ndarray): (N,) volumes of the cells.
+            cell_IDs (ndarray): (N, 3) indices of the cells (used for external purpose).
+            extents (ndarray): (N, 6) borders of the cells (used for models that are not vectorized).
+        """
+        cells = self.calculate_cells(positions, volumes, cell_IDs, extents)
+        GridWriter(grid_file).write_cell_data(cells['arrays']['data'])
+        self.add_cells(cells)
+
+    def create_cells(self, grid_file, nr_chunks, grid_name):
+        """Calculates and writes the cells chunk by chunk (see get_chunk_cells).
+
+        Args:
+            grid_file: Input grid file (tmp_grid).
+            nr_chunks (int): Number of chunks.
+            grid_name (str): Name of the grid for the progress output.
+        """
+        writer = GridWriter(grid_file)
+        for i_chunk, cells in enumerate(self.calculate_chunks(nr_chunks)):
+            stdout.write('--- Generate ' + grid_name + ' grid: ' +
+                         str(round(100.0 * i_chunk / nr_chunks, 3)) + ' %      \r')
+            stdout.flush()
+            writer.write_cell_data(cells['arrays']['data'])
+            self.add_cells(cells)
+
+    def init_geometry(self, nr_chunks):
+        """Loads the positions and volumes of all cells from the geometry cache
+        or calculates and stores them, if the cache is used.
+
+        Notes:
+            The cache key is the content of the cell borders (see cell_borders),
+            so any set of grid parameters that results in the same cells shares the
+            cache file. If keep_geometry is set, the geometry is also kept in memory
+            for the next grids of the same process.
+
+        Args:
+            nr_chunks (int): Number of chunks.
+        """
+        self.geometry = None
+        if self.geometry_cache is None and not self.keep_geometry:
+            return
+        key = FileCache.get_key(type(self).__name__, self.cell_borders)
+        geometry = Grid.geometry_memory.get(key)
+        if geometry is None and self.geometry_cache is not None:
+            geometry = self.geometry_cache.load_arrays(key)
+        if geometry is None:
+            chunks = [self.get_chunk_cells(i_chunk) for i_chunk in range(nr_chunks)]
+            geometry = {
+                'positions': np.concatenate([chunk[0] for chunk in chunks]),
+                'volumes': np.concatenate([chunk[1] for chunk in chunks]),
+                'offsets': np.cumsum([0] + [len(chunk[1]) for chunk in chunks]),
+            }
+            if self.geometry_cache is not None:
+                self.geometry_cache.save_arrays(key, geometry)
+        if self.keep_geometry:
+            # The most recently used geometry is the last one
+            Grid.geometry_memory.pop(key, None)
+            Grid.geometry_memory[key] = geometry
+            while len(Grid.geometry_memory) > self.geometry_memory_size:
+                del Grid.geometry_memory[next(iter(Grid.geometry_memory))]
+        self.geometry = geometry
+
+    def get_cached_geometry(self, i_chunk):
+        """Positions and volumes of the cells of one chunk from the geometry cache.
+
+        Args:
+            i_chunk (int): Index of the chunk.
+
+        Returns:
+            Positions and volumes of the cells.
+        """
+        cells = slice(self.geometry['offsets'][i_chunk], self.geometry['offsets'][i_chunk + 1])
+        return self.geometry['positions'][cells], self.geometry['volumes'][cells]
+
+    def calculate_chunk(self, i_chunk):
+        """Calculates the cells of one chunk.
+
+        Args:
+            i_chunk (int): Index of the chunk.
+
+        Returns:
+            dict: Calculated cells (see calculate_cells).
+        """
+        return self.calculate_cells(*self.get_chunk_cells(i_chunk))
+
+    def calculate_chunks(self, nr_chunks):
+        """Calculates all chunks in their order in the grid file.
+
+        Notes:
+            With more than one job, the chunks are calculated by a pool of forked
+            processes and their arrays are returned via shared memory. At most two
+            chunks per process are calculated in advance of the consumer of the chunks.
+
+        Args:
+            nr_chunks (int): Number of chunks.
+
+        Returns:
+            Generator: Calculated chunk (see calculate_chunk).
+        """
+        if self.jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            print('HINT: Parallel grid creation needs forked processes, using one process!')
+            self.jobs = 1
+        if self.jobs <= 1 or nr_chunks <= 1:
+            for i_chunk in range(nr_chunks):
+                yield self.calculate_chunk(i_chunk)
+            return
+        nr_processes = min(self.jobs, nr_chunks)
+        with multiprocessing.get_context('fork').Pool(nr_processes, initializer=init_worker,
+                                                      initargs=(self,)) as pool:
+            results = deque()
+            next_chunk = 0
+            try:
+                while next_chunk < nr_chunks or len(results) > 0:
+                    while next_chunk < nr_chunks and len(results) < 2 * nr_processes:
+                        results.append(pool.apply_async(calculate_chunk_in_worker, (next_chunk,)))
+                        next_chunk += 1
+                    chunk = results[0].get()
+                    chunk['arrays'] = receive_arrays(chunk['arrays'])
+                    results.popleft()
+                    yield chunk
+            finally:
+                # Remove the shared memory of the chunks that are not received
+                # (the consumer stopped early or a chunk failed)
+                while len(results) > 0:
+                    try:
+                        discard_arrays(results.popleft().get()['arrays'])
+                    except Exception:
+                        pass
+
+    def create_nodes(self, positions, volumes, extents=None):
+        """Creates the grid nodes that are passed to init_position for models that are not vectorized.
+
+        Args:
+            positions (ndarray): (N, 3) cartesian positions of the cells.
+            volumes (ndarray): (N,) volumes of the cells.
+            extents (ndarray): (N, 6) borders of the cells.
+
+        Returns:
+            NodeStore: Grid nodes (None if the model is vectorized).
+        """
+        if self.data.vectorized:
+            return None
+        columns = {'position': positions, 'volume': volumes}
+        if extents is not None:
+            columns['extent'] = extents
+        return NodeStore(self.model.parameter['grid_type'], columns)
+
+    def get_mass_batch(self, quantities, volumes):
+        """Calculates the gas and dust mass of many cells.
+
+        Args:
+            quantities (dict): Cell quantities (see get_cell_quantities).
+            volumes (ndarray): (N,) volumes of the cells.
+
+        Returns:
+            Gas mass and dust mass (None if no density is defined).
+        """
+        masses = []
+        for quantity, nr_densities in [('gas_density_distribution', self.nr_gas_densities),
+                                       ('dust_density_distribution', self.nr_dust_densities)]:
+            if nr_densities > 0 and quantity in self.quantities:
+                density = quantities[quantity]
+                masses.append(np.sum(np.multiply(density, np.reshape(
+                    volumes, (-1,) + (1,) * (np.ndim(density) - 1))), axis=0))
+            else:
+                masses.append(None)
+        return masses
+
+    def add_mass(self, gas_mass=None, dust_mass=None, remove=False):
+        """Adds gas and dust mass to the total mass.
+
+        Args:
+            gas_mass: Gas mass of each density distribution (and region).
+            dust_mass: Dust mass of each density distribution (and region).
+            remove (bool): Remove the mass instead of adding?
+        """
+        if gas_mass is not None:
             if remove:
-                gas_mass *= -1
+                gas_mass = np.multiply(gas_mass, -1)
             if self.total_gas_mass is None:
                 self.total_gas_mass = gas_mass
             else:
                 self.total_gas_mass += gas_mass
-
-        if self.nr_dust_densities > 0:
-            dust_mass = np.multiply(
-                node.parameter['dust_density'], node.parameter['volume'])
+        if dust_mass is not None:
             if remove:
-                dust_mass *= -1
+                dust_mass = np.multiply(dust_mass, -1)
             if self.total_dust_mass is None:
                 self.total_dust_mass = dust_mass
             else:
                 self.total_dust_mass += dust_mass
 
+    def update_mass_measurement_batch(self, quantities, volumes, remove=False):
+        """Updates the total mass for normalization with many cells at once.
+
+        Notes:
+            The mass of each density distribution (and custom region) is tracked,
+            see get_mass_batch and add_mass.
+
+        Args:
+            quantities (dict): Cell quantities (see get_cell_quantities).
+            volumes (ndarray): (N,) volumes of the cells.
+            remove (bool): Remove the density instead of adding?
+        """
+        gas_mass, dust_mass = self.get_mass_batch(quantities, volumes)
+        self.add_mass(gas_mass, dust_mass, remove)
+
     def check_density_arrays(self):
         """Check if get_density functions provide fitting arrays.
         """
@@ -183,190 +546,350 @@ class Grid:
             GRIDgas_mdens  28
             GRIDdust_mdens 29
         """
-        if grid_type == 'octree':
-            grid_id = 20
-        elif grid_type == 'spherical':
-            grid_id = 30
-        elif grid_type == 'cylindrical':
-            grid_id = 40
-        else:
-            raise ValueError('Grid type: ' + str(grid_type) + 'is not known!')
-
-        grid_file.write(struct.pack('H', grid_id))
-        grid_file.write(struct.pack('H', self.data_length))
-        # Gas density index: 0 or gas mass density index: 28
-        for i_gas_dens in range(self.nr_gas_densities):
-            if num_dens:
-                grid_file.write(struct.pack('H', 0))
-            else:
-                grid_file.write(struct.pack('H', 28))
-        # Dust density index: 1 or dust mass density index: 29
-        for i_dust_dens in range(self.nr_dust_densities):
-            if num_dens:
-                grid_file.write(struct.pack('H', 1))
-            else:
-                grid_file.write(struct.pack('H', 29))
-        if self.data.get_dust_temperature() is not None:
-            # Dust temperature index: 2
-            grid_file.write(struct.pack('H', 2))
-        if self.data.get_gas_temperature() is not None:
-            # Gas temperature index: 3
-            grid_file.write(struct.pack('H', 3))
-        if self.data.get_magnetic_field() is not None:
-            # Magnetic field x-component index: 4
-            grid_file.write(struct.pack('H', 4))
-            # Magnetic field y-component index: 5
-            grid_file.write(struct.pack('H', 5))
-            # Magnetic field z-component index: 6
-            grid_file.write(struct.pack('H', 6))
-        if self.data.get_velocity_field() is not None:
-            # Velocity field x-component index: 7
-            grid_file.write(struct.pack('H', 7))
-            # Velocity field y-component index: 8
-            grid_file.write(struct.pack('H', 8))
-            # Velocity field z-component index: 9
-            grid_file.write(struct.pack('H', 9))
-        # Add an index for the dust choice in a certain cell
-        if self.data.get_dust_id() is not None:
-            # Dust choice index: 21
-            grid_file.write(struct.pack('H', 21))
-        if self.data.dust_min_size() is not None:
-            # Minimum dust grain size: 14
-            grid_file.write(struct.pack('H', 14))
-        if self.data.dust_max_size() is not None:
-            # Maximum dust grain size: 15
-            grid_file.write(struct.pack('H', 15))
-        if self.data.dust_size_param() is not None:
-            # Size distribution parameter: 16
-            grid_file.write(struct.pack('H', 16))
+        writer = GridWriter(grid_file)
+        writer.write_general_header(grid_type, self.get_quantity_ids(num_dens))
         if grid_type == 'octree':
             if root is not None:
-                grid_file.write(struct.pack(
-                    'd', self.model.octree_parameter['sidelength']))
-                grid_file.write(struct.pack('H', root.parameter['is_leaf']))
-                grid_file.write(struct.pack('H', root.parameter['level']))
+                writer.write_octree_header(self.model.octree_parameter['sidelength'],
+                                           root.parameter['is_leaf'], root.parameter['level'])
             else:
                 raise ValueError(
                     'root node has to be defined for writing the grid header!')
 
-    def write_node_data(self, grid_file, node, data_type='f', cell_IDs=None, rewrite=False):
-        """Write data of each node.
+    #: dict: Quantity IDs of the data columns of each model accessor besides the densities
+    accessor_ids = {
+        # Dust temperature index: 2
+        'dust_temperature': [2],
+        # Gas temperature index: 3
+        'gas_temperature': [3],
+        # Magnetic field x, y, z-component index: 4, 5, 6
+        'magnetic_field': [4, 5, 6],
+        # Velocity field x, y, z-component index: 7, 8, 9
+        'velocity_field': [7, 8, 9],
+        # Dust choice index: 21
+        'dust_id': [21],
+        # Minimum dust grain size: 14
+        'dust_min_size': [14],
+        # Maximum dust grain size: 15
+        'dust_max_size': [15],
+        # Size distribution parameter: 16
+        'dust_size_param': [16],
+    }
+
+    def get_quantity_ids(self, num_dens=False):
+        """Quantity IDs of the data columns in the grid header (see write_header).
 
         Args:
-            grid_file: Input grid file (tmp_grid).
-            node: Instance of octree node.
-            data_type (str): Type of the node data ('f': float or 'd': double).
-            cell_IDs (List): indices of the cells (used for external purpose).
-                Spherical -> [i_r, i_t, i_p]
-                Cylindrical -> [i_r, i_p, i_z]
-            rewrite (bool): Remove the the last cell data to overwrite it.
+            num_dens (bool): Interpret given gas or dust distribution as number density.
+
+        Returns:
+            List: ID of each data column.
+        """
+        quantity_ids = []
+        # Gas density index: 0 or gas mass density index: 28
+        quantity_ids += [0 if num_dens else 28] * self.nr_gas_densities
+        # Dust density index: 1 or dust mass density index: 29
+        quantity_ids += [1 if num_dens else 29] * self.nr_dust_densities
+        for quantity in self.quantities:
+            if quantity in self.accessor_ids.keys():
+                quantity_ids += self.accessor_ids[quantity]
+        return quantity_ids
+
+    def store_region_densities(self, quantities):
+        """Keeps the raw densities of each region to normalize them individually.
+
+        Args:
+            quantities (dict): Cell quantities (see get_cell_quantities).
+        """
+        for quantity in self.region_densities.keys():
+            self.region_densities[quantity].append(np.asarray(quantities[quantity], dtype=float))
+
+    def get_density_normalization(self):
+        """Calculates how the density columns are normalized to the total model mass.
+
+        Notes:
+            If gas_mass is a float, the gas (dust) densities are scaled by the ratio of
+            the model mass and the total mass in the grid. Otherwise, each region is scaled
+            individually (see relative_gas_densities) and the density columns of
+            distributions with multiple regions are recalculated from the region densities.
+
+        Returns:
+            ndarray: Factor of each density column.
+            dict: Relative density of each region for the quantities in region_densities.
+        """
+        nr_densities = self.nr_gas_densities + self.nr_dust_densities
+        scale_factors = np.ones(nr_densities)
+        relative_densities = {}
+        i_gas = slice(0, self.nr_gas_densities)
+        i_dust = slice(self.nr_gas_densities, nr_densities)
+        if isinstance(self.model.parameter['gas_mass'], float):
+            if self.nr_gas_densities > 0:
+                scale_factors[i_gas] = 0.
+                if np.sum(self.total_gas_mass) > 0.:
+                    scale_factors[i_gas] = np.sum(self.model.parameter['gas_mass']) / np.sum(self.total_gas_mass)
+                self.total_gas_mass = np.multiply(self.total_gas_mass, scale_factors[0])
+            if self.nr_dust_densities > 0:
+                scale_factors[i_dust] = 0.
+                if np.sum(self.total_dust_mass) > 0.:
+                    scale_factors[i_dust] = np.sum(self.model.parameter['dust_mass']) / np.sum(self.total_dust_mass)
+                self.total_dust_mass = np.multiply(self.total_dust_mass, scale_factors[-1])
+            return scale_factors, relative_densities
+
+        for name, columns in [('gas', i_gas), ('dust', i_dust)]:
+            mass = self.model.parameter[name + '_mass']
+            total_mass = getattr(self, 'total_' + name + '_mass')
+            if mass is None or total_mass is None:
+                continue
+            # Update the relation between the regions in the grid
+            tmp_mass = np.subtract(total_mass, self.model.tmp_parameter['ignored_' + name + '_density'])
+            relative_density = np.divide(mass, tmp_mass, out=np.zeros_like(mass, dtype=float),
+                                         where=tmp_mass != 0)
+            self.model.tmp_parameter['relative_' + name + '_densities'] = relative_density
+            setattr(self, 'total_' + name + '_mass', np.multiply(total_mass, relative_density))
+            if name + '_density_distribution' in self.region_densities.keys():
+                relative_densities[name + '_density_distribution'] = relative_density
+            else:
+                scale_factors[columns] = relative_density
+        return scale_factors, relative_densities
+
+    def get_normalized_densities(self, density_data, rows, scale_factors, relative_densities):
+        """Normalizes the density columns of many cells.
+
+        Args:
+            density_data (ndarray): (N, nr_densities) densities written to the grid.
+            rows: Indices (or slice) of the cells in the order of their calculation.
+            scale_factors (ndarray): Factor of each density column.
+            relative_densities (dict): Relative density of each region.
+
+        Returns:
+            ndarray: (N, nr_densities) normalized densities.
+        """
+        density_data = density_data * scale_factors
+        for quantity, relative_density in relative_densities.items():
+            region_density = np.multiply(self.region_densities[quantity][rows], relative_density)
+            i_column = 0 if quantity == 'gas_density_distribution' else self.nr_gas_densities
+            density_data[:, i_column:i_column + region_density.shape[1]] = np.sum(
+                region_density, axis=tuple(range(2, region_density.ndim)))
+        return density_data
+
+    def normalize_density(self, grid_filename, chunk_size=1048576):
+        """Normalize the density of the written grid to the total model mass.
+
+        Notes:
+            The density columns are updated in place via a memory map of the cell data.
+
+        Args:
+            grid_filename (str): Path to the grid file written by create_grid.
+            chunk_size (int): Number of cells that are normalized at once.
         """
-        # Set data type length in bytes depending on the data type
-        if data_type == 'f':
-            data_type_length = 4
-        elif data_type == 'd':
-            data_type_length = 8
+        scale_factors, relative_densities = self.get_density_normalization()
+        for quantity in relative_densities.keys():
+            self.region_densities[quantity] = np.concatenate(self.region_densities[quantity])
+        nr_densities = self.nr_gas_densities + self.nr_dust_densities
+        cell_data = np.memmap(grid_filename, dtype=np.float64, mode='r+', offset=self.data_offset)
+        cell_data = cell_data.reshape(-1, self.data_length)
+        for i_cell in range(0, len(cell_data), chunk_size):
+            rows = slice(i_cell, i_cell + chunk_size)
+            cell_data[rows, :nr_densities] = self.get_normalized_densities(
+                cell_data[rows, :nr_densities], rows, scale_factors, relative_densities)
+        cell_data.flush()
+        del cell_data
+
+    def patch_quantity(self, grid_filename, quantity, chunk_size=1048576):
+        """Calculates one quantity of the model in the cells of an existing grid and
+        overwrites its data columns (or appends them, if the grid does not contain them).
+
+        Notes:
+            The cells are reconstructed from the header of the grid file and only the
+            accessor of the quantity is evaluated. Existing columns are overwritten in
+            place via a memory map, new columns are added by rewriting the grid file
+            chunk by chunk (see GridFile.append_columns).
+
+        Args:
+            grid_filename (str): Path to the existing grid file.
+            quantity (str): Model accessor without 'get_' (see accessor_ids).
+            chunk_size (int): Number of octree leaves that are calculated at once.
+
+        Returns:
+            bool: True if the columns were appended to the grid file.
+        """
+        if quantity not in self.accessor_ids.keys():
+            raise ValueError('The quantity ' + str(quantity) + ' cannot be patched!')
+        if quantity not in self.quantities:
+            raise ValueError('The model does not define the quantity ' + str(quantity) + '!')
+        # Only the patched quantity is calculated (without densities, masses and regions)
+        self.quantities = [quantity]
+        self.region_densities = {}
+
+        grid_file = self.open_grid_file(grid_filename, mode='r+')
+        quantity_ids = self.accessor_ids[quantity]
+        nr_existing = np.sum(np.isin(quantity_ids, grid_file.quantity_ids))
+        if 0 < nr_existing < len(quantity_ids):
+            raise ValueError('The grid file ' + grid_filename + ' contains only a part of the columns of ' +
+                             quantity + '!')
+        column_chunks = self.calculate_patch_chunks(grid_file, chunk_size)
+        if nr_existing == 0:
+            grid_file.append_columns(quantity_ids, column_chunks)
         else:
-            raise ValueError(
-                'Do not understand the data type ' + data_type + ' in grid.py!')
+            columns = [grid_file.get_columns(quantity_id)[0] for quantity_id in quantity_ids]
+            i_cell = 0
+            for column_data in column_chunks:
+                grid_file.set_data(column_data, slice(i_cell, i_cell + len(column_data)), columns)
+                i_cell += len(column_data)
+            grid_file.data.flush()
+        del grid_file
+        return nr_existing == 0
+
+    def open_grid_file(self, grid_filename, mode='r'):
+        """Opens an existing grid file of this grid type.
 
-        if rewrite:
-            grid_file.seek(-(self.data_length * data_type_length), 1)
+        Args:
+            grid_filename (str): Path to the grid file.
+            mode (str): Mode of the memory map ('r': read only, 'r+': modify the cell data).
 
-        # Transmit the cell position to the model to obtain the cell quantities
-        self.data.init_position(node, cell_IDs)
+        Returns:
+            GridFile: Opened grid file.
+        """
+        return GridFile(grid_filename, mode)
 
-        # Write gas density to grid for each defined distribution
-        if self.nr_gas_densities > 0:
-            node.parameter['gas_density'] = self.data.get_gas_density_distribution()
-            for i_gas_dens in range(self.nr_gas_densities):
-                if isinstance(node.parameter['gas_density'], (float, int)):
-                    grid_file.write(struct.pack(
-                        data_type, node.parameter['gas_density']))
-                else:
-                    grid_file.write(struct.pack(data_type, np.sum(
-                        node.parameter['gas_density'][i_gas_dens])))
-        # Write dust density to grid for each defined distribution
-        if self.nr_dust_densities > 0:
-            node.parameter['dust_density'] = self.data.get_dust_density_distribution()
-            for i_dust_dens in range(self.nr_dust_densities):
-                if isinstance(node.parameter['dust_density'], (float, int)):
-                    grid_file.write(struct.pack(
-                        data_type, node.parameter['dust_density']))
+    def calculate_patch_chunks(self, grid_file, chunk_size=None):
+        """Calculates the data of the cells of an existing grid chunk by chunk.
+
+        Args:
+            grid_file (GridFile): Existing grid file.
+            chunk_size (int): Not used, the cells are calculated per radial ring or shell.
+
+        Returns:
+            Generator: (N, data_length) data of consecutive cells in the order of the grid file.
+        """
+        self.read_cell_borders(grid_file)
+        nr_chunks = len(self.cell_borders['radius_list'])
+        self.init_geometry(nr_chunks)
+        for i_chunk, cells in enumerate(self.calculate_chunks(nr_chunks)):
+            stdout.write('--- Patch ' + grid_file.parameter['grid_type'] + ' grid: ' +
+                         str(round(100.0 * i_chunk / nr_chunks, 3)) + ' %      \r')
+            stdout.flush()
+            yield cells['arrays']['data']
+
+    def get_grid_index(self, grid_filename):
+        """Opens an existing grid file with an index to find the cells of many positions.
+
+        Notes:
+            The cell borders are calculated from the header of the grid file in the
+            same way as for the grid creation (see read_cell_borders).
+
+        Args:
+            grid_filename (str): Path to the grid file.
+
+        Returns:
+            GridIndex: Index of the grid file (see GridIndex.query).
+        """
+        grid_file = self.open_grid_file(grid_filename)
+        self.read_cell_borders(grid_file)
+        if grid_file.parameter['grid_type'] == 'spherical':
+            return SphericalIndex(grid_file, self.cell_borders)
+        return CylindricalIndex(grid_file, self.cell_borders)
+
+    #: int: Number of sample cells per grid cell in each optimized direction (see optimize_cell_borders)
+    border_sampling = 8
+    #: int: Number of phi samples of models that are not axisymmetric (see optimize_cell_borders)
+    border_phi_samples = 16
+    #: float: Part of the cells that are distributed with the spacing of the samples (see get_adaptive_borders)
+    border_uniform_weight = 0.1
+
+    def sample_border_weights(self, radius_list, vertical_list, phi_list, chunk_size=1048576):
+        """Calculates the mass or the optical depth of fine sample cells summed up per
+        radial and per vertical sample.
+
+        Notes:
+            The optical depth increment of a sample is its density times its path length
+            in the radial (or vertical) direction, averaged over the other directions
+            weighted by the volume. The opacity is assumed to be constant.
+
+        Args:
+            radius_list (ndarray): Radial borders of the samples.
+            vertical_list (ndarray): Vertical borders of the samples (theta or z).
+            phi_list (ndarray): Phi borders of the samples.
+            chunk_size (int): Maximum number of samples that are calculated at once.
+
+        Returns:
+            Weight of each radial and each vertical sample.
+        """
+        n_r, n_v = len(radius_list) - 1, len(vertical_list) - 1
+        i_v, i_p = [i.ravel() for i in np.meshgrid(np.arange(n_v), np.arange(len(phi_list) - 1), indexing='ij')]
+        weights = [np.zeros(n_r), np.zeros(n_v)]
+        volume_sums = [np.zeros(n_r), np.zeros(n_v)]
+        nr_shells = max(1, chunk_size // len(i_v))
+        for i_start in range(0, n_r, nr_shells):
+            i_r = np.repeat(np.arange(i_start, min(i_start + nr_shells, n_r)), len(i_v))
+            i_shell = (np.tile(i_v, len(i_r) // len(i_v)), np.tile(i_p, len(i_r) // len(i_v)))
+            positions, volumes, extents, vertical_paths = self.get_sample_cells(
+                radius_list, vertical_list, phi_list, i_r, *i_shell)
+            density = self.get_border_density(positions, volumes, extents)
+            for i_axis, (index, path) in enumerate([(i_r, extents[:, 1] - extents[:, 0]), (i_shell[0], vertical_paths)]):
+                if self.border_optimization == 'mass':
+                    weights[i_axis] += np.bincount(index, density * volumes, len(weights[i_axis]))
                 else:
-                    grid_file.write(struct.pack(data_type, np.sum(
-                        node.parameter['dust_density'][i_dust_dens])))
-
-        # Set additional quantities
-        dust_temperature = self.data.get_dust_temperature()
-        if dust_temperature is not None:
-            grid_file.write(struct.pack(
-                data_type, dust_temperature))
-        gas_temperature = self.data.get_gas_temperature()
-        if gas_temperature is not None:
-            grid_file.write(struct.pack(
-                data_type, gas_temperature))
-
-        mag_field = self.data.get_magnetic_field()
-        if mag_field is not None:
-            grid_file.write(struct.pack(data_type, mag_field[0]))
-            grid_file.write(struct.pack(data_type, mag_field[1]))
-            grid_file.write(struct.pack(data_type, mag_field[2]))
-        velocity = self.data.get_velocity_field()
-        if velocity is not None:
-            grid_file.write(struct.pack(data_type, velocity[0]))
-            grid_file.write(struct.pack(data_type, velocity[1]))
-            grid_file.write(struct.pack(data_type, velocity[2]))
-
-        dust_id = self.data.get_dust_id()
-        if dust_id is not None:
-            grid_file.write(struct.pack(data_type, dust_id))
-        a_min = self.data.get_dust_min_size()
-        if a_min is not None:
-            grid_file.write(struct.pack(data_type, a_min))
-        a_max = self.data.get_dust_max_size()
-        if a_max is not None:
-            grid_file.write(struct.pack(data_type, a_max))
-        size_param = self.data.get_dust_size_param()
-        if size_param is not None:
-            grid_file.write(struct.pack(data_type, size_param))
-
-    def read_write_node_data(self, tmp_file, grid_file, data_type='f'):
-        """Read node data to binary grid_file.
+                    weights[i_axis] += np.bincount(index, density * path * volumes, len(weights[i_axis]))
+                    volume_sums[i_axis] += np.bincount(index, volumes, len(weights[i_axis]))
+        if self.border_optimization != 'mass':
+            weights = [weight / np.maximum(volume_sum, np.finfo(float).tiny)
+                       for weight, volume_sum in zip(weights, volume_sums)]
+        return weights
+
+    def get_border_density(self, positions, volumes, extents):
+        """Density of the sample cells used to optimize the cell borders.
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
-            data_type (str): Type of the node data ('f': float or 'd': double).
-        """
-        # Set data type length in bytes depending on the data type
-        if data_type == 'f':
-            data_type_length = 4
-        elif data_type == 'd':
-            data_type_length = 8
+            positions (ndarray): (N, 3) cartesian positions of the samples.
+            volumes (ndarray): (N,) volumes of the samples.
+            extents (ndarray): (N, 6) borders of the samples (used for models that are not vectorized).
+
+        Returns:
+            ndarray: Sum of all density distributions (dust density for the optical depth, if defined).
+        """
+        if self.border_optimization == 'tau' and self.nr_dust_densities > 0 or self.nr_gas_densities == 0:
+            quantity = 'dust_density_distribution'
         else:
-            raise ValueError(
-                'Do not understand the data type ' + data_type + ' in grid.py!')
-
-        # Calculate normalized density
-        for i_gas_dens in range(self.nr_gas_densities):
-            gas_density = tmp_file.read(data_type_length)
-            normed_gas_density = 0.
-            if isinstance(np.sum(self.total_gas_mass), (float, int)) and np.sum(self.total_gas_mass) > 0.:
-                normed_gas_density = struct.unpack(data_type, gas_density)[0] * \
-                    (np.sum(
-                        self.model.parameter['gas_mass']) / np.sum(self.total_gas_mass))
-            grid_file.write(struct.pack(data_type, normed_gas_density))
-        for i_dust_dens in range(self.nr_dust_densities):
-            dust_density = tmp_file.read(data_type_length)
-            normed_dust_density = 0.
-            if isinstance(np.sum(self.total_dust_mass), (float, int)) and np.sum(self.total_dust_mass) > 0.:
-                normed_dust_density = struct.unpack(data_type, dust_density)[0] * \
-                    (np.sum(
-                        self.model.parameter['dust_mass']) / np.sum(self.total_dust_mass))
-            grid_file.write(struct.pack(data_type, normed_dust_density))
-        for i in range(self.data_length - self.nr_gas_densities - self.nr_dust_densities):
-            grid_file.write(tmp_file.read(data_type_length))
+            quantity = 'gas_density_distribution'
+        if quantity not in self.quantities:
+            raise ValueError('The cell borders can only be optimized for models with a density distribution!')
+        density = self.data.get_batch_data([quantity], positions, volumes,
+                                           nodes=self.create_nodes(positions, volumes, extents))[quantity]
+        density = np.asarray(density, dtype=float)
+        return np.sum(density.reshape(len(density), -1), axis=1)
+
+    @classmethod
+    def get_adaptive_borders(cls, sample_list, weights, nr_cells, mirror=False):
+        """Places cell borders so that each cell contains the same part of the weights.
+
+        Notes:
+            A part of the cells (border_uniform_weight) is distributed like the samples,
+            so that regions without mass still get cells and no cell becomes arbitrarily large.
+
+        Args:
+            sample_list (ndarray): Borders of the samples.
+            weights (ndarray): Weight of each sample.
+            nr_cells (int): Number of cells.
+            mirror (bool): Make the borders mirror symmetric to the center of the sample list.
+
+        Returns:
+            ndarray: Cell borders (with the first and last sample border).
+        """
+        weights = np.asarray(weights, dtype=float)
+        if mirror:
+            weights = (weights + weights[::-1]) / 2.
+        cumulative = np.concatenate(([0.], np.cumsum(weights)))
+        uniform = np.linspace(0., 1., len(sample_list))
+        if cumulative[-1] > 0:
+            uniform = (1. - cls.border_uniform_weight) * cumulative / cumulative[-1] + \
+                cls.border_uniform_weight * uniform
+        borders = np.interp(np.linspace(0., 1., nr_cells + 1), uniform, sample_list)
+        if mirror:
+            borders = (borders + sample_list[0] + sample_list[-1] - borders[::-1]) / 2.
+        borders[0] = sample_list[0]
+        borders[-1] = sample_list[-1]
+        return borders
 
 
 class OcTree(Grid):
@@ -399,167 +922,406 @@ class OcTree(Grid):
         root.parameter['sidelength'] = self.model.octree_parameter['sidelength']
         # Set node volume
         root.parameter['volume'] = self.get_volume(node=root)
+        # The root node is a leaf, if it will not be refined
+        root.parameter['is_leaf'] = self.model.octree_parameter['max_tree_level'] == 0 or \
+            self.model.ignore_cell(root)
         return root
 
-    @staticmethod
-    def write_node_header(grid_file, node, rewrite=False):
-        """Write header of each node.
+    def create_grid(self, grid_file, node, max_tree_level=None, refinement_limit=None):
+        """Create an octree grid level by level and calculate the total mass of the grid nodes.
+
+        Notes:
+            The children of all refined nodes of one level are calculated at once.
+            Below the second level, the subtree of each node is calculated as one chunk
+            (in parallel with more than one job) and merged in the order of the nodes.
+            After the refinement is finished, the tree is written in one pass
+            (depth-first order with is_leaf and level in front of each node).
 
         Args:
             grid_file: Input grid file (tmp_grid).
-            node: Instance of octree node.
-            rewrite (bool): Remove the last 4 bytes to rewrite the header.
+            node: Root node of the octree grid.
+            max_tree_level (int): Maximum number of grid levels.
+            refinement_limit (float): maximum of the relative density difference between
+                the 8 children nodes and the parent node (see grid_refinement).
         """
-        if rewrite:
-            grid_file.seek(-4, 1)
-        grid_file.write(struct.pack('H', node.parameter['is_leaf']))
-        grid_file.write(struct.pack('H', node.parameter['level']))
+        # Set max tree level from user input.
+        if max_tree_level is None:
+            max_tree_level = self.model.octree_parameter['max_tree_level']
+        if max_tree_level > 21:
+            raise ValueError('Octree grids with more than 21 levels are not supported!')
+        if refinement_limit is None:
+            refinement_limit = self.model.octree_parameter['refinement_limit']
+        if self.model.octree_parameter['max_optical_depth'] is not None and \
+                self.model.octree_parameter['opacity'] is None:
+            raise ValueError('The optical depth criterion of the octree refinement needs the opacity!')
+
+        #: dict: Parameters of the refinement (used by each chunk)
+        self.refinement = {
+            'max_tree_level': max_tree_level,
+            'refinement_limit': refinement_limit,
+            'max_cell_mass': self.model.octree_parameter['max_cell_mass'],
+            'max_optical_depth': self.model.octree_parameter['max_optical_depth'],
+            'opacity': self.model.octree_parameter['opacity'],
+            'gradient_limit': self.model.octree_parameter['gradient_limit'],
+            'sidelength': node.parameter['sidelength'],
+            'volume': node.parameter['volume'],
+        }
+        if self.refinement['max_cell_mass'] is not None or self.refinement['max_optical_depth'] is not None:
+            self.refinement['density_scale'] = self.estimate_density_scale()
+
+        # Nodes of the current level starting with the root node
+        positions = np.array([node.parameter['position']], dtype=float)
+        nodes = {
+            'positions': positions,
+            'index': np.zeros(1, dtype=int),
+            'parent': np.full(1, -1),
+            'quantities': self.get_octree_quantities(positions, 0, np.zeros(1, dtype=int),
+                                                     node.parameter['sidelength'], node.parameter['volume']),
+            'refine': np.array([not node.parameter['is_leaf']]),
+        }
 
-    def create_grid(self, grid_file, node, max_tree_level=None, refinement_limit=0.1):
-        """Create an octree grid and calculate the total mass of the grid nodes.
+        #: int: Level at which the octree is split into subtrees (see max_chunk_depth)
+        self.split_level = max(OcTree.split_level, self.refinement['max_tree_level'] + 1 - self.max_chunk_depth)
+        #: ndarray: Number of nodes, leaves and merged nodes of each level
+        self.level_counts = np.zeros((self.refinement['max_tree_level'] + 1, 3), dtype=np.int64)
+
+        #: List: Nodes (parent, index, is_leaf), leaf data and leaf mass of each level
+        tree, nodes = self.refine_levels(nodes, 0, self.split_level)
+        self.add_mass(*self.get_tree_mass(tree))
+        self.count_levels(tree, 0)
+        #: dict: Nodes of the split level (each subtree is calculated as one chunk)
+        self.chunk_nodes = nodes
+        self.write_tree(grid_file, tree, self.get_chunk_trees(len(nodes['positions'])))
+        self.chunk_nodes = None
+        self.print_refinement()
+
+    def print_refinement(self):
+        """Prints the number of nodes, leaves and merged nodes of each level (see count_levels).
+        """
+        print('--- Octree refinement (level: nodes, leaves, merged nodes):      ')
+        for level, counts in enumerate(self.level_counts[self.level_counts[:, 0] > 0]):
+            print('    ' + str(level) + ': ' + ', '.join(str(count) for count in counts))
+
+    def count_levels(self, tree, first_level):
+        """Adds the number of nodes, leaves and merged nodes of each level of a (sub)tree.
 
         Args:
-            grid_file: Input grid file (tmp_grid).
-            node: Instance of grid node.
-            max_tree_level (int): Maximum number of grid levels.
-            refinement_limit (float): maximum of the density difference between the 8
-                children nodes and the parent node.
+            tree (List): Nodes of each level (see refine_levels).
+            first_level (int): Level of the first nodes.
         """
-        # Set max tree level from user input.
-        max_tree_level = self.model.octree_parameter['max_tree_level']
-        # Show percentage based on the second and third grid level
-        tmp_node = node
-        while tmp_node.parameter['level'] > 2:
-            tmp_node = tmp_node.parent
-        percentage_count = 0
-        if tmp_node.parameter['level'] == 2:
-            percentage_count = tmp_node.parameter['index'] + \
-                tmp_node.parent.parameter['index'] * 8
-        elif tmp_node.parameter['level'] == 1:
-            percentage_count = tmp_node.parameter['index'] * 8
-        stdout.write('--- Generate cartesian grid: ' +
-                     str(int(100 * percentage_count / (8 * 8 - 1))) + ' %      \r')
-        stdout.flush()
-        if node.parameter['level'] < max_tree_level and not self.model.ignore_cell(node):
-            # Add 8 children to node
-            self.add_level(node=node)
-            for i_leaf in range(8):
-                # Refer to current children node
-                node = node.children[i_leaf]
-                # Write the header of the node
-                self.write_node_header(grid_file=grid_file, node=node)
-                # Recursive execute this function to add another 8 children to node
-                self.create_grid(grid_file=grid_file, node=node, max_tree_level=max_tree_level,
-                                 refinement_limit=refinement_limit)
-                # Go to parent node
-                node = node.parent
-                if i_leaf == 7:
-                    # Calculate a difference between various quantities to do grid refinement
-                    difference = self.grid_refinement(node=node)
-                    if difference < refinement_limit and node.parameter['level'] > 3:
-                        # If the difference is small enough and the level larger than 3,
-                        # delete the children and use the parent node only.
-                        for j_leaf in range(8):
-                            # Subtract the children mass from total mass
-                            self.remove_node_from_grid(
-                                grid_file=grid_file, node=node.children[j_leaf])
-                        # Parent node is now a leaf
-                        node.parameter['is_leaf'] = True
-                        # Rewrite the header of the parent node
-                        self.write_node_header(
-                            grid_file=grid_file, node=node, rewrite=True)
-                        # Write data of the parent node
-                        self.write_node_data(grid_file=grid_file, node=node)
-                        # Add the mass of the parent node to the total mass
-                        self.update_mass_measurement(node=node)
-        else:
-            # Initialize and write a leaf node including data
-            node.parameter['is_leaf'] = True
-            # Rewrite the node header to include is_leaf = True
-            self.write_node_header(grid_file=grid_file,
-                                   node=node, rewrite=True)
-            # Write data of the node
-            self.write_node_data(grid_file=grid_file, node=node)
-            # Add the mass of the node to the total mass
-            self.update_mass_measurement(node=node)
+        for level, nodes in enumerate(tree, first_level):
+            self.level_counts[level] += [len(nodes['index']), np.sum(nodes['is_leaf']), np.sum(nodes['merged'])]
+
+    #: int: Minimum level at which the octree is split into subtrees (see create_grid)
+    split_level = 2
+    #: int: Maximum number of levels of each subtree (limits the memory needed for one chunk)
+    max_chunk_depth = 7
+
+    def refine_levels(self, nodes, first_level, last_level=None):
+        """Refines the nodes of one level and their children level by level.
+
+        Args:
+            nodes (dict): Positions, index, parent, quantities and refine flag of the nodes.
+            first_level (int): Level of the nodes.
+            last_level (int): Level at which the refinement stops (max_tree_level + 1 if None).
+
+        Returns:
+            List of the nodes (parent, index, is_leaf), leaf data and leaf mass of each level
+            and the nodes of the last level (see nodes).
+        """
+        max_tree_level = self.refinement['max_tree_level']
+        if last_level is None:
+            last_level = max_tree_level + 1
+
+        #: Offset direction of the 8 children nodes (index from 0 to 7)
+        child_offsets = np.array([[-1., -1., -1.], [1., -1., -1.], [-1., 1., -1.], [1., 1., -1.],
+                                  [-1., -1., 1.], [1., -1., 1.], [-1., 1., 1.], [1., 1., 1.]])
+
+        positions = nodes['positions']
+        index = nodes['index']
+        parent = nodes['parent']
+        quantities = nodes['quantities']
+        refine = np.array(nodes['refine'])
+
+        tree = []
+        for level in range(first_level, last_level):
+            if len(positions) == 0:
+                break
+            if first_level == 0:
+                stdout.write('--- Generate cartesian grid: level ' + str(level) + ' of ' +
+                             str(max_tree_level) + ' (' + str(len(positions)) + ' nodes)      \r')
+                stdout.flush()
+            #: float: Width, volume of each node in this level
+            sidelength = self.refinement['sidelength'] / 2 ** level
+            volume = self.refinement['volume'] / 8 ** level
+            if level == max_tree_level:
+                refine[:] = False
+            elif level > 0 and self.ignore_cells_defined():
+                refine &= np.logical_not([self.model.ignore_cell(tmp_node) for tmp_node in self.create_octree_nodes(
+                    positions, level, index, sidelength, volume)])
+
+            # Add 8 children to each refined node
+            refined = np.flatnonzero(refine)
+            child_positions = np.reshape(positions[refined, np.newaxis, :] +
+                                         child_offsets * (sidelength / 4.), (-1, 3))
+            child_index = np.tile(np.arange(8), len(refined))
+            child_quantities = self.get_octree_quantities(child_positions, level + 1, child_index,
+                                                          sidelength / 2., volume / 8.)
+            nr_merged = 0
+            if level > 3 and len(refined) > 0:
+                # Calculate a difference between various quantities to do grid refinement
+                difference = self.grid_refinement(
+                    {key: None if value is None else value[refined] for key, value in quantities.items()},
+                    child_quantities, sidelength, volume)
+                # If the difference is small enough and the level larger than 3,
+                # use the parent node only instead of the children.
+                merged = difference < 1.
+                nr_merged = int(np.sum(merged))
+                refine[refined[merged]] = False
+                kept = np.repeat(np.logical_not(merged), 8)
+                child_positions = child_positions[kept]
+                child_index = child_index[kept]
+                child_quantities = {key: None if value is None else value[kept]
+                                    for key, value in child_quantities.items()}
+                refined = refined[np.logical_not(merged)]
+
+            # Nodes that are not refined are leaves with data
+            is_leaf = np.logical_not(refine)
+            leaf_quantities = {key: None if value is None else value[is_leaf] for key, value in quantities.items()}
+            gas_mass, dust_mass = self.get_mass_batch(leaf_quantities, np.full(np.sum(is_leaf), volume))
+            tree.append({'parent': parent, 'index': index, 'is_leaf': is_leaf,
+                         'data': self.get_cell_data(leaf_quantities).astype(np.float32),
+                         'gas_mass': gas_mass, 'dust_mass': dust_mass, 'merged': np.array([nr_merged])})
+            for quantity in self.region_densities.keys():
+                tree[-1][quantity] = np.asarray(leaf_quantities[quantity], dtype=float)
+
+            # Go to the next level
+            positions = child_positions
+            index = child_index
+            parent = np.repeat(refined, 8)
+            quantities = child_quantities
+            refine = np.ones(len(positions), dtype=bool)
+
+        return tree, {'positions': positions, 'index': index, 'parent': parent,
+                      'quantities': quantities, 'refine': refine}
+
+    def get_chunk_cells(self, i_chunk):
+        """Selects the node of the split level that is the root of a subtree.
+
+        Args:
+            i_chunk (int): Index of the node in the split level.
+
+        Returns:
+            dict: Nodes for refine_levels.
+        """
+        return {key: {quantity: None if value is None else value[i_chunk:i_chunk + 1]
+                      for quantity, value in nodes.items()} if key == 'quantities' else nodes[i_chunk:i_chunk + 1]
+                for key, nodes in self.chunk_nodes.items()}
+
+    def calculate_chunk(self, i_chunk):
+        """Refines the subtree of one node of the split level.
+
+        Args:
+            i_chunk (int): Index of the node in the split level.
+
+        Returns:
+            dict: Arrays of each level of the subtree (keys are level and name)
+            and the gas and dust mass of its leaves.
+        """
+        tree, _ = self.refine_levels(self.get_chunk_cells(i_chunk), self.split_level)
+        gas_mass, dust_mass = self.get_tree_mass(tree)
+        return {'arrays': {(level, key): value for level, nodes in enumerate(tree)
+                           for key, value in nodes.items() if key not in ['gas_mass', 'dust_mass']},
+                'gas_mass': gas_mass, 'dust_mass': dust_mass}
 
     @staticmethod
-    def add_level(node):
-        """Add 8 children nodes to an octree node.
+    def get_chunk_tree(arrays):
+        """Converts the arrays of a calculated chunk back into a list of levels.
 
         Args:
-            node: Instance of octree node.
+            arrays (dict): Arrays of each level (see calculate_chunk).
+
+        Returns:
+            List: Nodes of each level of the subtree.
         """
-        #: float: Distance to a children node on the x-axis
-        d_x = node.parameter['sidelength'] / 4.
-        #: float: Distance to a children node on the y-axis
-        d_y = node.parameter['sidelength'] / 4.
-        #: float: Distance to a children node on the z-axis
-        d_z = node.parameter['sidelength'] / 4.
-        #: Node is not a leaf anymore
-        node.parameter['is_leaf'] = False
-        for i_leaf in range(8):
-            # Each children is a new node
-            node.children[i_leaf] = Node('octree')
-            # Calculate the position of the children nodes
-            position = [0., 0., 0.]
-            if i_leaf == 0:
-                position = np.add(
-                    node.parameter['position'], [-d_x, -d_y, -d_z])
-            elif i_leaf == 1:
-                position = np.add(
-                    node.parameter['position'], [d_x, -d_y, -d_z])
-            elif i_leaf == 2:
-                position = np.add(
-                    node.parameter['position'], [-d_x, d_y, -d_z])
-            elif i_leaf == 3:
-                position = np.add(node.parameter['position'], [d_x, d_y, -d_z])
-            elif i_leaf == 4:
-                position = np.add(
-                    node.parameter['position'], [-d_x, -d_y, d_z])
-            elif i_leaf == 5:
-                position = np.add(node.parameter['position'], [d_x, -d_y, d_z])
-            elif i_leaf == 6:
-                position = np.add(node.parameter['position'], [-d_x, d_y, d_z])
-            elif i_leaf == 7:
-                position = np.add(node.parameter['position'], [d_x, d_y, d_z])
-            # Set the position of the children nodes
-            node.children[i_leaf].parameter['position'] = position
-            # Set the extent of the children nodes
-            node.children[i_leaf].parameter['sidelength'] = np.divide(
-                node.parameter['sidelength'], 2.)
-            # Set the volume of the children nodes
-            node.children[i_leaf].parameter['volume'] = node.parameter['volume'] / 8.
-            # Set the level of the children nodes
-            node.children[i_leaf].parameter['level'] = node.parameter['level'] + 1
-            # Set the index of the children nodes (from 0 to 7)
-            node.children[i_leaf].parameter['index'] = i_leaf
-            # Set the parent node of the children nodes
-            node.children[i_leaf].parent = node
-
-    def remove_node_from_grid(self, grid_file, node):
-        """Remove node from binary grid file.
-
-        Args:
-            grid_file: Output grid file.
-            node: Instance of octree node.
+        tree = [{} for _ in range(max([level for level, _ in arrays.keys()], default=-1) + 1)]
+        for (level, key), value in arrays.items():
+            tree[level][key] = value
+        return tree
+
+    def get_chunk_trees(self, nr_chunks):
+        """Calculates the subtrees of the split level one after another.
+
+        Args:
+            nr_chunks (int): Number of nodes in the split level.
 
         Returns:
-            Volume of the node
+            Generator: Nodes of each level of each subtree (in the order of their roots).
         """
-        if node.parameter['is_leaf'] == True:
-            # Subtract the children mass from total mass
-            self.update_mass_measurement(node=node, remove=True)
-            # Go some bytes back to remove the children from binary file
-            grid_file.seek(-(self.data_length * 4 + 2 + 2), 1)
-            # Remove written nodes from memory
-            del node
-        else:
-            # Go some bytes back to remove the children from binary file
-            grid_file.seek(-(2 + 2), 1)
-            for j_leaf in range(8):
-                # Subtract the children mass from total mass
-                self.remove_node_from_grid(grid_file, node.children[j_leaf])
+        for i_chunk, chunk in enumerate(self.calculate_chunks(nr_chunks)):
+            stdout.write('--- Generate cartesian grid: ' + str(round(100.0 * i_chunk / nr_chunks, 3)) + ' %      \r')
+            stdout.flush()
+            self.add_mass(chunk['gas_mass'], chunk['dust_mass'])
+            chunk_tree = self.get_chunk_tree(chunk['arrays'])
+            self.count_levels(chunk_tree, self.split_level)
+            yield chunk_tree
+
+    @staticmethod
+    def get_tree_mass(tree):
+        """Sums the gas and dust mass of the leaves of all levels.
+
+        Args:
+            tree (List): Nodes of each level (see refine_levels).
+
+        Returns:
+            Gas mass and dust mass (None if no density is defined).
+        """
+        masses = [None, None]
+        for nodes in tree:
+            for i_mass, key in enumerate(['gas_mass', 'dust_mass']):
+                if nodes[key] is not None:
+                    masses[i_mass] = nodes[key] if masses[i_mass] is None else masses[i_mass] + nodes[key]
+        return masses
+
+    def get_octree_quantities(self, positions, level, index, sidelength, volume):
+        """Calculates the quantities of octree nodes of the same level.
+
+        Args:
+            positions (ndarray): (N, 3) positions of the nodes.
+            level (int): Level of the nodes.
+            index (ndarray): (N,) index of the nodes (from 0 to 7).
+            sidelength (float): Width of the nodes.
+            volume (float): Volume of the nodes.
+
+        Returns:
+            dict: Array of each quantity with the node index as first dimension.
+        """
+        volumes = np.full(len(positions), volume)
+        nodes = None
+        if not self.data.vectorized:
+            nodes = self.create_octree_nodes(positions, level, index, sidelength, volume)
+        return self.get_cell_quantities(positions, volumes, nodes=nodes)
+
+    def ignore_cells_defined(self):
+        """Does the model define ignore_cell?
+
+        Returns:
+            bool: True if ignore_cell of the model class is not the default one.
+        """
+        from polaris_tools_modules.base import Model
+        return type(self.model).ignore_cell is not Model.ignore_cell
+
+    @staticmethod
+    def create_octree_nodes(positions, level, index, sidelength, volume):
+        """Creates the octree nodes that are passed to init_position and ignore_cell.
+
+        Args:
+            positions (ndarray): (N, 3) positions of the nodes.
+            level (int): Level of the nodes.
+            index (ndarray): (N,) index of the nodes (from 0 to 7).
+            sidelength (float): Width of the nodes.
+            volume (float): Volume of the nodes.
+
+        Returns:
+            NodeStore: Octree nodes.
+        """
+        return NodeStore('octree', {'position': positions, 'index': index},
+                         {'level': level, 'sidelength': sidelength, 'volume': volume})
+
+    def write_tree(self, grid_file, tree, chunk_trees):
+        """Write the nodes of all levels in depth-first order (without the root node header).
+
+        Notes:
+            Each subtree of the split level is written as soon as it is calculated and
+            released afterwards. Only the nodes above the split level and the raw densities
+            of the regions are kept until the end (the leaves are found again in the written
+            file for the normalization, see normalize_density).
+
+        Args:
+            grid_file: Input grid file (tmp_grid).
+            tree (List): Nodes (parent, index, is_leaf), leaf data and leaf mass of each level
+                above the split level.
+            chunk_trees: Generator of the subtrees of the split level (see get_chunk_trees).
+        """
+        writer = GridWriter(grid_file)
+        if tree[0]['is_leaf'][0]:
+            self.store_region_densities(tree[0])
+            writer.write_cell_data(tree[0]['data'], np.float32)
+            return
+        # The roots of the subtrees are placeholders in the level below the other nodes
+        chunk_level = len(tree)
+        top_tree = tree + [{'parent': self.chunk_nodes['parent'], 'index': self.chunk_nodes['index'],
+                            'is_leaf': np.zeros(len(self.chunk_nodes['index']), dtype=bool)}]
+        is_leaf, levels, leaf_rows = self.get_depth_first_nodes(top_tree, 0, skip_root=True)
+        top_leaves = self.get_leaf_arrays(tree)
+
+        i_node = 0
+        for i_chunk_root in np.append(np.flatnonzero(levels == chunk_level), len(levels)):
+            # Nodes above the split level in front of the next subtree
+            nodes = slice(i_node, i_chunk_root)
+            rows = leaf_rows[nodes][is_leaf[nodes]]
+            self.write_nodes(writer, is_leaf[nodes], levels[nodes],
+                             {key: value[rows] for key, value in top_leaves.items()})
+            if i_chunk_root < len(levels):
+                chunk_tree = next(chunk_trees)
+                chunk_is_leaf, chunk_levels, chunk_rows = self.get_depth_first_nodes(chunk_tree, chunk_level)
+                chunk_leaves = {key: value[chunk_rows[chunk_is_leaf]]
+                                for key, value in self.get_leaf_arrays(chunk_tree).items()}
+                del chunk_tree
+                self.write_nodes(writer, chunk_is_leaf, chunk_levels, chunk_leaves)
+            i_node = i_chunk_root + 1
+
+    def write_nodes(self, writer, is_leaf, levels, leaves):
+        """Writes octree nodes behind the nodes written before.
+
+        Args:
+            writer (GridWriter): Writer of the grid file.
+            is_leaf (ndarray): Is the node a leaf (in depth-first order)?
+            levels (ndarray): Level of each node.
+            leaves (dict): Data and raw region densities of the leaves in the order of the nodes.
+        """
+        if len(is_leaf) == 0:
+            return
+        writer.write_octree_nodes(is_leaf, levels, leaves['data'])
+        self.store_region_densities(leaves)
+
+    def get_leaf_arrays(self, tree):
+        """Concatenates the data and raw region densities of the leaves of all levels.
+
+        Args:
+            tree (List): Nodes of each level (see refine_levels).
+
+        Returns:
+            dict: Arrays of the leaves in the order of the levels.
+        """
+        return {key: np.concatenate([nodes[key] for nodes in tree])
+                for key in ['data'] + list(self.region_densities.keys())}
+
+    @staticmethod
+    def get_depth_first_nodes(tree, first_level, skip_root=False):
+        """Sorts the nodes of a tree or subtree in depth-first order.
+
+        Args:
+            tree (List): Nodes (parent, index, is_leaf) of each level starting with the root node.
+            first_level (int): Level of the root node.
+            skip_root (bool): Leave out the root node (if it is written in the header).
+
+        Returns:
+            is_leaf, level and the row of the leaf data (in the order of the levels) of each node.
+        """
+        # Key of each node from the index of the node and its parents
+        keys = [np.zeros(1, dtype=np.int64)]
+        for level in range(1, len(tree)):
+            keys.append(keys[level - 1][tree[level]['parent']] * 8 + tree[level]['index'])
+        levels = np.concatenate([np.full(len(nodes['index']), first_level + level, dtype=np.uint16)
+                                 for level, nodes in enumerate(tree)])
+        is_leaf = np.concatenate([nodes['is_leaf'] for nodes in tree])
+        leaf_rows = np.cumsum(is_leaf) - 1
+        # Parents are in front of their children, children are sorted by their index
+        order = LinearOcTree.get_depth_first_order(np.concatenate(keys), levels - first_level)
+        if skip_root:
+            order = order[1:]
+        return is_leaf[order], levels[order], leaf_rows[order]
 
     @staticmethod
     def get_volume(node):
@@ -575,82 +1337,203 @@ class OcTree(Grid):
                   node.parameter['sidelength'] * node.parameter['sidelength'])
         return volume
 
-    def grid_refinement(self, node):
-        """Calculates the maximum difference of the density in the
-        center of the parent and in each of the 8 children.
+    def grid_refinement(self, parent_quantities, children_quantities, sidelength, volume):
+        """Calculates how much the refinement criteria are exceeded by each refined node.
+
+        Notes:
+            The criteria are the relative difference of the density in the center of the
+            parent and in each of the 8 children (refinement_limit), the gas mass and the
+            optical depth across the parent (max_cell_mass, max_optical_depth) and the
+            relative difference of the magnetic field and velocity (gradient_limit).
+            Criteria that are None are not used.
 
         Args:
-            node: Instance of octree node.
+            parent_quantities (dict): Quantities of the refined nodes.
+            children_quantities (dict): Quantities of their children (8 per node).
+            sidelength (float): Width of the refined nodes.
+            volume (float): Volume of the refined nodes.
 
         Returns:
-            Float: Maximum difference of the density in the
-            center of the parent and in each of the 8 children.
-        """
-        # Set density of parent node for refinement calculation
-        self.data.init_position(node)
-        node.parameter['gas_density'] = self.model.get_gas_density_distribution()
-        if isinstance(node.parameter['gas_density'], (float, int)):
-            if np.sum(node.parameter['gas_density']) > 0:
-                return 9999
-        else:
-            for i_gas_dens, gas_dens in enumerate(node.parameter['gas_density']):
-                if np.sum(gas_dens) > 0:
-                    return 9999
-        return 0
+            ndarray: Maximum ratio of each criterion to its limit (the children
+            are merged into the parent node, if it is smaller than 1).
+        """
+        nr_nodes = len(next(value for value in parent_quantities.values() if value is not None))
+        difference = np.zeros(nr_nodes)
+        densities = {}
+        for quantity in ['gas_density_distribution', 'dust_density_distribution']:
+            if quantity not in self.quantities:
+                continue
+            densities[quantity] = self.get_density_sum(parent_quantities[quantity])
+            if self.refinement['refinement_limit'] is None:
+                continue
+            children = self.get_density_sum(children_quantities[quantity]).reshape(nr_nodes, 8, -1)
+            # Any density in the children of an empty node is an infinite contrast
+            contrast = self.get_ratio(np.abs(children - densities[quantity][:, np.newaxis, :]),
+                                      densities[quantity][:, np.newaxis, :])
+            difference = np.maximum(difference, self.get_ratio(np.max(contrast, axis=(1, 2)),
+                                                               self.refinement['refinement_limit']))
+        if 'gas_density_distribution' in densities.keys():
+            gas_density = np.sum(densities['gas_density_distribution'], axis=1) * \
+                self.refinement.get('density_scale', {}).get('gas_density_distribution', 1.)
+            if self.refinement['max_cell_mass'] is not None:
+                difference = np.maximum(difference, self.get_ratio(gas_density * volume,
+                                                                   self.refinement['max_cell_mass']))
+        if self.refinement['max_optical_depth'] is not None:
+            if 'dust_density_distribution' in densities.keys():
+                dust_density = np.sum(densities['dust_density_distribution'], axis=1) * \
+                    self.refinement['density_scale']['dust_density_distribution']
+            elif 'gas_density_distribution' in densities.keys():
+                dust_density = gas_density * self.model.parameter['mass_fraction']
+            else:
+                dust_density = np.zeros(nr_nodes)
+            difference = np.maximum(difference, self.get_ratio(self.refinement['opacity'] * dust_density * sidelength,
+                                                               self.refinement['max_optical_depth']))
+        if self.refinement['gradient_limit'] is not None:
+            for quantity in ['magnetic_field', 'velocity_field']:
+                if quantity not in self.quantities:
+                    continue
+                parent = np.asarray(parent_quantities[quantity], dtype=float)
+                children = np.asarray(children_quantities[quantity], dtype=float).reshape(nr_nodes, 8, 3)
+                change = np.max(np.linalg.norm(children - parent[:, np.newaxis, :], axis=2), axis=1)
+                strength = np.maximum(np.linalg.norm(parent, axis=1), np.max(np.linalg.norm(children, axis=2), axis=1))
+                difference = np.maximum(difference, self.get_ratio(self.get_ratio(change, strength),
+                                                                   self.refinement['gradient_limit']))
+        return difference
 
-    def normalize_density(self, tmp_file, grid_file):
-        """Read the temporary octree grid and normalize the
-        density to the total model mass.
+    @staticmethod
+    def get_ratio(value, limit):
+        """Divides non-negative values by their limits (zero values give zero, even if the limit is zero).
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
+            value (ndarray): Values.
+            limit (ndarray or float): Limits.
+
+        Returns:
+            ndarray: Ratio of the values to their limits (infinite if only the limit is zero).
         """
-        self.read_write_header(tmp_file=tmp_file, grid_file=grid_file)
-        while True:
-            is_leaf = self.read_write_node_header(
-                tmp_file=tmp_file, grid_file=grid_file)
-            if len(is_leaf) == 0:
-                break
-            is_leaf = struct.unpack('H', is_leaf)[0]
-            if is_leaf == 1:
-                self.read_write_node_data(
-                    tmp_file=tmp_file, grid_file=grid_file)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(value > 0, np.divide(value, limit), 0.)
 
-    def read_write_header(self, tmp_file, grid_file):
-        """Read and write octree header from binary file.
+    @staticmethod
+    def get_density_sum(density):
+        """Sums the regions of each density distribution.
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
+            density (ndarray): Density of the nodes (see get_cell_quantities).
+
+        Returns:
+            ndarray: (N, nr_densities) density of each distribution.
         """
-        grid_file.write(tmp_file.read(2))
-        grid_file.write(tmp_file.read(2))
-        for i in range(self.data_length):
-            grid_file.write(tmp_file.read(2))
-        grid_file.write(tmp_file.read(8))
-        grid_file.write(tmp_file.read(2))
-        grid_file.write(tmp_file.read(2))
+        density = np.asarray(density, dtype=float)
+        if density.ndim == 1:
+            return density[:, np.newaxis]
+        return np.sum(density.reshape(density.shape[0], density.shape[1], -1), axis=2)
 
-    @staticmethod
-    def read_write_node_header(tmp_file, grid_file):
-        """Read and write header of each node.
+    def estimate_density_scale(self, level=5):
+        """Estimates the factor between the model density and the normalized density
+        (used by the mass and optical depth criterion of grid_refinement).
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
+            level (int): Level of the regular nodes at which the density is sampled.
 
         Returns:
-            Int: Binary value of the is_leaf parameter.
+            dict: Factor of the gas and the dust density distribution.
         """
-        is_leaf = tmp_file.read(2)
-        if len(is_leaf) == 2:
-            grid_file.write(is_leaf)
-            level = tmp_file.read(2)
-            grid_file.write(level)
-        elif len(is_leaf) != 0:
-            raise ValueError('Problem with is_leaf in grid normalization!')
-        return is_leaf
+        density_scale = {'gas_density_distribution': 1., 'dust_density_distribution': 1.}
+        if self.parse_args is not None and not self.parse_args.normalize:
+            return density_scale
+        nr_nodes = 2 ** level
+        sidelength = self.refinement['sidelength'] / nr_nodes
+        volume = self.refinement['volume'] / 8 ** level
+        i_x, i_y, i_z = [i.ravel() for i in np.meshgrid(*(3 * [np.arange(nr_nodes)]), indexing='ij')]
+        positions = (np.column_stack((i_x, i_y, i_z)) + 0.5) * sidelength - self.refinement['sidelength'] / 2.
+        quantities = self.get_octree_quantities(positions, level, i_x % 2 + 2 * (i_y % 2) + 4 * (i_z % 2),
+                                                sidelength, volume)
+        for quantity, mass in [('gas_density_distribution', self.model.parameter['gas_mass']),
+                               ('dust_density_distribution', self.model.parameter['dust_mass'])]:
+            if quantity in self.quantities and mass is not None:
+                model_mass = np.sum(quantities[quantity]) * volume
+                if model_mass > 0:
+                    density_scale[quantity] = np.sum(mass) / model_mass
+        return density_scale
+
+    def normalize_density(self, grid_filename, chunk_size=1048576):
+        """Normalize the density of the written octree grid to the total model mass.
+
+        Notes:
+            The nodes of the written grid are found again chunk by chunk (see
+            OcTreeFile.get_node_offset_chunks), so that no position has to be kept per
+            leaf. The density values of the leaves are scaled in place via a memory map.
+
+        Args:
+            grid_filename (str): Path to the grid file written by create_grid.
+            chunk_size (int): Number of leaves that are scaled at once.
+        """
+        scale_factors, relative_densities = self.get_density_normalization()
+        for quantity in relative_densities.keys():
+            self.region_densities[quantity] = np.concatenate(self.region_densities[quantity])
+        nr_densities = self.nr_gas_densities + self.nr_dust_densities
+        grid_file = OcTreeFile(grid_filename, mode='r+', build_index=False)
+        i_leaf = 0
+        for node_offsets, is_leaf, _ in grid_file.get_node_offset_chunks(chunk_size):
+            index = node_offsets[is_leaf, np.newaxis] + 1 + np.arange(nr_densities)
+            rows = slice(i_leaf, i_leaf + len(index))
+            grid_file.data[index] = self.get_normalized_densities(
+                grid_file.data[index], rows, scale_factors, relative_densities)
+            i_leaf += len(index)
+        grid_file.data.flush()
+        del grid_file
+
+    def open_grid_file(self, grid_filename, mode='r'):
+        """Opens an existing octree grid file.
+
+        Args:
+            grid_filename (str): Path to the grid file.
+            mode (str): Mode of the memory map ('r': read only, 'r+': modify the leaf data).
+
+        Returns:
+            OcTreeFile: Opened grid file.
+        """
+        return OcTreeFile(grid_filename, mode)
+
+    def calculate_patch_chunks(self, grid_file, chunk_size=1048576):
+        """Calculates the data of the leaves of an existing octree grid chunk by chunk.
+
+        Args:
+            grid_file (OcTreeFile): Existing grid file.
+            chunk_size (int): Number of leaves that are calculated at once.
+
+        Returns:
+            Generator: (N, data_length) data of consecutive leaves in the order of the grid file.
+        """
+        sidelength = grid_file.parameter['sidelength']
+        nr_leaves = grid_file.get_nr_leaves()
+        for i_leaf in range(0, nr_leaves, chunk_size):
+            stdout.write('--- Patch cartesian grid: ' + str(round(100.0 * i_leaf / nr_leaves, 3)) + ' %      \r')
+            stdout.flush()
+            leaves = slice(i_leaf, i_leaf + chunk_size)
+            positions = grid_file.get_leaf_centers(leaves)
+            levels = grid_file.leaf_levels[leaves].astype(int)
+            # Same volume as in create_grid (volume of the root divided by 8 per level)
+            volumes = sidelength * sidelength * sidelength / 8. ** levels
+            nodes = None
+            if not self.data.vectorized:
+                nodes = NodeStore('octree', {'position': positions, 'volume': volumes, 'level': levels,
+                                             'index': (grid_file.leaf_keys[leaves] & np.uint64(7)).astype(int),
+                                             'sidelength': sidelength / 2. ** levels})
+            quantities = self.get_cell_quantities(positions, volumes, nodes=nodes)
+            yield self.get_cell_data(quantities).astype(np.float32)
+
+    def get_grid_index(self, grid_filename):
+        """Opens an existing octree grid file with an index to find the leaves of many positions.
+
+        Args:
+            grid_filename (str): Path to the grid file.
+
+        Returns:
+            OcTreeIndex: Index of the grid file (see GridIndex.query).
+        """
+        return OcTreeIndex(self.open_grid_file(grid_filename))
 
 
 class Spherical(Grid):
@@ -696,6 +1579,28 @@ class Spherical(Grid):
         """
         #: Parameter from the chosen model used for the grid creation
         sp_param = self.model.spherical_parameter
+        if self.border_optimization is not None:
+            self.optimize_cell_borders()
+        radius_list, phi_list, theta_list = self.init_cell_borders()
+
+        # Write the spherical header with the custom lists
+        GridWriter(grid_file).write_spherical_header(sp_param, radius_list, phi_list, theta_list)
+
+        #: int: Position of the cell data in the grid file (used for normalization)
+        self.data_offset = grid_file.tell()
+
+        # Calculate and write each radial shell at once (and the cell in the center)
+        self.init_geometry(sp_param['n_r'] + 1)
+        self.create_cells(grid_file, sp_param['n_r'] + 1, 'spherical')
+
+    def init_cell_borders(self):
+        """Calculates the cell borders from the spherical parameter of the model.
+
+        Returns:
+            Radius, phi and theta list (written to the header, if they are custom lists).
+        """
+        #: Parameter from the chosen model used for the grid creation
+        sp_param = self.model.spherical_parameter
 
         #: Array of radius values
         if sp_param['sf_r'] == 0:
@@ -741,149 +1646,125 @@ class Spherical(Grid):
         else:
             theta_list = self.math.lin_list(0, np.pi, sp_param['n_th'])
 
-        grid_file.write(struct.pack('d', sp_param['inner_radius']))
-        grid_file.write(struct.pack('d', sp_param['outer_radius']))
-        grid_file.write(struct.pack('H', sp_param['n_r']))
-        grid_file.write(struct.pack('H', sp_param['n_ph']))
-        grid_file.write(struct.pack('H', sp_param['n_th']))
-        # f_radius
-        grid_file.write(struct.pack('d', sp_param['sf_r']))
-        # f_phi
-        grid_file.write(struct.pack('d', sp_param['sf_ph']))
-        # f_theta
-        grid_file.write(struct.pack('d', sp_param['sf_th']))
-        # Write radius list if custom
-        if sp_param['sf_r'] == 0:
-            for tmp_rad in radius_list[1:-1]:
-                grid_file.write(struct.pack('d', tmp_rad))
-        # Write phi list if custom
-        if sp_param['sf_ph'] == 0:
-            for tmp_phi in phi_list[1:-1]:
-                grid_file.write(struct.pack('d', tmp_phi))
-        # Write theta list if custom
-        if sp_param['sf_th'] == 0:
-            for tmp_theta in theta_list[1:-1]:
-                grid_file.write(struct.pack('d', tmp_theta))
+        #: dict: Cell borders of the grid (used to calculate the cells of each radial shell)
+        self.cell_borders = {
+            'radius_list': np.asarray(radius_list, dtype=float),
+            'phi_list': np.asarray(phi_list, dtype=float),
+            'theta_list': np.asarray(theta_list, dtype=float),
+        }
+        # Are the theta borders mirror symmetric to the midplane?
+        self.cell_borders['mirror'] = np.allclose(
+            self.cell_borders['theta_list'] + self.cell_borders['theta_list'][::-1], np.pi, rtol=1e-12, atol=0)
+        return radius_list, phi_list, theta_list
 
-        # Calculate the total number of cells
-        nr_cells = 0
-        for i_r in range(sp_param['n_r']):
-            nr_cells += sp_param['n_ph'] * sp_param['n_th']
+    def read_cell_borders(self, grid_file):
+        """Sets the spherical parameter and the cell borders from the header of an existing grid.
 
-        i_node = 0
-        for i_r in range(sp_param['n_r']):
-            for i_p in range(sp_param['n_ph']):
-                for i_t in range(sp_param['n_th']):
-                    stdout.write('--- Generate spherical grid: ' +
-                                 str(round(100.0 * i_node / nr_cells, 3)) + ' %      \r')
-                    stdout.flush()
-                    # Calculate the cell midpoint in spherical coordinates
-                    spherical_coord = np.zeros(3)
-                    spherical_coord[0] = (
-                        radius_list[i_r] + radius_list[i_r + 1]) / 2.
-                    spherical_coord[1] = (
-                        theta_list[i_t] + theta_list[i_t + 1]) / 2.
-                    spherical_coord[2] = (
-                        phi_list[i_p] + phi_list[i_p + 1]) / 2.
-                    # Convert the spherical coordinate into cartesian node position
-                    position = self.math.spherical_to_cartesian(
-                        spherical_coord)
-                    node = Node('spherical')
-                    node.parameter['position'] = position
-                    node.parameter['extent'] = [radius_list[i_r], radius_list[i_r + 1],
-                                                theta_list[i_t], theta_list[i_t + 1],
-                                                phi_list[i_p], phi_list[i_p + 1]]
-                    node.parameter['volume'] = self.get_volume(node=node)
-                    self.write_node_data(grid_file=grid_file, node=node, data_type='d',
-                                         cell_IDs=[i_r, i_t, i_p])
-                    self.update_mass_measurement(node=node)
-                    del node
-                    i_node += 1
-        node = Node('spherical')
-        node.parameter['position'] = [0., 0., 0.]
-        node.parameter['extent'] = [0., radius_list[0],
-                                    0, np.pi,
-                                    0, 2. * np.pi]
-        node.parameter['volume'] = self.get_volume(node=node)
-        self.write_node_data(grid_file=grid_file, node=node, data_type='d',
-                             cell_IDs=[-1, -1, -1])
-        self.update_mass_measurement(node=node)
+        Args:
+            grid_file (GridFile): Existing spherical grid file.
+        """
+        sp_param = self.model.spherical_parameter
+        for name in grid_file.spherical_header.names:
+            sp_param[name] = grid_file.parameter[name]
+        sp_param.update(grid_file.border_lists)
+        sp_param['split_first_cell'] = 1
+        self.init_cell_borders()
 
-    @staticmethod
-    def get_volume(node):
-        """Calculate the volume of a spherical node.
+    def optimize_cell_borders(self):
+        """Places the radial and theta borders so that each cell contains the same
+        part of the mass or the optical depth of the model (see border_optimization).
+
+        Notes:
+            The density is sampled with border_sampling cells per grid cell (logarithmic
+            in radius, linear in theta). The borders are used as custom lists (sf_r = 0,
+            sf_th = 0), which are written to the grid header.
+        """
+        sp_param = self.model.spherical_parameter
+        n_r = len(sp_param['radius_list']) - 1 if sp_param['sf_r'] == 0 else sp_param['n_r']
+        n_th = len(sp_param['theta_list']) - 1 if sp_param['sf_th'] == 0 else sp_param['n_th']
+        radius_samples = np.geomspace(sp_param['inner_radius'], sp_param['outer_radius'],
+                                      self.border_sampling * n_r + 1)
+        theta_samples = np.linspace(0., np.pi, self.border_sampling * n_th + 1)
+        phi_samples = np.linspace(0., 2. * np.pi, (1 if self.model.axisymmetric else self.border_phi_samples) + 1)
+        weights_r, weights_th = self.sample_border_weights(radius_samples, theta_samples, phi_samples)
+        sp_param['radius_list'] = self.get_adaptive_borders(radius_samples, weights_r, n_r)
+        sp_param['theta_list'] = self.get_adaptive_borders(theta_samples, weights_th, n_th,
+                                                           mirror=self.model.mirror_symmetric)
+        sp_param['sf_r'] = 0
+        sp_param['sf_th'] = 0
+        print('HINT: The radial and theta cell borders contain the same ' +
+              ('mass' if self.border_optimization == 'mass' else 'optical depth') + ' (sf_r = 0, sf_th = 0)!')
+
+    def get_sample_cells(self, radius_list, theta_list, phi_list, i_r, i_t, i_p):
+        """Calculates the sample cells used to optimize the cell borders.
 
         Args:
-            node: Instance of spherical node.
+            radius_list (ndarray): Radial borders of the samples.
+            theta_list (ndarray): Theta borders of the samples.
+            phi_list (ndarray): Phi borders of the samples.
+            i_r, i_t, i_p (ndarray): Indices of the samples.
 
         Returns:
-            Volume of the node
+            Positions, volumes, extents and path length in theta direction of the samples.
         """
-        volume = (node.parameter['extent'][1] ** 3 - node.parameter['extent'][0] ** 3) * \
-                 (np.cos(node.parameter['extent'][2]) - np.cos(node.parameter['extent'][3])) * \
-                 (node.parameter['extent'][5] -
-                  node.parameter['extent'][4]) / 3.
-        return volume
+        extents = np.column_stack((radius_list[i_r], radius_list[i_r + 1], theta_list[i_t], theta_list[i_t + 1],
+                                   phi_list[i_p], phi_list[i_p + 1]))
+        spherical_coord = (extents[:, 0::2] + extents[:, 1::2]) / 2.
+        return self.math.spherical_to_cartesian(spherical_coord), self.get_volume(extent=extents.T), extents, \
+            spherical_coord[:, 0] * (extents[:, 3] - extents[:, 2])
 
-    def normalize_density(self, tmp_file, grid_file):
-        """Read the temporary spherical grid and normalize the
-        density to the total model mass.
+    def get_chunk_cells(self, i_chunk):
+        """Calculates the cells of one radial shell.
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
-        """
-        #: Parameter from the chosen model used for the grid creation
-        sp_param = self.model.spherical_parameter
+            i_chunk (int): Index of the radial shell (n_r for the cell in the center).
 
-        self.read_write_header(tmp_file=tmp_file, grid_file=grid_file)
-        for i_r in range(sp_param['n_r']):
-            for i_t in range(sp_param['n_th']):
-                for i_p in range(sp_param['n_ph']):
-                    self.read_write_node_data(
-                        tmp_file=tmp_file, grid_file=grid_file, data_type='d')
-        self.read_write_node_data(
-            tmp_file=tmp_file, grid_file=grid_file, data_type='d')
+        Returns:
+            Positions, volumes, cell IDs, extents and symmetry of the cells (see calculate_cells).
+        """
+        radius_list = self.cell_borders['radius_list']
+        if i_chunk == len(radius_list) - 1:
+            extents = np.array([[0., radius_list[0], 0, np.pi, 0, 2. * np.pi]])
+            return np.zeros((1, 3)), self.get_volume(extent=extents.T), np.array([[-1, -1, -1]]), extents
+        phi_list = self.cell_borders['phi_list']
+        theta_list = self.cell_borders['theta_list']
+        i_p, i_t = [i.ravel() for i in np.meshgrid(
+            np.arange(len(phi_list) - 1), np.arange(len(theta_list) - 1), indexing='ij')]
+        # Calculate the cell midpoint in spherical coordinates
+        spherical_coord = np.column_stack((
+            np.full(len(i_t), (radius_list[i_chunk] + radius_list[i_chunk + 1]) / 2.),
+            (theta_list[i_t] + theta_list[i_t + 1]) / 2., (phi_list[i_p] + phi_list[i_p + 1]) / 2.))
+        extents = np.column_stack((
+            np.full(len(i_t), radius_list[i_chunk]), np.full(len(i_t), radius_list[i_chunk + 1]),
+            theta_list[i_t], theta_list[i_t + 1], phi_list[i_p], phi_list[i_p + 1]))
+        cell_IDs = np.column_stack((np.full(len(i_t), i_chunk), i_t, i_p))
+        if self.geometry is None:
+            # Convert the spherical coordinate into cartesian node position
+            positions = self.math.spherical_to_cartesian(spherical_coord)
+            volumes = self.get_volume(extent=extents.T)
+        else:
+            positions, volumes = self.get_cached_geometry(i_chunk)
+        return positions, volumes, cell_IDs, extents, \
+            self.get_symmetry(i_p, i_t, spherical_coord[:, 2], len(theta_list) - 1, self.cell_borders['mirror'])
 
-    def read_write_header(self, tmp_file, grid_file):
-        """Read and write spherical header from binary file.
+    @staticmethod
+    def get_volume(node=None, extent=None):
+        """Calculate the volume of a spherical node.
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
-        """
-        grid_file.write(tmp_file.read(2))
-        grid_file.write(tmp_file.read(2))
-        for i in range(self.data_length):
-            grid_file.write(tmp_file.read(2))
-        grid_file.write(tmp_file.read(8))
-        grid_file.write(tmp_file.read(8))
-        # Get number of radial cells
-        n_r = tmp_file.read(2)
-        grid_file.write(n_r)
-        # Get number of phi cells
-        n_ph = tmp_file.read(2)
-        grid_file.write(n_ph)
-        # Get number of theta cells
-        n_th = tmp_file.read(2)
-        grid_file.write(n_th)
-        # Get step width factors (zero for custom)
-        sf_r = tmp_file.read(8)
-        grid_file.write(sf_r)
-        sf_ph = tmp_file.read(8)
-        grid_file.write(sf_ph)
-        sf_th = tmp_file.read(8)
-        grid_file.write(sf_th)
-        # Write the custom cell distribution if chosen
-        if struct.unpack('d', sf_r)[0] == 0:
-            for i_r in range(struct.unpack('H', n_r)[0] - 1):
-                grid_file.write(tmp_file.read(8))
-        if struct.unpack('d', sf_ph)[0] == 0:
-            for i_ph in range(struct.unpack('H', n_ph)[0] - 1):
-                grid_file.write(tmp_file.read(8))
-        if struct.unpack('d', sf_th)[0] == 0:
-            for i_th in range(struct.unpack('H', n_th)[0] - 1):
-                grid_file.write(tmp_file.read(8))
+            node: Instance of spherical node.
+            extent (List or ndarray): Borders of the node(s) instead of the node
+                (r_in, r_out, th_in, th_out, ph_in, ph_out), each can be an array.
+
+        Returns:
+            Volume of the node
+        """
+        if extent is None:
+            extent = node.parameter['extent']
+        volume = (extent[1] ** 3 - extent[0] ** 3) * \
+                 (np.cos(extent[2]) - np.cos(extent[3])) * \
+                 (extent[5] - extent[4]) / 3.
+        return volume
 
     def write_other_grid(self, tmp_file, code_name):
         """Generate a grid for other RT codes as well.
@@ -971,6 +1852,32 @@ class Cylindrical(Grid):
         """
         #: Parameter from the chosen model used for the grid creation
         cy_param = self.model.cylindrical_parameter
+        if self.border_optimization is not None:
+            self.optimize_cell_borders()
+        radius_list, z_list, dz_list = self.init_cell_borders()
+
+        # Write the cylindrical header with the custom lists (or n_ph, dz of each ring)
+        GridWriter(grid_file).write_cylindrical_header(cy_param, radius_list, cy_param['phi_list'], z_list, dz_list)
+
+        #: int: Position of the cell data in the grid file (used for normalization)
+        self.data_offset = grid_file.tell()
+
+        # Calculate and write each radial ring at once (and the cells inside the inner radius)
+        self.init_geometry(cy_param['n_r'] + 1)
+        self.create_cells(grid_file, cy_param['n_r'] + 1, 'cylindrical')
+
+    def init_cell_borders(self, dz_list=None):
+        """Calculates the cell borders from the cylindrical parameter of the model.
+
+        Args:
+            dz_list (ndarray): Width of the vertical cells of each radial ring if sf_z is -1
+                (calculated with get_dz of the model if None).
+
+        Returns:
+            Radius list, z list of the first ring and dz list (written to the header).
+        """
+        #: Parameter from the chosen model used for the grid creation
+        cy_param = self.model.cylindrical_parameter
 
         #: Array of radius values
         if cy_param['sf_r'] == 0:
@@ -1009,204 +1916,201 @@ class Cylindrical(Grid):
                 if cy_param['phi_list'][0] != 0 or \
                         cy_param['phi_list'][-1] != 2. * np.pi:
                     raise ValueError('phi_list does not fullfil a full cicle!')
-                phi_list = np.array([cy_param['phi_list']
-                                     for i_r in range(cy_param['n_r'])])
-                cy_param['n_ph'] = [len(phi_list[0])-1] * cy_param['n_r']
+                cy_param['n_ph'] = [len(cy_param['phi_list']) - 1] * cy_param['n_r']
             else:
                 raise ValueError(
                     'Cell distriution in phi-direction not understood!')
-        elif cy_param['sf_ph'] == -1:
-            phi_list = [self.math.lin_list(0., 2. * np.pi, n_ph)
-                        for n_ph in cy_param['n_ph']]
+        elif cy_param['sf_ph'] != -1:
+            cy_param['n_ph'] = [cy_param['n_ph'][0]] * cy_param['n_r']
+        #: Number of phi cells in each radial ring
+        n_ph = np.array(cy_param['n_ph'], dtype=int)
+        #: Position of the phi borders of each radial ring in the (ragged) phi_list
+        ph_offsets = np.concatenate(([0], np.cumsum(n_ph + 1)))
+        if cy_param['sf_ph'] == 0:
+            phi_list = np.tile(np.asarray(cy_param['phi_list'], dtype=float), cy_param['n_r'])
         else:
-            phi_list = np.array([self.math.lin_list(0., 2. * np.pi, cy_param['n_ph'][0])
-                                 for i_r in range(cy_param['n_r'])])
-
-        #: Array of z values
+            # Linear distribution in each radial ring (see lin_list)
+            i_ph = np.arange(ph_offsets[-1]) - np.repeat(ph_offsets[:-1], n_ph + 1)
+            phi_list = i_ph * np.repeat(2. * np.pi / n_ph, n_ph + 1)
+            phi_list[ph_offsets[1:] - 1] = 2. * np.pi
+
+        #: Array of z values (for each radial ring) and width of the vertical cells if sf_z is -1
+        if cy_param['sf_z'] != -1:
+            dz_list = None
         if cy_param['sf_z'] == 0:
             if len(cy_param['z_list']) > 0:
                 if cy_param['z_list'][0] != -cy_param['z_max'] or \
                         cy_param['z_list'][-1] != cy_param['z_max']:
                     raise ValueError(
                         'z_list does not agree with the inner and outer grid borders!')
-                z_list = np.array([cy_param['z_list']
-                                   for i_r in range(cy_param['n_r'])])
-                cy_param['n_z'] = len(z_list[0]) - 1
+                cy_param['n_z'] = len(cy_param['z_list']) - 1
+                z_list = np.tile(np.asarray(cy_param['z_list'], dtype=float), (cy_param['n_r'], 1))
             else:
                 raise ValueError(
                     'Cell distribution in z-direction not understood!')
         elif cy_param['sf_z'] == -1:
-            z_max_tmp = [self.model.get_dz(
-                radius_list[i_r]) * cy_param['n_z'] / 2. for i_r in range(cy_param['n_r'])]
-            z_list = np.array(
-                [self.math.lin_list(-zmax, zmax, cy_param['n_z']) for zmax in z_max_tmp])
+            # Width of the vertical cells at the inner border of each radial ring
+            if dz_list is not None:
+                dz_list = np.asarray(dz_list, dtype=float)
+            elif self.model.vectorized:
+                dz_list = np.asarray(self.model.get_dz(np.asarray(radius_list[:-1], dtype=float)), dtype=float)
+            else:
+                dz_list = np.array([self.model.get_dz(rho_tmp) for rho_tmp in radius_list[:-1]])
+            z_max_tmp = dz_list * cy_param['n_z'] / 2.
+            # Linear distribution in each radial ring (see lin_list)
+            z_list = -z_max_tmp[:, np.newaxis] + np.arange(cy_param['n_z'] + 1) * \
+                ((z_max_tmp - -z_max_tmp) / cy_param['n_z'])[:, np.newaxis]
+            z_list[:, 0] = -z_max_tmp
+            z_list[:, -1] = z_max_tmp
         elif cy_param['sf_z'] == 1.0:
-            z_list = np.array([self.math.sin_list(-cy_param['z_max'], cy_param['z_max'], cy_param['n_z'])
-                               for i_r in range(cy_param['n_r'])])
+            z_list = np.tile(self.math.sin_list(-cy_param['z_max'], cy_param['z_max'], cy_param['n_z']),
+                             (cy_param['n_r'], 1))
         elif cy_param['sf_z'] > 1.0:
-            z_list = np.array([self.math.exp_list_sym(-cy_param['z_max'], cy_param['z_max'],
-                                                      cy_param['n_z'], cy_param['sf_z']) for i_r in range(cy_param['n_r'])])
+            z_list = np.tile(self.math.exp_list_sym(-cy_param['z_max'], cy_param['z_max'],
+                                                    cy_param['n_z'], cy_param['sf_z']), (cy_param['n_r'], 1))
         else:
-            z_list = np.array([self.math.lin_list(-cy_param['z_max'], cy_param['z_max'], cy_param['n_z'])
-                               for i_r in range(cy_param['n_r'])])
-
-        grid_file.write(struct.pack('d', cy_param['inner_radius']))
-        grid_file.write(struct.pack('d', cy_param['outer_radius']))
-        grid_file.write(struct.pack('d', cy_param['z_max']))
-        grid_file.write(struct.pack('H', cy_param['n_r']))
-        grid_file.write(struct.pack('H', cy_param['n_ph'][0]))
-        grid_file.write(struct.pack('H', cy_param['n_z']))
-        # f_rho
-        grid_file.write(struct.pack('d', cy_param['sf_r']))
-        # f_phi
-        grid_file.write(struct.pack('d', cy_param['sf_ph']))
-        # f_z
-        grid_file.write(struct.pack('d', cy_param['sf_z']))
-        # Write radius list if custom
-        if cy_param['sf_r'] == 0:
-            for tmp_rho in radius_list[1:-1]:
-                grid_file.write(struct.pack('d', tmp_rho))
-        # Write phi list if custom
-        if cy_param['sf_ph'] == 0:
-            for tmp_phi in phi_list[0][1:-1]:
-                grid_file.write(struct.pack('d', tmp_phi))
-        elif cy_param['sf_ph'] == -1:
-            for i_r in range(cy_param['n_r']):
-                grid_file.write(struct.pack('H', cy_param['n_ph'][i_r]))
-        # Write dz or z, if chosen
-        if cy_param['sf_z'] == 0:
-            for tmp_z in z_list[0][1:-1]:
-                grid_file.write(struct.pack('d', tmp_z))
-        elif cy_param['sf_z'] == -1:
-            for rho_tmp in radius_list[:-1]:
-                grid_file.write(struct.pack('d', self.model.get_dz(rho_tmp)))
+            z_list = np.tile(self.math.lin_list(-cy_param['z_max'], cy_param['z_max'], cy_param['n_z']),
+                             (cy_param['n_r'], 1))
+
+        #: dict: Cell borders of the grid (used to calculate the cells of each radial ring)
+        self.cell_borders = {
+            'radius_list': np.asarray(radius_list, dtype=float),
+            'phi_list': phi_list,
+            'ph_offsets': ph_offsets,
+            'z_list': z_list,
+        }
+        # Are the z borders mirror symmetric to the midplane?
+        self.cell_borders['mirror'] = np.allclose(z_list, -z_list[:, ::-1], rtol=1e-12,
+                                                  atol=1e-12 * np.max(np.abs(z_list)))
+        return radius_list, z_list[0], dz_list
 
-        # Calculate the total number of cells
-        nr_cells = 0
-        for i_r in range(cy_param['n_r']):
-            nr_cells += cy_param['n_ph'][i_r] * cy_param['n_z']
+    def read_cell_borders(self, grid_file):
+        """Sets the cylindrical parameter and the cell borders from the header of an existing grid.
 
-        i_node = 0
-        for i_r in range(cy_param['n_r']):
-            for i_p in range(cy_param['n_ph'][i_r]):
-                for i_z in range(cy_param['n_z']):
-                    stdout.write('--- Generate cylindrical grid: ' +
-                                 str(round(100.0 * i_node / nr_cells, 3)) + ' %      \r')
-                    stdout.flush()
-                    # Calculate the cell midpoint in cylindrical coordinates
-                    cylindrical_coord = np.array([
-                        (radius_list[i_r] + radius_list[i_r + 1]) / 2.,
-                        (phi_list[i_r][i_p] + phi_list[i_r][i_p + 1]) / 2.,
-                        (z_list[i_r][i_z] + z_list[i_r][i_z + 1]) / 2.
-                    ])
-                    # Convert the cylindrical coordinate into cartesian node position
-                    node = Node('cylindrical')
-                    node.parameter['position'] = self.math.cylindrical_to_cartesian(
-                        cylindrical_coord)
-                    node.parameter['extent'] = [radius_list[i_r], radius_list[i_r + 1],
-                                                phi_list[i_r][i_p], phi_list[i_r][i_p + 1],
-                                                z_list[i_r][i_z], z_list[i_r][i_z + 1]]
-                    node.parameter['volume'] = self.get_volume(node=node)
-                    self.write_node_data(grid_file=grid_file, node=node, data_type='d',
-                                         cell_IDs=[i_r, i_p, i_z])
-                    self.update_mass_measurement(node=node)
-                    del node
-                    i_node += 1
-
-        for i_z in range(cy_param['n_z']):
-            node = Node('cylindrical')
-            node.parameter['position'] = [
-                0., 0., (z_list[0][i_z] + z_list[0][i_z + 1]) / 2.]
-            node.parameter['extent'] = [0., radius_list[0],
-                                        phi_list[0][0], phi_list[0][cy_param['n_ph'][0]], z_list[0][i_z], z_list[0][i_z + 1]]
-            node.parameter['volume'] = self.get_volume(node=node)
-            self.write_node_data(grid_file=grid_file, node=node,
-                                 data_type='d', cell_IDs=[-1, -1, i_z])
-            self.update_mass_measurement(node=node)
-            del node
+        Args:
+            grid_file (GridFile): Existing cylindrical grid file.
+        """
+        cy_param = self.model.cylindrical_parameter
+        for name in grid_file.cylindrical_header.names:
+            cy_param[name] = grid_file.parameter[name]
+        cy_param.update(grid_file.border_lists)
+        cy_param['n_ph'] = [int(n_ph) for n_ph in grid_file.n_ph]
+        cy_param['split_first_cell'] = 1
+        self.init_cell_borders(dz_list=grid_file.dz_list)
 
-    @staticmethod
-    def get_volume(node):
-        """Calculate the volume of a cylindrical node.
+    def optimize_cell_borders(self):
+        """Places the radial and vertical borders so that each cell contains the same
+        part of the mass or the optical depth of the model (see border_optimization).
+
+        Notes:
+            The density is sampled with border_sampling cells per grid cell (logarithmic
+            in radius, linear in z). The borders are used as custom lists (sf_r = 0,
+            sf_z = 0), which are written to the grid header. If the vertical cells of
+            each radial ring follow the model (sf_z = -1, e.g. a flared disk), only the
+            radial borders are optimized, since one z_list for all rings would put the
+            vertical cells into the thin inner rings.
+        """
+        cy_param = self.model.cylindrical_parameter
+        n_r = len(cy_param['radius_list']) - 1 if cy_param['sf_r'] == 0 else cy_param['n_r']
+        n_z = len(cy_param['z_list']) - 1 if cy_param['sf_z'] == 0 else cy_param['n_z']
+        radius_samples = np.geomspace(cy_param['inner_radius'], cy_param['outer_radius'],
+                                      self.border_sampling * n_r + 1)
+        z_samples = np.linspace(-cy_param['z_max'], cy_param['z_max'], self.border_sampling * n_z + 1)
+        phi_samples = np.linspace(0., 2. * np.pi, (1 if self.model.axisymmetric else self.border_phi_samples) + 1)
+        weights_r, weights_z = self.sample_border_weights(radius_samples, z_samples, phi_samples)
+        cy_param['radius_list'] = self.get_adaptive_borders(radius_samples, weights_r, n_r)
+        cy_param['sf_r'] = 0
+        quantity = 'mass' if self.border_optimization == 'mass' else 'optical depth'
+        if cy_param['sf_z'] == -1:
+            print('HINT: The radial cell borders contain the same ' + quantity + ' (sf_r = 0), '
+                  'the vertical cells of each radial ring are kept (sf_z = -1)!')
+            return
+        cy_param['z_list'] = self.get_adaptive_borders(z_samples, weights_z, n_z, mirror=self.model.mirror_symmetric)
+        cy_param['sf_z'] = 0
+        print('HINT: The radial and vertical cell borders contain the same ' + quantity + ' (sf_r = 0, sf_z = 0)!')
+
+    def get_sample_cells(self, radius_list, z_list, phi_list, i_r, i_z, i_p):
+        """Calculates the sample cells used to optimize the cell borders.
 
         Args:
-            node: Instance of cylindrical node.
+            radius_list (ndarray): Radial borders of the samples.
+            z_list (ndarray): Vertical borders of the samples.
+            phi_list (ndarray): Phi borders of the samples.
+            i_r, i_z, i_p (ndarray): Indices of the samples.
 
         Returns:
-            Volume of the node
+            Positions, volumes, extents and path length in z direction of the samples.
         """
-        volume = (node.parameter['extent'][1] ** 2 - node.parameter['extent'][0] ** 2) * \
-                 (node.parameter['extent'][3] - node.parameter['extent'][2]) * \
-                 (node.parameter['extent'][5] -
-                  node.parameter['extent'][4]) / 2.
-        return volume
+        extents = np.column_stack((radius_list[i_r], radius_list[i_r + 1], phi_list[i_p], phi_list[i_p + 1],
+                                   z_list[i_z], z_list[i_z + 1]))
+        cylindrical_coord = (extents[:, 0::2] + extents[:, 1::2]) / 2.
+        return self.math.cylindrical_to_cartesian(cylindrical_coord), self.get_volume(extent=extents.T), extents, \
+            extents[:, 5] - extents[:, 4]
 
-    def normalize_density(self, tmp_file, grid_file):
-        """Read the temporary cylindrical grid and normalize the
-        density to the total model mass.
+    def get_chunk_cells(self, i_chunk):
+        """Calculates the cells of one radial ring.
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
-        """
-        #: Parameter from the chosen model used for the grid creation
-        cy_param = self.model.cylindrical_parameter
+            i_chunk (int): Index of the radial ring (n_r for the cells inside the inner radius).
 
-        self.read_write_header(tmp_file=tmp_file, grid_file=grid_file)
-        for i_r in range(cy_param['n_r']):
-            for i_p in range(cy_param['n_ph'][i_r]):
-                for i_z in range(cy_param['n_z']):
-                    self.read_write_node_data(
-                        tmp_file=tmp_file, grid_file=grid_file, data_type='d')
-        for i_z in range(cy_param['n_z']):
-            self.read_write_node_data(
-                tmp_file=tmp_file, grid_file=grid_file, data_type='d')
+        Returns:
+            Positions, volumes, cell IDs, extents and symmetry of the cells (see calculate_cells).
+        """
+        radius_list = self.cell_borders['radius_list']
+        phi_list = self.cell_borders['phi_list']
+        ph_offsets = self.cell_borders['ph_offsets']
+        z_list = self.cell_borders['z_list']
+        n_z = z_list.shape[1] - 1
+        if i_chunk == len(radius_list) - 1:
+            # Cells inside the inner radius
+            i_z = np.arange(n_z)
+            positions = np.zeros((n_z, 3))
+            positions[:, 2] = (z_list[0][i_z] + z_list[0][i_z + 1]) / 2.
+            extents = np.column_stack((
+                np.zeros(n_z), np.full(n_z, radius_list[0]),
+                np.full(n_z, phi_list[0]), np.full(n_z, phi_list[ph_offsets[1] - 1]),
+                z_list[0][i_z], z_list[0][i_z + 1]))
+            return positions, self.get_volume(extent=extents.T), \
+                np.column_stack((np.full(n_z, -1), np.full(n_z, -1), i_z)), extents
+        # Cell indices of the current radial ring
+        i_p, i_z = [i.ravel() for i in np.meshgrid(
+            np.arange(ph_offsets[i_chunk + 1] - ph_offsets[i_chunk] - 1), np.arange(n_z), indexing='ij')]
+        ring_phi_list = phi_list[ph_offsets[i_chunk]:ph_offsets[i_chunk + 1]]
+        # Calculate the cell midpoint in cylindrical coordinates
+        cylindrical_coord = np.column_stack((
+            np.full(len(i_p), (radius_list[i_chunk] + radius_list[i_chunk + 1]) / 2.),
+            (ring_phi_list[i_p] + ring_phi_list[i_p + 1]) / 2.,
+            (z_list[i_chunk][i_z] + z_list[i_chunk][i_z + 1]) / 2.))
+        extents = np.column_stack((
+            np.full(len(i_p), radius_list[i_chunk]), np.full(len(i_p), radius_list[i_chunk + 1]),
+            ring_phi_list[i_p], ring_phi_list[i_p + 1], z_list[i_chunk][i_z], z_list[i_chunk][i_z + 1]))
+        if self.geometry is None:
+            # Convert the cylindrical coordinate into cartesian node position
+            positions = self.math.cylindrical_to_cartesian(cylindrical_coord)
+            volumes = self.get_volume(extent=extents.T)
+        else:
+            positions, volumes = self.get_cached_geometry(i_chunk)
+        return positions, volumes, np.column_stack((np.full(len(i_p), i_chunk), i_p, i_z)), extents, \
+            self.get_symmetry(i_p, i_z, cylindrical_coord[:, 1], n_z, self.cell_borders['mirror'])
 
-    def read_write_header(self, tmp_file, grid_file):
-        """Read and write spherical header from binary file.
+    @staticmethod
+    def get_volume(node=None, extent=None):
+        """Calculate the volume of a cylindrical node.
 
         Args:
-            tmp_file: Input grid file (tmp_grid).
-            grid_file: Output grid file (final_grid).
-        """
-        grid_file.write(tmp_file.read(2))
-        grid_file.write(tmp_file.read(2))
-        for i in range(self.data_length):
-            grid_file.write(tmp_file.read(2))
-        grid_file.write(tmp_file.read(8))
-        grid_file.write(tmp_file.read(8))
-        grid_file.write(tmp_file.read(8))
-        # Get number of radial cells
-        n_r = tmp_file.read(2)
-        grid_file.write(n_r)
-        # Get number of phi cells
-        n_ph = tmp_file.read(2)
-        grid_file.write(n_ph)
-        # Get number of theta cells
-        n_z = tmp_file.read(2)
-        grid_file.write(n_z)
-        # Get step width factors (zero for custom)
-        sf_r = tmp_file.read(8)
-        grid_file.write(sf_r)
-        sf_ph = tmp_file.read(8)
-        grid_file.write(sf_ph)
-        sf_z = tmp_file.read(8)
-        grid_file.write(sf_z)
-        if struct.unpack('d', sf_r)[0] == 0:
-            for i_r in range(struct.unpack('H', n_r)[0] - 1):
-                grid_file.write(tmp_file.read(8))
-        if struct.unpack('d', sf_ph)[0] == 0:
-            for i_ph in range(struct.unpack('H', n_ph)[0] - 1):
-                grid_file.write(tmp_file.read(8))
-        elif struct.unpack('d', sf_ph)[0] == -1:
-            for i_r in range(struct.unpack('H', n_r)[0]):
-                grid_file.write(tmp_file.read(2))
-        if struct.unpack('d', sf_z)[0] == 0:
-            for i_z in range(struct.unpack('H', n_z)[0] - 1):
-                grid_file.write(tmp_file.read(8))
-        elif struct.unpack('d', sf_z)[0] == -1:
-            for i_r in range(struct.unpack('H', n_r)[0]):
-                grid_file.write(tmp_file.read(8))
+            node: Instance of cylindrical node.
+            extent (List or ndarray): Borders of the node(s) instead of the node
+                (r_in, r_out, ph_in, ph_out, z_in, z_out), each can be an array.
+
+        Returns:
+            Volume of the node
+        """
+        if extent is None:
+            extent = node.parameter['extent']
+        volume = (extent[1] ** 2 - extent[0] ** 2) * \
+                 (extent[3] - extent[2]) * \
+                 (extent[5] - extent[4]) / 2.
+        return volume
 
 
 class Node:
@@ -1244,3 +2148,222 @@ class Node:
         elif grid_type in ['spherical', 'cylindrical']:
             #: Children nodes
             self.children = []
+
+
+class NodeStore:
+    """The NodeStore class includes the parameters of many nodes in the grid as arrays.
+
+    Notes:
+        Models that are not vectorized get a NodeView of each node in init_position
+        and ignore_cell, which can be used like a Node without a dict for each node.
+    """
+
+    def __init__(self, grid_type, columns, constants=None):
+        """Initialisation of the node parameters.
+
+        Args:
+            grid_type (str): Name of the grid type.
+            columns (dict): Array of each parameter with the node index as first dimension.
+            constants (dict): Parameters that are the same for all nodes.
+        """
+        #: dict: Array of each parameter that differs between the nodes
+        self.columns = columns
+        #: dict: Parameters that are the same for all nodes (with the defaults of Node)
+        self.constants = dict(Node(grid_type).parameter, **(constants or {}))
+        #: int: Number of nodes
+        self.nr_nodes = len(columns['position'])
+
+    def __len__(self):
+        return self.nr_nodes
+
+    def __getitem__(self, i_node):
+        return NodeView(self, i_node)
+
+    def __iter__(self):
+        for i_node in range(self.nr_nodes):
+            yield NodeView(self, i_node)
+
+    def get_parameter(self, i_node, name):
+        """Parameter of one node.
+
+        Args:
+            i_node (int): Index of the node.
+            name (str): Name of the parameter (e.g. 'position').
+
+        Returns:
+            Value of the parameter.
+        """
+        if name in self.columns:
+            return self.columns[name][i_node]
+        return self.constants[name]
+
+    def set_parameter(self, i_node, name, value):
+        """Changes a parameter of one node.
+
+        Args:
+            i_node (int): Index of the node.
+            name (str): Name of the parameter.
+            value: New value of the parameter.
+        """
+        if name not in self.columns:
+            # Constants become a column if they are changed for one node
+            self.columns[name] = [self.constants.get(name)] * self.nr_nodes
+        self.columns[name][i_node] = value
+
+
+class NodeView:
+    """The NodeView class is one node of a NodeStore with the interface of Node.
+
+    Notes:
+        node.parameter['position'] reads the column of the NodeStore, since
+        the parameter of a NodeView is the NodeView itself.
+    """
+
+    __slots__ = ('store', 'i_node')
+
+    def __init__(self, store, i_node):
+        """Initialisation of the view.
+
+        Args:
+            store (NodeStore): Parameters of the nodes.
+            i_node (int): Index of the node in the store.
+        """
+        #: NodeStore: Parameters of the nodes
+        self.store = store
+        #: int: Index of the node in the store
+        self.i_node = i_node
+
+    @property
+    def parameter(self):
+        """Parameters of the node (like Node.parameter).
+
+        Returns:
+            NodeView: The view itself.
+        """
+        return self
+
+    def __getitem__(self, name):
+        return self.store.get_parameter(self.i_node, name)
+
+    def __setitem__(self, name, value):
+        self.store.set_parameter(self.i_node, name, value)
+
+    def __contains__(self, name):
+        return name in self.store.columns or name in self.store.constants
+
+    def get(self, name, default=None):
+        """Parameter of the node (default if the node has no parameter of this name).
+
+        Args:
+            name (str): Name of the parameter.
+            default: Value if the node has no parameter of this name.
+
+        Returns:
+            Value of the parameter.
+        """
+        return self[name] if name in self else default
+
+
+#: Grid: Grid instance of a worker process (see Grid.calculate_chunks)
+worker_grid = None
+
+
+def init_worker(grid):
+    """Sets the grid of a worker process.
+
+    Args:
+        grid: Grid instance (inherited by forking the process).
+    """
+    global worker_grid
+    worker_grid = grid
+
+
+def calculate_chunk_in_worker(i_chunk):
+    """Calculates one chunk of the grid in a worker process.
+
+    Args:
+        i_chunk (int): Index of the chunk.
+
+    Returns:
+        dict: Calculated chunk with its arrays moved into shared memory (see share_arrays).
+    """
+    chunk = worker_grid.calculate_chunk(i_chunk)
+    chunk['arrays'] = share_arrays(chunk['arrays'])
+    return chunk
+
+
+def share_arrays(arrays):
+    """Copies arrays into shared memory blocks to avoid pickling them.
+
+    Args:
+        arrays (dict): Arrays to share.
+
+    Returns:
+        dict: Name, dtype and shape of the shared memory block of each array.
+    """
+    shared_arrays = {}
+    try:
+        for key, array in arrays.items():
+            block = create_shared_block(max(array.nbytes, 1))
+            shared_arrays[key] = (block.name, array.dtype.str, array.shape)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            block.close()
+    except BaseException:
+        discard_arrays(shared_arrays)
+        raise
+    return shared_arrays
+
+
+def create_shared_block(size):
+    """Creates a shared memory block that is not removed by the resource tracker.
+
+    Notes:
+        The receiving process is responsible for removing the block (see receive_arrays),
+        since the block would be removed when the worker process ends otherwise.
+        Before Python 3.13, the block can only be unregistered with its private name.
+
+    Args:
+        size (int): Size of the block in bytes.
+
+    Returns:
+        SharedMemory: Created shared memory block.
+    """
+    if version_info >= (3, 13):
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+def receive_arrays(shared_arrays):
+    """Copies arrays out of shared memory blocks and removes the blocks.
+
+    Args:
+        shared_arrays (dict): Name, dtype and shape of the shared memory blocks (see share_arrays).
+
+    Returns:
+        dict: Received arrays.
+    """
+    arrays = {}
+    for key, (name, dtype, shape) in shared_arrays.items():
+        block = shared_memory.SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf).copy()
+        block.close()
+        block.unlink()
+    return arrays
+
+
+def discard_arrays(shared_arrays):
+    """Removes shared memory blocks without receiving their arrays.
+
+    Args:
+        shared_arrays (dict): Name, dtype and shape of the shared memory blocks (see share_arrays).
+    """
+    for name, _, _ in shared_arrays.values():
+        try:
+            block = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            # Already removed (e.g. partially received)
+            continue
+        block.close()
+        block.unlink()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+import numpy as np
+from polaris_tools_modules.grid_file import GridLayout, GridWriter
+
+
+class GridArchive(GridLayout):
+    """Chunked and compressed HDF5 or Zarr container of a POLARIS grid file.
+
+    Notes:
+        The container has one dataset per quantity ID in the group 'quantities'
+        (with one column per density distribution if the ID occurs multiple times),
+        the geometry in the group 'geometry' (border lists, n_ph and dz_list of
+        cylindrical grids, is_leaf and level of the octree nodes) and the header
+        values as attributes. The rows of the quantities are the cells in the order
+        of the grid file (the leaves for octree grids), so that the binary grid file
+        can be restored without any difference.
+        h5py (.h5, .hdf5) or zarr (.zarr) are only imported if a container is used.
+    """
+
+    #: int: Version of the layout of the container
+    format_version = 1
+
+    #: int: Compression level of the HDF5 datasets (gzip)
+    compression_level = 4
+
+    def __init__(self, filename, mode='r'):
+        """Initialisation of the container.
+
+        Args:
+            filename (str): Path to the container (.h5, .hdf5 or .zarr).
+            mode (str): Mode of the container ('r': read, 'w': create).
+        """
+        self.filename = filename
+        #: str: Package used for the container (h5py or zarr)
+        self.backend = self.get_backend(filename)
+        if self.backend == 'h5py':
+            import h5py
+            self.container = h5py.File(filename, mode)
+        else:
+            import zarr
+            self.container = zarr.open_group(filename, mode=mode)
+
+        #: dict: Header parameter (grid_type, n_r, sf_r, ...)
+        self.parameter = {}
+        #: dict: Cell borders (radius_list, phi_list, theta_list, z_list) of the custom distributions
+        self.border_lists = {}
+        #: ndarray: Number of phi cells of each radial ring (cylindrical grids)
+        self.n_ph = None
+        #: ndarray: Width of the vertical cells of each radial ring (cylindrical grids with sf_z = -1)
+        self.dz_list = None
+        if mode == 'r':
+            self.read_header()
+
+    @staticmethod
+    def get_backend(filename):
+        """Finds the package for the container from the file extension and checks if it is installed.
+
+        Args:
+            filename (str): Path to the container.
+
+        Returns:
+            str: Name of the package (h5py or zarr).
+        """
+        if filename.rstrip('/').endswith('.zarr'):
+            backend = 'zarr'
+        elif filename.endswith('.h5') or filename.endswith('.hdf5'):
+            backend = 'h5py'
+        else:
+            raise ValueError('The container ' + filename + ' needs the extension .h5, .hdf5 or .zarr!')
+        try:
+            __import__(backend)
+        except ImportError:
+            raise ImportError('The container ' + filename + ' needs the python package ' + backend +
+                              ' (pip install ' + backend + ')!')
+        return backend
+
+    def close(self):
+        """Closes the container (HDF5 files are only complete after closing them).
+        """
+        if self.backend == 'h5py':
+            self.container.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def create_dataset(self, group, name, shape, dtype, chunk_size):
+        """Creates a chunked and compressed dataset.
+
+        Args:
+            group (str): Name of the group of the dataset.
+            name (str): Name of the dataset.
+            shape (tuple): Shape of the dataset.
+            dtype: Data type of the dataset.
+            chunk_size (int): Number of rows per chunk.
+
+        Returns:
+            Dataset of h5py or array of zarr.
+        """
+        chunks = (max(1, min(chunk_size, shape[0])),) + tuple(shape[1:])
+        container_group = self.container.require_group(group)
+        if self.backend == 'h5py':
+            # Shuffling the bytes of the values improves the compression of floats
+            return container_group.create_dataset(name, shape=shape, dtype=dtype, chunks=chunks, shuffle=True,
+                                                  compression='gzip', compression_opts=self.compression_level)
+        if hasattr(container_group, 'create_array'):
+            return container_group.create_array(name, shape=shape, dtype=dtype, chunks=chunks)
+        return container_group.create_dataset(name, shape=shape, dtype=dtype, chunks=chunks)
+
+    def get_quantity_columns(self, quantity_ids):
+        """Dataset and column of each data column of the grid.
+
+        Args:
+            quantity_ids (List): ID of each data column.
+
+        Returns:
+            dict: Index of the data columns of each dataset.
+        """
+        columns = {}
+        for i_column, quantity_id in enumerate(quantity_ids):
+            name = self.quantity_names.get(int(quantity_id), 'id_' + str(quantity_id))
+            columns.setdefault(name, []).append(i_column)
+        return columns
+
+    def get_ring_cells(self, i_r_start, i_r_end):
+        """Cells of a range of radial rings (or shells) in the order of the grid file.
+
+        Args:
+            i_r_start (int): Index of the first radial ring.
+            i_r_end (int): Index after the last radial ring.
+
+        Returns:
+            slice: Rows of the cells.
+        """
+        if self.parameter['grid_type'] == 'octree':
+            raise ValueError('Octree grids have no radial rings!')
+        if self.parameter['grid_type'] == 'spherical':
+            ring_cells = np.full(self.parameter['n_r'], self.parameter['n_ph'] * self.parameter['n_th'])
+        else:
+            ring_cells = self.n_ph * self.parameter['n_z']
+        first_cell = np.concatenate(([0], np.cumsum(ring_cells)))
+        return slice(int(first_cell[i_r_start]), int(first_cell[i_r_end]))
+
+    def get_chunk_size(self, chunk_size):
+        """Number of rows per chunk that does not split radial rings (if possible).
+
+        Args:
+            chunk_size (int): Preferred number of rows per chunk.
+
+        Returns:
+            int: Number of rows per chunk.
+        """
+        if self.parameter['grid_type'] == 'octree' or (
+                self.parameter['grid_type'] == 'cylindrical' and np.any(self.n_ph != self.n_ph[0])):
+            return chunk_size
+        ring_cells = self.get_ring_cells(0, 1).stop
+        return max(1, chunk_size // ring_cells) * ring_cells
+
+    def write_grid(self, grid_file, model_parameter=None, chunk_size=65536):
+        """Writes a grid file into the container chunk by chunk.
+
+        Args:
+            grid_file (GridFile): Opened grid file (OcTreeFile without index for octree grids).
+            model_parameter (dict): Parameters of the model stored as attribute (JSON).
+            chunk_size (int): Number of cells (or leaves) per chunk.
+        """
+        self.parameter = grid_file.parameter
+        self.border_lists = grid_file.border_lists
+        self.n_ph = grid_file.n_ph
+        self.dz_list = grid_file.dz_list
+        attributes = dict(self.parameter, format_version=self.format_version,
+                          grid_id=self.grid_ids[self.parameter['grid_type']],
+                          quantity_ids=[int(quantity_id) for quantity_id in grid_file.quantity_ids])
+        if model_parameter is not None:
+            # Arrays and other values of the model are stored as lists or strings
+            attributes['model_parameter'] = json.dumps(model_parameter, default=lambda value: (
+                np.asarray(value).tolist() if isinstance(value, (np.ndarray, np.generic)) else str(value)))
+        for key, value in attributes.items():
+            self.container.attrs[key] = value
+
+        for name, values in list(self.border_lists.items()) + [('n_ph', self.n_ph), ('dz_list', self.dz_list)]:
+            if values is not None:
+                self.create_dataset('geometry', name, np.shape(values), np.asarray(values).dtype,
+                                    chunk_size)[:] = values
+
+        columns = self.get_quantity_columns(grid_file.quantity_ids)
+        if self.parameter['grid_type'] == 'octree':
+            self.write_octree(grid_file, columns, chunk_size)
+            return
+        chunk_size = self.get_chunk_size(chunk_size)
+        datasets = {name: self.create_dataset('quantities', name, (len(grid_file.data),) + (
+            (len(i_columns),) if len(i_columns) > 1 else ()), np.float64, chunk_size)
+                    for name, i_columns in columns.items()}
+        for i_cell in range(0, len(grid_file.data), chunk_size):
+            cell_data = np.asarray(grid_file.data[i_cell:i_cell + chunk_size])
+            for name, i_columns in columns.items():
+                datasets[name][i_cell:i_cell + len(cell_data)] = np.squeeze(cell_data[:, i_columns], axis=1) \
+                    if len(i_columns) == 1 else cell_data[:, i_columns]
+
+    def write_octree(self, grid_file, columns, chunk_size):
+        """Writes the nodes of an octree grid file into the container chunk by chunk.
+
+        Args:
+            grid_file (OcTreeFile): Opened octree grid file.
+            columns (dict): Index of the data columns of each dataset.
+            chunk_size (int): Number of leaves per chunk.
+        """
+        # The number of nodes and leaves is only known after reading all nodes once
+        nr_nodes = 0
+        nr_leaves = 0
+        for is_leaf, _, _ in grid_file.get_node_chunks(chunk_size):
+            nr_nodes += len(is_leaf)
+            nr_leaves += int(np.sum(is_leaf))
+        node_datasets = {name: self.create_dataset('geometry', name, (nr_nodes,), np.uint16, 8 * chunk_size)
+                         for name in ['is_leaf', 'level']}
+        datasets = {name: self.create_dataset('quantities', name, (nr_leaves,) + (
+            (len(i_columns),) if len(i_columns) > 1 else ()), np.float32, chunk_size)
+                    for name, i_columns in columns.items()}
+        i_node = 0
+        i_leaf = 0
+        for is_leaf, levels, leaf_data in grid_file.get_node_chunks(chunk_size):
+            node_datasets['is_leaf'][i_node:i_node + len(is_leaf)] = is_leaf
+            node_datasets['level'][i_node:i_node + len(is_leaf)] = levels
+            for name, i_columns in columns.items():
+                datasets[name][i_leaf:i_leaf + len(leaf_data)] = np.squeeze(leaf_data[:, i_columns], axis=1) \
+                    if len(i_columns) == 1 else leaf_data[:, i_columns]
+            i_node += len(is_leaf)
+            i_leaf += len(leaf_data)
+
+    def read_header(self):
+        """Reads the header values and the geometry of the grid from the container.
+        """
+        attributes = dict(self.container.attrs)
+        if attributes.get('format_version') != self.format_version:
+            raise ValueError('The container ' + self.filename + ' has an unknown format version!')
+        self.parameter['grid_type'] = self.get_grid_type(int(attributes['grid_id']))
+        #: ndarray: ID of each data column
+        self.quantity_ids = np.asarray(attributes['quantity_ids'], dtype=int)
+        #: int: Number of quantities per grid cell
+        self.data_length = len(self.quantity_ids)
+        header_dtype = getattr(self, self.parameter['grid_type'] + '_header')
+        for name in header_dtype.names:
+            self.parameter[name] = np.asarray(attributes[name]).astype(header_dtype[name]).item()
+
+        geometry = self.container['geometry'] if 'geometry' in self.container else {}
+        for name in ['radius_list', 'phi_list', 'theta_list', 'z_list']:
+            if name in geometry:
+                self.border_lists[name] = geometry[name][:]
+        if self.parameter['grid_type'] == 'cylindrical':
+            self.n_ph = np.full(self.parameter['n_r'], self.parameter['n_ph'], dtype=int)
+            if 'n_ph' in geometry:
+                self.n_ph = geometry['n_ph'][:].astype(int)
+            if 'dz_list' in geometry:
+                self.dz_list = geometry['dz_list'][:]
+
+    def get_model_parameter(self):
+        """Parameters of the model that were stored with the grid.
+
+        Returns:
+            dict: Parameters of the model (None if not stored).
+        """
+        if 'model_parameter' not in self.container.attrs:
+            return None
+        return json.loads(self.container.attrs['model_parameter'])
+
+    def get_quantity(self, quantity, cells=slice(None), radial_range=None):
+        """Reads one quantity of some cells (only the chunks of these cells are read).
+
+        Args:
+            quantity (str or int): Name (e.g. 'gas_mass_density') or ID of the quantity.
+            cells: Index, indices or slice of the cells (leaves) in the order of the grid file.
+            radial_range (tuple): Index of the first and after the last radial ring
+                (used instead of cells, see get_ring_cells).
+
+        Returns:
+            ndarray: Data of the quantity (with one column per data column, if the ID
+            occurs multiple times).
+        """
+        if not isinstance(quantity, str):
+            quantity = self.quantity_names.get(int(quantity), 'id_' + str(quantity))
+        if quantity not in self.container['quantities']:
+            raise ValueError('Quantity ' + str(quantity) + ' is not in the container ' + self.filename + '!')
+        if radial_range is not None:
+            cells = self.get_ring_cells(*radial_range)
+        return self.container['quantities'][quantity][cells]
+
+    def write_binary(self, binary_file, chunk_size=65536):
+        """Restores the binary grid file chunk by chunk.
+
+        Args:
+            binary_file: Binary grid file opened for writing.
+            chunk_size (int): Number of cells (or leaves) per chunk.
+        """
+        writer = GridWriter(binary_file)
+        writer.write_grid_header(self)
+        columns = self.get_quantity_columns(self.quantity_ids)
+        datasets = {name: self.container['quantities'][name] for name in columns.keys()}
+        nr_rows = datasets[next(iter(columns))].shape[0] if len(columns) > 0 else 0
+
+        def get_rows(rows):
+            data = np.zeros((rows.stop - rows.start, self.data_length))
+            for name, i_columns in columns.items():
+                data[:, i_columns] = np.reshape(datasets[name][rows], (len(data), len(i_columns)))
+            return data
+
+        if self.parameter['grid_type'] != 'octree':
+            if nr_rows != self.count_cells(self.parameter, self.n_ph):
+                raise ValueError('The container ' + self.filename + ' does not contain all cells of the grid!')
+            for i_cell in range(0, nr_rows, chunk_size):
+                writer.write_cell_data(get_rows(slice(i_cell, min(i_cell + chunk_size, nr_rows))))
+            return
+
+        node_datasets = self.container['geometry']
+        nr_nodes = node_datasets['is_leaf'].shape[0]
+        i_leaf = 0
+        for i_node in range(0, nr_nodes, chunk_size):
+            is_leaf = node_datasets['is_leaf'][i_node:i_node + chunk_size] != 0
+            levels = node_datasets['level'][i_node:i_node + chunk_size]
+            leaves = slice(i_leaf, i_leaf + int(np.sum(is_leaf)))
+            writer.write_octree_nodes(is_leaf, levels, get_rows(leaves))
+            i_leaf = leaves.stop
+        if i_leaf != nr_rows:
+            raise ValueError('The container ' + self.filename + ' does not fit to the octree nodes!')
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from sys import stdout
+
+import numpy as np
+from polaris_tools_modules.grid import Grid
+from polaris_tools_modules.octree import LinearOcTree
+
+
+class SnapshotGrid:
+    """Creates octree grids from particle (SPH) snapshots.
+
+    Notes:
+        The octree is refined until each leaf contains at most max_particles particles.
+        The particles are binned with their Morton keys at the deepest level, so that
+        the number of particles of all nodes of one level is found with searchsorted.
+        The mass of each particle is distributed over the leaves with its kernel
+        (cubic spline with compact support at the smoothing length), which is sampled
+        on a fixed stencil and normalized per particle. Therefore, the total mass of
+        the grid is the total mass of the particles. Temperatures, magnetic field and
+        velocity are averaged over the leaves weighted by the distributed mass.
+    """
+
+    #: dict: Names of the datasets in Gadget like HDF5 snapshots
+    dataset_names = {
+        'Coordinates': 'position',
+        'Masses': 'mass',
+        'SmoothingLength': 'smoothing_length',
+        'Velocities': 'velocity_field',
+        'MagneticField': 'magnetic_field',
+        'Temperature': 'gas_temperature',
+        'DustTemperature': 'dust_temperature',
+    }
+
+    #: List: Optional quantities of the particles in the order of the grid data (see Grid.accessor_ids)
+    quantities = ['dust_temperature', 'gas_temperature', 'magnetic_field', 'velocity_field']
+
+    #: int: Number of kernel samples per axis of the stencil (odd to include the particle position)
+    kernel_samples = 5
+
+    #: int: Number of kernel samples that are located at once (limits the memory)
+    chunk_samples = 262144
+
+    def __init__(self, particles, sidelength=None, max_particles=8, max_tree_level=20):
+        """Initialisation of the snapshot grid.
+
+        Args:
+            particles (dict): Position [m], mass [kg] and smoothing_length [m] of the particles
+                and optionally dust_temperature, gas_temperature [K], magnetic_field [T]
+                and velocity_field [m/s] (see read_snapshot).
+            sidelength (float): Width of the root node centered at the origin
+                (smallest cube that contains the kernels of all particles if None).
+            max_particles (int): Maximum number of particles per leaf.
+            max_tree_level (int): Maximum level of the octree.
+        """
+        missing = [name for name in ['position', 'mass', 'smoothing_length'] if name not in particles]
+        if len(missing) > 0:
+            raise ValueError('The snapshot does not contain ' + ', '.join(missing) + '!')
+        if max_tree_level > LinearOcTree.max_level:
+            raise ValueError('Octree grids with more than ' + str(LinearOcTree.max_level) +
+                             ' levels are not supported!')
+        self.particles = particles
+        self.positions = np.asarray(particles['position'], dtype=float).reshape(-1, 3)
+        if sidelength is None:
+            # Include the kernel of each particle
+            sidelength = 2. * np.max(np.abs(self.positions) + np.reshape(
+                particles['smoothing_length'], (-1, 1))) * (1. + 1e-6)
+        elif np.any(np.abs(self.positions) > sidelength / 2.):
+            raise ValueError('The particles are not inside of the octree grid (increase the sidelength)!')
+        self.sidelength = sidelength
+        self.max_particles = max_particles
+        self.max_tree_level = max_tree_level
+        #: List: Optional quantities given in the snapshot
+        self.snapshot_quantities = [quantity for quantity in self.quantities if quantity in particles]
+
+    @classmethod
+    def read_snapshot(cls, filename, group=None):
+        """Reads the particles of a snapshot.
+
+        Notes:
+            .npy files contain a structured array with one field per quantity, .npz files
+            one array per quantity. HDF5 files (.h5, .hdf5, needs h5py) contain one dataset
+            per quantity (in the group, e.g. PartType0) with the names of read_snapshot or
+            the Gadget names (see dataset_names). All values are in SI units.
+
+        Args:
+            filename (str): Path to the snapshot.
+            group (str): Group of the particle datasets in HDF5 snapshots.
+
+        Returns:
+            dict: Arrays of the particles (see __init__).
+        """
+        names = ['position', 'mass', 'smoothing_length'] + cls.quantities
+        if filename.endswith('.npy'):
+            snapshot = np.load(filename, mmap_mode='r')
+            if snapshot.dtype.names is None:
+                raise ValueError('The snapshot ' + filename + ' needs one field per quantity!')
+            return {name: snapshot[name] for name in snapshot.dtype.names if name in names}
+        if filename.endswith('.npz'):
+            with np.load(filename) as snapshot:
+                return {name: snapshot[name] for name in snapshot.files if name in names}
+        if filename.endswith('.h5') or filename.endswith('.hdf5'):
+            try:
+                import h5py
+            except ImportError:
+                raise ImportError('The snapshot ' + filename + ' needs the python package h5py (pip install h5py)!')
+            with h5py.File(filename, 'r') as snapshot:
+                datasets = snapshot[group] if group is not None else snapshot
+                return {cls.dataset_names.get(name, name): datasets[name][()] for name in datasets.keys()
+                        if cls.dataset_names.get(name, name) in names}
+        raise ValueError('The snapshot ' + filename + ' needs the extension .npy, .npz, .h5 or .hdf5!')
+
+    def get_quantity_ids(self):
+        """IDs of the data columns (gas mass density and the quantities of the snapshot).
+
+        Returns:
+            List: ID of each data column.
+        """
+        quantity_ids = [28]
+        for quantity in self.snapshot_quantities:
+            quantity_ids += Grid.accessor_ids[quantity]
+        return quantity_ids
+
+    def refine_octree(self):
+        """Refines the octree until each leaf contains at most max_particles particles.
+
+        Returns:
+            LinearOcTree: Leaves of the octree (without data).
+        """
+        max_level = self.max_tree_level
+        nr_cells = 2 ** max_level
+        coords = np.floor((self.positions / self.sidelength + 0.5) * nr_cells)
+        particle_keys = np.sort(LinearOcTree.encode_keys(np.clip(coords, 0, nr_cells - 1), max_level))
+
+        keys = []
+        levels = []
+        level_keys = np.zeros(1, dtype=np.uint64)
+        for level in range(max_level + 1):
+            stdout.write('--- Generate cartesian grid: level ' + str(level) + ' of ' +
+                         str(max_level) + ' (' + str(len(level_keys)) + ' nodes)      \r')
+            stdout.flush()
+            # Number of particles in each node from the range of the keys of its descendants
+            shift = np.uint64(3 * (max_level - level))
+            counts = np.searchsorted(particle_keys, (level_keys + np.uint64(1)) << shift) - \
+                np.searchsorted(particle_keys, level_keys << shift)
+            refine = counts > self.max_particles if level < max_level else np.zeros(len(level_keys), dtype=bool)
+            keys.append(level_keys[np.logical_not(refine)])
+            levels.append(np.full(len(keys[-1]), level, dtype=np.uint8))
+            level_keys = ((level_keys[refine, np.newaxis] << np.uint64(3)) + np.arange(8, dtype=np.uint64)).ravel()
+            if len(level_keys) == 0:
+                break
+        return LinearOcTree(self.sidelength, np.concatenate(keys), np.concatenate(levels))
+
+    def get_kernel_stencil(self):
+        """Sample positions and weights of the particle kernel.
+
+        Returns:
+            ndarray: (M, 3) sample positions in units of the smoothing length.
+            ndarray: (M,) kernel weight of each sample (cubic spline, sum is 1).
+        """
+        axis = (2. * np.arange(self.kernel_samples) + 1.) / self.kernel_samples - 1.
+        stencil = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+        q = np.linalg.norm(stencil, axis=1)
+        weights = np.where(q <= 0.5, 1. - 6. * q ** 2 + 6. * q ** 3, 2. * (1. - q) ** 3)
+        inside = q < 1.
+        return stencil[inside], weights[inside] / np.sum(weights[inside])
+
+    def deposit_particles(self, tree):
+        """Distributes the mass (and mass weighted quantities) of the particles over the leaves.
+
+        Args:
+            tree (LinearOcTree): Leaves of the octree.
+
+        Returns:
+            ndarray: (N_leaves, 1 + N_quantities) mass and mass weighted sum of the quantities of each leaf.
+        """
+        masses = np.asarray(self.particles['mass'], dtype=float).ravel()
+        smoothing_lengths = np.asarray(self.particles['smoothing_length'], dtype=float).ravel()
+        values = np.column_stack([np.ones(len(masses))] + [
+            np.asarray(self.particles[quantity], dtype=float).reshape(len(masses), -1)
+            for quantity in self.snapshot_quantities])
+        stencil, weights = self.get_kernel_stencil()
+        leaf_sums = np.zeros((len(tree), values.shape[1]))
+
+        # Samples (particle, leaf, mass) that are added to the leaves at once (see add_samples)
+        samples = []
+        nr_samples = 0
+        chunk_size = max(1, self.chunk_samples // len(stencil))
+        for i_particle in range(0, len(masses), chunk_size):
+            stdout.write('--- Deposit particles: ' + str(round(100.0 * i_particle / len(masses), 3)) + ' %      \r')
+            stdout.flush()
+            particles = slice(i_particle, i_particle + chunk_size)
+            positions = self.positions[particles]
+            leaves = tree.locate(positions)
+            # Particles whose kernel is inside of their leaf add everything to this leaf
+            in_leaf = np.all(np.abs(positions - tree.get_leaf_centers(leaves)) + smoothing_lengths[particles, np.newaxis]
+                             <= tree.get_leaf_sizes(leaves)[:, np.newaxis] / 2., axis=1)
+            chunk_samples = [(i_particle + np.flatnonzero(in_leaf), leaves[in_leaf], masses[particles][in_leaf])]
+            spread = np.flatnonzero(np.logical_not(in_leaf))
+            if len(spread) > 0:
+                sample_positions = positions[spread, np.newaxis, :] + \
+                    smoothing_lengths[particles][spread, np.newaxis, np.newaxis] * stencil
+                spread_leaves = tree.locate(sample_positions.reshape(-1, 3)).reshape(len(spread), len(stencil))
+                # Samples outside of the grid are left out (the particle itself is always inside)
+                spread_weights = np.where(spread_leaves >= 0, weights, 0.)
+                spread_weights /= np.sum(spread_weights, axis=1)[:, np.newaxis]
+                used = spread_weights > 0
+                chunk_samples.append((np.repeat(i_particle + spread, used.sum(axis=1)), spread_leaves[used],
+                                      (masses[particles][spread, np.newaxis] * spread_weights)[used]))
+            samples += chunk_samples
+            nr_samples += sum(len(sample_leaves) for _, sample_leaves, _ in chunk_samples)
+            # The cost of adding the samples is at least the number of leaves
+            if nr_samples >= max(len(tree), self.chunk_samples):
+                self.add_samples(leaf_sums, values, samples)
+                samples = []
+                nr_samples = 0
+        self.add_samples(leaf_sums, values, samples)
+        return leaf_sums
+
+    @staticmethod
+    def add_samples(leaf_sums, values, samples):
+        """Adds the mass and the mass weighted quantities of kernel samples to the leaves.
+
+        Args:
+            leaf_sums (ndarray): (N_leaves, 1 + N_quantities) sums of the leaves (updated in place).
+            values (ndarray): (N_particles, 1 + N_quantities) one and the quantities of each particle.
+            samples (List): Particle index, leaf index and mass of the samples of each chunk.
+        """
+        if len(samples) == 0:
+            return
+        sample_particles, sample_leaves, sample_masses = [np.concatenate(arrays) for arrays in zip(*samples)]
+        for i_column in range(values.shape[1]):
+            column_sums = np.bincount(sample_leaves, weights=sample_masses * values[sample_particles, i_column])
+            leaf_sums[:len(column_sums), i_column] += column_sums
+
+    def create_grid(self, grid_file):
+        """Creates the octree and writes it as POLARIS grid file.
+
+        Args:
+            grid_file: Binary grid file opened for writing.
+
+        Returns:
+            float: Total gas mass of the grid.
+        """
+        tree = self.refine_octree()
+        leaf_sums = self.deposit_particles(tree)
+        data = [leaf_sums[:, :1] / tree.get_leaf_sizes()[:, np.newaxis] ** 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Leaves without particles get zero values
+            data.append(np.where(leaf_sums[:, :1] > 0, leaf_sums[:, 1:] / leaf_sums[:, :1], 0.))
+        tree.data = np.hstack(data)
+        tree.write_grid(grid_file, self.get_quantity_ids())
+        #: int: Number of leaves of the octree
+        self.nr_leaves = len(tree)
+        return float(np.sum(leaf_sums[:, 0]))
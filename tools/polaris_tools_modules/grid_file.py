@@ -0,0 +1,1198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class GridLayout:
+    """The binary layouts of the POLARIS grid files (see Grid.cpp, OcTree.cpp,
+    Spherical.cpp and Cylindrical.cpp).
+
+    Notes:
+        All values are stored in native byte order without padding. The file starts with
+        grid_id (H), data_length (H) and one quantity ID (H) per data column. The grid
+        specific header follows with the optional border lists and the cell data.
+    """
+
+    #: dict: ID of each grid type
+    grid_ids = {
+        'octree': 20,
+        'spherical': 30,
+        'cylindrical': 40,
+    }
+
+    #: dict: Names of the quantity IDs in the grid header
+    quantity_names = {
+        0: 'gas_number_density',
+        1: 'dust_number_density',
+        2: 'dust_temperature',
+        3: 'gas_temperature',
+        4: 'mag_x',
+        5: 'mag_y',
+        6: 'mag_z',
+        7: 'vel_x',
+        8: 'vel_y',
+        9: 'vel_z',
+        10: 'px',
+        11: 'py',
+        12: 'pz',
+        13: 'a_alg',
+        14: 'a_min',
+        15: 'a_max',
+        16: 'size_param',
+        17: 'ratio',
+        18: 'v_turb',
+        19: 'pda',
+        20: 'opiate',
+        21: 'dust_id',
+        22: 'n_th',
+        23: 'T_e',
+        24: 'n_cr',
+        25: 'g_min',
+        26: 'g_max',
+        27: 'p',
+        28: 'gas_mass_density',
+        29: 'dust_mass_density',
+    }
+
+    #: np.dtype: Header of spherical grids (after the quantity IDs)
+    spherical_header = np.dtype([
+        ('inner_radius', np.float64), ('outer_radius', np.float64),
+        ('n_r', np.uint16), ('n_ph', np.uint16), ('n_th', np.uint16),
+        ('sf_r', np.float64), ('sf_ph', np.float64), ('sf_th', np.float64),
+    ])
+
+    #: np.dtype: Header of cylindrical grids (after the quantity IDs)
+    cylindrical_header = np.dtype([
+        ('inner_radius', np.float64), ('outer_radius', np.float64), ('z_max', np.float64),
+        ('n_r', np.uint16), ('n_ph', np.uint16), ('n_z', np.uint16),
+        ('sf_r', np.float64), ('sf_ph', np.float64), ('sf_z', np.float64),
+    ])
+
+    #: np.dtype: Header of octree grids (after the quantity IDs)
+    octree_header = np.dtype([('sidelength', np.float64)])
+
+    #: np.dtype: Header in front of each octree node
+    node_header = np.dtype([('is_leaf', np.uint16), ('level', np.uint16)])
+
+    #: str: Format of the data values in ASCII grid files (exact for float64 values)
+    ascii_float_format = '%.17g'
+
+    @classmethod
+    def get_grid_type(cls, grid_id):
+        """Name of the grid type of a grid ID.
+
+        Args:
+            grid_id (int): ID of the grid type in the grid header.
+
+        Returns:
+            str: Name of the grid type (octree, spherical, cylindrical).
+        """
+        grid_types = {grid_id: grid_type for grid_type, grid_id in cls.grid_ids.items()}
+        if grid_id not in grid_types.keys():
+            raise ValueError('Grid ID ' + str(grid_id) + ' is not known!')
+        return grid_types[grid_id]
+
+    @staticmethod
+    def count_cells(parameter, n_ph=None):
+        """Number of cells of a spherical or cylindrical grid (including the cells in the center).
+
+        Args:
+            parameter (dict): Header parameter (grid_type, n_r, n_ph, n_th or n_z).
+            n_ph (ndarray): Number of phi cells of each radial ring (cylindrical grids).
+
+        Returns:
+            int: Number of cells.
+        """
+        if parameter['grid_type'] == 'spherical':
+            return parameter['n_r'] * parameter['n_ph'] * parameter['n_th'] + 1
+        return (int(np.sum(n_ph)) + 1) * parameter['n_z']
+
+
+class GridWriter(GridLayout):
+    """Writes POLARIS grid files block by block from numpy arrays.
+    """
+
+    def __init__(self, grid_file):
+        """Initialisation of the grid writer.
+
+        Args:
+            grid_file: Binary grid file opened for writing.
+        """
+        self.grid_file = grid_file
+
+    def write_array(self, values, dtype):
+        """Writes an array with one buffer write.
+
+        Args:
+            values (ndarray): Values to write.
+            dtype: Data type of the values in the grid file.
+        """
+        self.grid_file.write(np.ascontiguousarray(values, dtype=dtype))
+
+    def write_general_header(self, grid_type, quantity_ids):
+        """Writes grid ID, data length and quantity IDs.
+
+        Args:
+            grid_type (str): Name of the grid type (octree, spherical, cylindrical).
+            quantity_ids (List): ID of each data column.
+        """
+        if grid_type not in self.grid_ids.keys():
+            raise ValueError('Grid type: ' + str(grid_type) + 'is not known!')
+        self.write_array([self.grid_ids[grid_type], len(quantity_ids)] + list(quantity_ids), np.uint16)
+
+    def write_octree_header(self, sidelength, is_leaf, level=0):
+        """Writes the octree header with the header of the root node.
+
+        Args:
+            sidelength (float): Width of the root node.
+            is_leaf (bool): Is the root node a leaf?
+            level (int): Level of the root node.
+        """
+        self.write_array(sidelength, np.float64)
+        self.write_node_headers([is_leaf], [level])
+
+    def write_spherical_header(self, sp_param, radius_list=None, phi_list=None, theta_list=None):
+        """Writes the spherical header with the custom border lists.
+
+        Args:
+            sp_param (dict): Spherical parameter of the model.
+            radius_list (List): Radial cell borders (written if sf_r is 0).
+            phi_list (List): Phi cell borders (written if sf_ph is 0).
+            theta_list (List): Theta cell borders (written if sf_th is 0).
+        """
+        header = np.zeros(1, dtype=self.spherical_header)
+        for name in self.spherical_header.names:
+            header[name] = sp_param[name]
+        self.write_array(header, self.spherical_header)
+        for sf, border_list in [('sf_r', radius_list), ('sf_ph', phi_list), ('sf_th', theta_list)]:
+            if sp_param[sf] == 0:
+                self.write_array(border_list[1:-1], np.float64)
+
+    def write_cylindrical_header(self, cy_param, radius_list=None, phi_list=None, z_list=None, dz_list=None):
+        """Writes the cylindrical header with the custom border lists.
+
+        Args:
+            cy_param (dict): Cylindrical parameter of the model (n_ph as list per ring).
+            radius_list (List): Radial cell borders (written if sf_r is 0).
+            phi_list (List): Phi cell borders (written if sf_ph is 0).
+            z_list (List): Vertical cell borders (written if sf_z is 0).
+            dz_list (List): Vertical cell width of each ring (written if sf_z is -1).
+        """
+        header = np.zeros(1, dtype=self.cylindrical_header)
+        for name in self.cylindrical_header.names:
+            header[name] = cy_param[name][0] if name == 'n_ph' else cy_param[name]
+        self.write_array(header, self.cylindrical_header)
+        if cy_param['sf_r'] == 0:
+            self.write_array(radius_list[1:-1], np.float64)
+        if cy_param['sf_ph'] == 0:
+            self.write_array(phi_list[1:-1], np.float64)
+        elif cy_param['sf_ph'] == -1:
+            self.write_array(cy_param['n_ph'], np.uint16)
+        if cy_param['sf_z'] == 0:
+            self.write_array(z_list[1:-1], np.float64)
+        elif cy_param['sf_z'] == -1:
+            self.write_array(dz_list, np.float64)
+
+    def write_grid_header(self, grid):
+        """Writes the complete header of a grid that was read from another file.
+
+        Args:
+            grid: Grid with the header values (parameter, quantity_ids, border_lists, n_ph
+                and dz_list as in GridFile).
+        """
+        self.write_general_header(grid.parameter['grid_type'], grid.quantity_ids)
+        if grid.parameter['grid_type'] == 'octree':
+            self.write_array(grid.parameter['sidelength'], np.float64)
+        elif grid.parameter['grid_type'] == 'spherical':
+            self.write_spherical_header(grid.parameter, grid.border_lists.get('radius_list'),
+                                        grid.border_lists.get('phi_list'), grid.border_lists.get('theta_list'))
+        else:
+            self.write_cylindrical_header(dict(grid.parameter, n_ph=grid.n_ph), grid.border_lists.get('radius_list'),
+                                          grid.border_lists.get('phi_list'), grid.border_lists.get('z_list'),
+                                          grid.dz_list)
+
+    def write_cell_data(self, cell_data, dtype=np.float64):
+        """Writes the data of many cells.
+
+        Args:
+            cell_data (ndarray): (N, data_length) data of the cells.
+            dtype: Data type of the cell data (float64 for spherical and cylindrical grids).
+        """
+        self.write_array(cell_data, dtype)
+
+    def write_node_headers(self, is_leaf, level):
+        """Writes the headers of many octree nodes without data in between.
+
+        Args:
+            is_leaf (ndarray): Is the node a leaf?
+            level (ndarray): Level of the node.
+        """
+        self.write_array(self.get_node_headers(is_leaf, level), self.node_header)
+
+    def write_octree_nodes(self, is_leaf, level, leaf_data):
+        """Writes octree nodes in their order in the file (node header and data if it is a leaf).
+
+        Args:
+            is_leaf (ndarray): Is the node a leaf?
+            level (ndarray): Level of the node.
+            leaf_data (ndarray): (N_leaves, data_length) data of the leaves in the order of the nodes.
+
+        Returns:
+            ndarray: Position of the data of each leaf in 4 byte words after the first node.
+        """
+        is_leaf = np.asarray(is_leaf, dtype=bool)
+        data_length = np.shape(leaf_data)[1]
+        # Each node header (is_leaf, level) and each data value has 4 bytes
+        node_length = 1 + is_leaf * data_length
+        node_offset = np.concatenate(([0], np.cumsum(node_length)[:-1]))
+        words = np.zeros(np.sum(node_length), dtype=np.uint32)
+        words.view(self.node_header)[node_offset] = self.get_node_headers(is_leaf, level)
+        leaf_offsets = node_offset[is_leaf] + 1
+        words.view(np.float32)[leaf_offsets[:, np.newaxis] + np.arange(data_length)] = leaf_data
+        self.write_array(words, np.uint32)
+        return leaf_offsets
+
+    def get_node_headers(self, is_leaf, level):
+        """Combines is_leaf and level into octree node headers.
+
+        Args:
+            is_leaf (ndarray): Is the node a leaf?
+            level (ndarray): Level of the node.
+
+        Returns:
+            ndarray: Node headers.
+        """
+        headers = np.zeros(len(is_leaf), dtype=self.node_header)
+        headers['is_leaf'] = is_leaf
+        headers['level'] = level
+        return headers
+
+
+class GridFile(GridLayout):
+    """Reads spherical and cylindrical POLARIS grid files via memory maps.
+
+    Notes:
+        The header is parsed once and the cell data is only mapped into memory,
+        which allows to inspect large grids (e.g. the grids written by POLARIS after
+        the temperature calculation) without reading them completely.
+    """
+
+    def __init__(self, filename, mode='r'):
+        """Initialisation of the grid file.
+
+        Args:
+            filename (str): Path to the binary grid file.
+            mode (str): Mode of the memory map ('r': read only, 'r+': modify the cell data).
+        """
+        self.filename = filename
+        self.mode = mode
+
+        #: dict: Header parameter (grid_type, n_r, sf_r, ...)
+        self.parameter = {}
+        #: dict: Cell borders (radius_list, phi_list, theta_list, z_list) of the custom distributions
+        self.border_lists = {}
+        #: ndarray: Number of phi cells of each radial ring (cylindrical grids)
+        self.n_ph = None
+        #: ndarray: Width of the vertical cells of each radial ring (cylindrical grids with sf_z = -1)
+        self.dz_list = None
+
+        self.read_file()
+
+    @classmethod
+    def read_grid_type(cls, filename):
+        """Reads only the grid type of a grid file (to choose between GridFile and OcTreeFile).
+
+        Args:
+            filename (str): Path to the binary grid file.
+
+        Returns:
+            str: Name of the grid type (octree, spherical, cylindrical).
+        """
+        with open(filename, 'rb') as grid_file:
+            buffer = grid_file.read(2)
+        if len(buffer) != 2:
+            raise ValueError('The grid file ' + filename + ' ends within the header!')
+        return cls.get_grid_type(int(np.frombuffer(buffer, dtype=np.uint16)[0]))
+
+    def read_file(self):
+        """Reads the header and maps the cell data of the grid file into memory.
+        """
+        with open(self.filename, 'rb') as grid_file:
+            self.read_header(grid_file)
+            #: int: Position of the cell data in the grid file
+            self.data_offset = grid_file.tell()
+
+        self.map_data()
+
+    def map_data(self):
+        """Maps the cell data of the grid file into memory.
+        """
+        #: np.memmap: (nr_cells, data_length) data of all cells in the order of the grid file
+        self.data = np.memmap(self.filename, dtype=np.float64, mode=self.mode, offset=self.data_offset,
+                              shape=(self.get_nr_cells(), self.data_length))
+
+    def read_array(self, grid_file, dtype, count=1):
+        """Reads an array from the current position of the grid file.
+
+        Args:
+            grid_file: Binary grid file.
+            dtype: Data type of the values in the grid file.
+            count (int): Number of values.
+
+        Returns:
+            ndarray: Values.
+        """
+        dtype = np.dtype(dtype)
+        buffer = grid_file.read(dtype.itemsize * count)
+        if len(buffer) != dtype.itemsize * count:
+            raise ValueError('The grid file ' + self.filename + ' ends within the header!')
+        return np.frombuffer(buffer, dtype=dtype)
+
+    def read_general_header(self, grid_file):
+        """Reads grid ID, data length and quantity IDs.
+
+        Args:
+            grid_file: Binary grid file.
+        """
+        grid_id, data_length = self.read_array(grid_file, np.uint16, 2)
+        self.parameter['grid_type'] = self.get_grid_type(grid_id)
+        #: int: Number of quantities per grid cell
+        self.data_length = int(data_length)
+        #: ndarray: ID of each data column
+        self.quantity_ids = self.read_array(grid_file, np.uint16, self.data_length).astype(int)
+
+    def read_header(self, grid_file):
+        """Reads the grid header including the custom border lists.
+
+        Args:
+            grid_file: Binary grid file.
+        """
+        self.read_general_header(grid_file)
+        if self.parameter['grid_type'] == 'octree':
+            raise ValueError('Octree grids have to be read with OcTreeFile!')
+
+        header_dtype = getattr(self, self.parameter['grid_type'] + '_header')
+        header = self.read_array(grid_file, header_dtype)[0]
+        for name in header_dtype.names:
+            self.parameter[name] = header[name].item()
+
+        if self.parameter['sf_r'] == 0:
+            self.border_lists['radius_list'] = np.concatenate((
+                [self.parameter['inner_radius']],
+                self.read_array(grid_file, np.float64, self.parameter['n_r'] - 1),
+                [self.parameter['outer_radius']]))
+        if self.parameter['grid_type'] == 'spherical':
+            if self.parameter['sf_ph'] == 0:
+                self.border_lists['phi_list'] = np.concatenate((
+                    [0.], self.read_array(grid_file, np.float64, self.parameter['n_ph'] - 1), [2. * np.pi]))
+            if self.parameter['sf_th'] == 0:
+                self.border_lists['theta_list'] = np.concatenate((
+                    [0.], self.read_array(grid_file, np.float64, self.parameter['n_th'] - 1), [np.pi]))
+        else:
+            self.n_ph = np.full(self.parameter['n_r'], self.parameter['n_ph'], dtype=int)
+            if self.parameter['sf_ph'] == 0:
+                self.border_lists['phi_list'] = np.concatenate((
+                    [0.], self.read_array(grid_file, np.float64, self.parameter['n_ph'] - 1), [2. * np.pi]))
+            elif self.parameter['sf_ph'] == -1:
+                self.n_ph = self.read_array(grid_file, np.uint16, self.parameter['n_r']).astype(int)
+            if self.parameter['sf_z'] == 0:
+                self.border_lists['z_list'] = np.concatenate((
+                    [-self.parameter['z_max']], self.read_array(grid_file, np.float64, self.parameter['n_z'] - 1),
+                    [self.parameter['z_max']]))
+            elif self.parameter['sf_z'] == -1:
+                self.dz_list = self.read_array(grid_file, np.float64, self.parameter['n_r'])
+
+    def get_nr_cells(self):
+        """Number of cells in the grid file (including the cells in the center).
+
+        Returns:
+            int: Number of cells.
+        """
+        return self.count_cells(self.parameter, self.n_ph)
+
+    def is_ragged(self):
+        """Does the number of phi cells differ between the radial rings (cylindrical grid with sf_ph = -1)?
+
+        Returns:
+            bool: True if the cell data cannot be shaped as one regular array.
+        """
+        return self.parameter['grid_type'] == 'cylindrical' and np.any(self.n_ph != self.n_ph[0])
+
+    def get_cell_data(self):
+        """Data of the cells without the cells in the center.
+
+        Returns:
+            np.memmap: (n_r, n_ph, n_th, data_length) data of spherical grids,
+            (n_r, n_ph, n_z, data_length) data of cylindrical grids or
+            (sum(n_ph) * n_z, data_length) data of cylindrical grids with
+            different n_ph per ring (see get_ring_data).
+        """
+        if self.parameter['grid_type'] == 'spherical':
+            return self.data[:-1].reshape(self.parameter['n_r'], self.parameter['n_ph'],
+                                          self.parameter['n_th'], self.data_length)
+        cell_data = self.data[:-self.parameter['n_z']]
+        if self.is_ragged():
+            return cell_data
+        return cell_data.reshape(self.parameter['n_r'], self.n_ph[0], self.parameter['n_z'], self.data_length)
+
+    def get_ring_data(self, i_r):
+        """Data of the cells of one radial ring of a cylindrical grid.
+
+        Args:
+            i_r (int): Index of the radial ring.
+
+        Returns:
+            np.memmap: (n_ph[i_r], n_z, data_length) data of the ring.
+        """
+        if self.parameter['grid_type'] != 'cylindrical':
+            raise ValueError('Only cylindrical grids consist of radial rings with various n_ph!')
+        i_start = int(np.sum(self.n_ph[:i_r])) * self.parameter['n_z']
+        i_end = i_start + self.n_ph[i_r] * self.parameter['n_z']
+        return self.data[i_start:i_end].reshape(self.n_ph[i_r], self.parameter['n_z'], self.data_length)
+
+    def get_center_data(self):
+        """Data of the cells in the center (one cell for spherical grids and n_z cells for cylindrical grids).
+
+        Returns:
+            np.memmap: (N_center, data_length) data of the center cells.
+        """
+        if self.parameter['grid_type'] == 'spherical':
+            return self.data[-1:]
+        return self.data[-self.parameter['n_z']:]
+
+    def get_quantity_names(self):
+        """Name of each data column taken from the quantity IDs of the header.
+
+        Returns:
+            List: Name of each data column.
+        """
+        return [self.quantity_names.get(quantity_id, 'id_' + str(quantity_id))
+                for quantity_id in self.quantity_ids]
+
+    def get_columns(self, quantity):
+        """Indices of the data columns of a quantity.
+
+        Args:
+            quantity (str or int): Name (e.g. 'gas_mass_density', 'dust_temperature')
+                or ID of the quantity.
+
+        Returns:
+            List: Indices of the data columns (multiple for multiple density distributions).
+        """
+        if isinstance(quantity, str):
+            columns = [i for i, name in enumerate(self.get_quantity_names()) if name == quantity]
+        else:
+            columns = list(np.flatnonzero(self.quantity_ids == quantity))
+        if len(columns) == 0:
+            raise ValueError('Quantity ' + str(quantity) + ' is not in the grid file ' + self.filename + '!')
+        return columns
+
+    def get_quantity(self, quantity, include_center=False):
+        """Data of one quantity of the cells.
+
+        Args:
+            quantity (str or int): Name or ID of the quantity (see get_columns).
+            include_center (bool): Use the data of all cells in the order of the grid file
+                instead of the shape of get_cell_data?
+
+        Returns:
+            np.memmap: Data of the quantity with the shape of the cell data without
+            the last dimension (one column) or with the column as last dimension
+            (multiple columns of the same quantity).
+        """
+        columns = self.get_columns(quantity)
+        if len(columns) == 1:
+            columns = columns[0]
+        elif columns == list(range(columns[0], columns[-1] + 1)):
+            columns = slice(columns[0], columns[-1] + 1)
+        if include_center:
+            return self.data[:, columns]
+        return self.get_cell_data()[..., columns]
+
+    def set_data(self, values, cells=slice(None), columns=slice(None)):
+        """Overwrites the data of cells (the grid file has to be opened with mode 'r+').
+
+        Args:
+            values (ndarray): New data of the cells.
+            cells: Index, indices or slice of the cells in the order of the grid file.
+            columns: Data columns that are overwritten.
+        """
+        self.data[cells, columns] = values
+
+    def append_columns(self, quantity_ids, column_chunks):
+        """Appends data columns to all cells (the grid file is rewritten chunk by chunk).
+
+        Notes:
+            The new grid file is written next to the grid file and replaces it at the end,
+            so the grid file is unchanged if the new columns cannot be calculated.
+
+        Args:
+            quantity_ids (List): ID of each new data column.
+            column_chunks: Data of the new columns for consecutive cells in the order of
+                the grid file, one (N, len(quantity_ids)) array per chunk.
+        """
+        # Only grid ID, data length and quantity IDs change in the header
+        general_header_size = 2 * (2 + self.data_length)
+        with open(self.filename, 'rb') as grid_file:
+            grid_file.seek(general_header_size)
+            header = grid_file.read(self.data_offset - general_header_size)
+        tmp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(self.filename)),
+                                               suffix='.tmp', delete=False)
+        try:
+            with tmp_file:
+                writer = GridWriter(tmp_file)
+                writer.write_general_header(self.parameter['grid_type'],
+                                            list(self.quantity_ids) + list(quantity_ids))
+                tmp_file.write(header)
+                self.write_appended_data(writer, column_chunks)
+            shutil.copymode(self.filename, tmp_file.name)
+            os.replace(tmp_file.name, self.filename)
+        except BaseException:
+            if os.path.exists(tmp_file.name):
+                os.remove(tmp_file.name)
+            raise
+        del self.data
+        self.read_file()
+
+    def write_appended_data(self, writer, column_chunks):
+        """Writes the data of all cells with the new data columns (see append_columns).
+
+        Args:
+            writer (GridWriter): Writer of the new grid file.
+            column_chunks: Data of the new columns for consecutive cells.
+        """
+        i_cell = 0
+        for columns in column_chunks:
+            columns = np.asarray(columns, dtype=np.float64).reshape(len(columns), -1)
+            if i_cell + len(columns) > len(self.data):
+                raise ValueError('More cells than in the grid file ' + self.filename + '!')
+            writer.write_cell_data(np.hstack((self.data[i_cell:i_cell + len(columns)], columns)))
+            i_cell += len(columns)
+        if i_cell != len(self.data):
+            raise ValueError('The new columns do not cover all cells of the grid file ' + self.filename + '!')
+
+    def get_ascii_header(self):
+        """Values of the header in the ASCII format (see AsciiGridFile).
+
+        Returns:
+            List: Values of each line of the header.
+        """
+        lines = [[self.grid_ids[self.parameter['grid_type']], self.data_length] + list(self.quantity_ids)]
+        names = getattr(self, self.parameter['grid_type'] + '_header').names
+        # Radii (and z_max), number of cells and step width factors in one line each
+        for line_names in [names[:-6], names[-6:-3], names[-3:]]:
+            lines.append([self.parameter[name] for name in line_names])
+        if self.parameter['sf_r'] == 0:
+            lines.append(self.border_lists['radius_list'][1:-1])
+        if self.parameter['sf_ph'] == 0:
+            lines.append(self.border_lists['phi_list'][1:-1])
+        if self.parameter['grid_type'] == 'spherical':
+            if self.parameter['sf_th'] == 0:
+                lines.append(self.border_lists['theta_list'][1:-1])
+        else:
+            if self.parameter['sf_ph'] == -1:
+                lines.append(self.n_ph)
+            if self.parameter['sf_z'] == 0:
+                lines.append(self.border_lists['z_list'][1:-1])
+            elif self.parameter['sf_z'] == -1:
+                lines.append(self.dz_list)
+        return lines
+
+    def get_ascii_chunks(self, chunk_size=65536):
+        """Formats the cell data as lines of the ASCII format chunk by chunk.
+
+        Args:
+            chunk_size (int): Number of cells that are formatted at once.
+
+        Returns:
+            Generator: Lines of consecutive cells.
+        """
+        line_format = ' '.join([self.ascii_float_format] * self.data_length) + '\n'
+        for i_cell in range(0, len(self.data), chunk_size):
+            cell_data = self.data[i_cell:i_cell + chunk_size]
+            yield (line_format * len(cell_data)) % tuple(np.ravel(cell_data).tolist())
+
+    def write_ascii(self, ascii_file, chunk_size=65536):
+        """Writes the grid in the ASCII format (see AsciiGridFile).
+
+        Args:
+            ascii_file: Text file opened for writing.
+            chunk_size (int): Number of cells that are written at once.
+        """
+        for values in self.get_ascii_header():
+            ascii_file.write(' '.join(str(value) for value in np.asarray(values).tolist()) + '\n')
+        for lines in self.get_ascii_chunks(chunk_size):
+            ascii_file.write(lines)
+
+
+class OcTreeFile(GridFile):
+    """Reads octree POLARIS grid files with random access to the leaves.
+
+    Notes:
+        The nodes are stored in depth-first order with is_leaf and level (H, H)
+        in front of each node and data_length float values after each leaf.
+        The file is scanned once to build an index with the position, level and
+        Morton key (path of child indices from the root) of each leaf. The index
+        can be stored next to the grid file to skip the scan next time.
+    """
+
+    #: str: Format of the leaf data in ASCII grid files (exact for float32 values)
+    ascii_float_format = '%.9g'
+
+    def __init__(self, filename, mode='r', index_filename=None, save_index=False, build_index=True):
+        """Initialisation of the octree grid file.
+
+        Args:
+            filename (str): Path to the binary grid file.
+            mode (str): Mode of the memory map ('r': read only, 'r+': modify the leaf data).
+            index_filename (str): Path to the index file (default: filename + '.index.npz').
+            save_index (bool): Save the index after scanning the grid file?
+            build_index (bool): Load or create the leaf index? Without the index, the nodes
+                can only be read in their order (see get_node_chunks).
+        """
+        #: str: Path to the index of the leaves
+        self.index_filename = index_filename
+        if self.index_filename is None:
+            self.index_filename = filename + '.index.npz'
+        self.save_index = save_index
+        self.build_index = build_index
+        GridFile.__init__(self, filename, mode)
+
+    def read_header(self, grid_file):
+        """Reads the octree header (the root node is read as first node).
+
+        Args:
+            grid_file: Binary grid file.
+        """
+        self.read_general_header(grid_file)
+        if self.parameter['grid_type'] != 'octree':
+            raise ValueError('Spherical and cylindrical grids have to be read with GridFile!')
+        self.parameter['sidelength'] = self.read_array(grid_file, self.octree_header)[0]['sidelength'].item()
+
+    def map_data(self):
+        """Maps the nodes of the grid file into memory and loads or creates the leaf index.
+        """
+        #: np.memmap: Nodes as 4 byte words (node headers and float leaf data)
+        self.data = np.memmap(self.filename, dtype=np.float32, mode=self.mode, offset=self.data_offset)
+        if self.build_index and not self.load_index():
+            self.scan_nodes()
+            if self.save_index:
+                self.write_index()
+
+    def get_file_stat(self):
+        """Size and modification time of the grid file to check if the index is up to date.
+
+        Returns:
+            ndarray: File size and modification time in ns.
+        """
+        file_stat = os.stat(self.filename)
+        return np.array([file_stat.st_size, file_stat.st_mtime_ns], dtype=np.int64)
+
+    def load_index(self):
+        """Loads the leaf index, if it exists and fits to the grid file.
+
+        Returns:
+            bool: True if the index was loaded.
+        """
+        if not os.path.isfile(self.index_filename):
+            return False
+        with np.load(self.index_filename) as index:
+            if not np.array_equal(index['file_stat'], self.get_file_stat()):
+                return False
+            #: ndarray: Position of the leaf data in 4 byte words after data_offset
+            self.leaf_offsets = index['leaf_offsets']
+            #: ndarray: Level of each leaf
+            self.leaf_levels = index['leaf_levels']
+            #: ndarray: Morton key of each leaf (3 bits per level, child index of the root in front)
+            self.leaf_keys = index['leaf_keys']
+            #: int: Number of nodes in the grid file
+            self.nr_nodes = int(index['nr_nodes'])
+        return True
+
+    def write_index(self):
+        """Saves the leaf index next to the grid file.
+        """
+        np.savez(self.index_filename, file_stat=self.get_file_stat(), nr_nodes=self.nr_nodes,
+                 leaf_offsets=self.leaf_offsets, leaf_levels=self.leaf_levels, leaf_keys=self.leaf_keys)
+
+    def get_next_node(self, words, node_offsets):
+        """Position of the next node for many nodes at once.
+
+        Args:
+            words (np.memmap): Nodes as 4 byte words.
+            node_offsets (ndarray): Position of the nodes in 4 byte words.
+
+        Returns:
+            ndarray: Position of the node after each node.
+        """
+        header = np.asarray(words[np.minimum(node_offsets, len(words) - 1)]).view(np.uint16)
+        return node_offsets + 1 + self.data_length * (header[0::2] != 0)
+
+    def find_nodes(self, words, start, end, block_size=4096):
+        """Finds the position of all nodes that start in a range of the file.
+
+        Notes:
+            The range is split into blocks of 4 byte words. A node that crosses the start
+            of a block ends within its first data_length + 1 words. Therefore, all blocks
+            are walked at once for each possible first node to find the first node of
+            the next block. Afterwards, the blocks are chained and walked again to get
+            the position of each node.
+
+        Args:
+            words (np.memmap): Nodes as 4 byte words.
+            start (int): Position of the first node in 4 byte words.
+            end (int): End of the range in 4 byte words.
+            block_size (int): Number of 4 byte words per block.
+
+        Returns:
+            ndarray: Position of each node in the range.
+            int: Position of the first node after the range.
+        """
+        block_size = max(block_size, self.data_length + 1)
+        block_start = np.arange(start, end, block_size)
+        block_end = np.minimum(block_start + block_size, end)
+
+        # Walk through each block for each possible position of its first node
+        node_offsets = block_start[:, np.newaxis] + np.arange(self.data_length + 1)
+        nr_block_nodes = np.zeros(node_offsets.shape, dtype=np.int64)
+        in_block = node_offsets < block_end[:, np.newaxis]
+        while np.any(in_block):
+            node_offsets[in_block] = self.get_next_node(words, node_offsets[in_block])
+            nr_block_nodes += in_block
+            in_block = node_offsets < block_end[:, np.newaxis]
+        next_start = (node_offsets - block_end[:, np.newaxis]).tolist()
+        nr_block_nodes = nr_block_nodes.tolist()
+
+        # Chain the blocks starting with the first node
+        first_node = np.zeros(len(block_start), dtype=np.int64)
+        nr_nodes = np.zeros(len(block_start), dtype=np.int64)
+        i_first = 0
+        for i_block in range(len(block_start)):
+            first_node[i_block] = i_first
+            nr_nodes[i_block] = nr_block_nodes[i_block][i_first]
+            i_first = next_start[i_block][i_first]
+
+        # Walk through all blocks again to get the position of each node
+        node_offsets = np.zeros(np.sum(nr_nodes), dtype=np.int64)
+        i_node = np.concatenate(([0], np.cumsum(nr_nodes)[:-1]))
+        position = block_start + first_node
+        in_block = position < block_end
+        while np.any(in_block):
+            node_offsets[i_node[in_block]] = position[in_block]
+            position[in_block] = self.get_next_node(words, position[in_block])
+            i_node += in_block
+            in_block = position < block_end
+        return node_offsets, end + i_first if len(block_start) > 0 else start
+
+    def scan_nodes(self, block_size=4096):
+        """Finds the position of all nodes and calculates the leaf index.
+
+        Args:
+            block_size (int): Number of 4 byte words per block (see find_nodes).
+        """
+        words = self.data.view(np.uint32)
+        node_offsets, next_node = self.find_nodes(words, 0, len(words), block_size)
+        if next_node != len(words):
+            raise ValueError('The octree grid file ' + self.filename + ' is not complete!')
+
+        header = words[node_offsets].view(np.uint16).reshape(-1, 2)
+        is_leaf = header[:, 0] != 0
+        levels = header[:, 1]
+        self.nr_nodes = len(node_offsets)
+
+        # The children of all nodes of one level follow in the same order as their parents
+        keys = np.zeros(self.nr_nodes, dtype=np.uint64)
+        for level in range(1, np.max(levels) + 1):
+            children = np.flatnonzero(levels == level)
+            parents = np.flatnonzero(np.logical_and(levels == level - 1, np.logical_not(is_leaf)))
+            if len(children) != 8 * len(parents):
+                raise ValueError('The nodes of level ' + str(level) + ' do not fit to the octree structure!')
+            keys[children] = np.repeat(keys[parents], 8) * np.uint64(8) + np.tile(np.arange(8, dtype=np.uint64),
+                                                                                 len(parents))
+        self.leaf_offsets = node_offsets[is_leaf] + 1
+        self.leaf_levels = levels[is_leaf].astype(np.uint8)
+        self.leaf_keys = keys[is_leaf]
+
+    def get_node_offset_chunks(self, chunk_size=65536):
+        """Finds the nodes in their order in the grid file chunk by chunk (without the leaf index).
+
+        Args:
+            chunk_size (int): Number of leaves (at most) that are found at once.
+
+        Returns:
+            Generator: Position (in 4 byte words), is_leaf and level of consecutive nodes.
+        """
+        words = self.data.view(np.uint32)
+        i_word = 0
+        while i_word < len(words):
+            node_offsets, i_word = self.find_nodes(
+                words, i_word, min(i_word + chunk_size * (self.data_length + 1), len(words)))
+            if i_word > len(words):
+                raise ValueError('The octree grid file ' + self.filename + ' is not complete!')
+            header = np.asarray(words[node_offsets]).view(np.uint16).reshape(-1, 2)
+            yield node_offsets, header[:, 0] != 0, header[:, 1]
+
+    def get_node_chunks(self, chunk_size=65536):
+        """Reads the nodes in their order in the grid file chunk by chunk (without the leaf index).
+
+        Args:
+            chunk_size (int): Number of leaves (at most) that are read at once.
+
+        Returns:
+            Generator: is_leaf, level and (N_leaves, data_length) leaf data of consecutive nodes.
+        """
+        for node_offsets, is_leaf, levels in self.get_node_offset_chunks(chunk_size):
+            yield is_leaf, levels, self.data[node_offsets[is_leaf, np.newaxis] + 1 + np.arange(self.data_length)]
+
+    def get_nr_leaves(self):
+        """Number of leaves in the grid file.
+
+        Returns:
+            int: Number of leaves.
+        """
+        return len(self.leaf_offsets)
+
+    def get_leaf_data(self, leaves=slice(None)):
+        """Data of the leaves.
+
+        Args:
+            leaves: Index, indices or slice of the leaves in the order of the grid file.
+
+        Returns:
+            ndarray: (N, data_length) data of the leaves.
+        """
+        return self.data[self.leaf_offsets[leaves][..., np.newaxis] + np.arange(self.data_length)]
+
+    def set_leaf_data(self, values, leaves=slice(None), columns=slice(None)):
+        """Overwrites the data of the leaves (the grid file has to be opened with mode 'r+').
+
+        Args:
+            values (ndarray): New data of the leaves.
+            leaves: Index, indices or slice of the leaves in the order of the grid file.
+            columns: Data columns that are overwritten.
+        """
+        self.data[self.leaf_offsets[leaves][..., np.newaxis] + np.arange(self.data_length)[columns]] = values
+
+    def set_data(self, values, cells=slice(None), columns=slice(None)):
+        """Overwrites the data of leaves (see set_leaf_data).
+
+        Args:
+            values (ndarray): New data of the leaves.
+            cells: Index, indices or slice of the leaves in the order of the grid file.
+            columns: Data columns that are overwritten.
+        """
+        self.set_leaf_data(values, cells, columns)
+
+    def write_appended_data(self, writer, column_chunks):
+        """Writes all nodes with the new data columns behind the data of each leaf (see append_columns).
+
+        Args:
+            writer (GridWriter): Writer of the new grid file.
+            column_chunks: Data of the new columns for consecutive leaves.
+        """
+        words = self.data.view(np.uint32)
+        i_leaf = 0
+        i_word = 0
+        for columns in column_chunks:
+            columns = np.asarray(columns, dtype=np.float32).reshape(len(columns), -1)
+            if len(columns) == 0:
+                continue
+            if i_leaf + len(columns) > self.get_nr_leaves():
+                raise ValueError('More leaves than in the grid file ' + self.filename + '!')
+            # Insert the new values after the last data value of each leaf
+            leaf_ends = self.leaf_offsets[i_leaf:i_leaf + len(columns)] + self.data_length
+            writer.write_array(np.insert(words[i_word:leaf_ends[-1]], np.repeat(leaf_ends - i_word, columns.shape[1]),
+                                         columns.view(np.uint32).ravel()), np.uint32)
+            i_leaf += len(columns)
+            i_word = leaf_ends[-1]
+        if i_leaf != self.get_nr_leaves():
+            raise ValueError('The new columns do not cover all leaves of the grid file ' + self.filename + '!')
+        writer.write_array(words[i_word:], np.uint32)
+
+    def get_leaf_sizes(self, leaves=slice(None)):
+        """Width of the leaves.
+
+        Args:
+            leaves: Index, indices or slice of the leaves in the order of the grid file.
+
+        Returns:
+            ndarray: Sidelength of each leaf.
+        """
+        return self.parameter['sidelength'] / 2. ** self.leaf_levels[leaves]
+
+    def get_leaf_centers(self, leaves=slice(None)):
+        """Center positions of the leaves (the root node is centered at the origin).
+
+        Args:
+            leaves: Index, indices or slice of the leaves in the order of the grid file.
+
+        Returns:
+            ndarray: (N, 3) cartesian positions of the leaves.
+        """
+        keys = np.atleast_1d(self.leaf_keys[leaves]).astype(np.int64)
+        levels = np.atleast_1d(self.leaf_levels[leaves]).astype(np.int64)
+        centers = np.zeros((len(keys), 3))
+        for level in range(1, int(np.max(levels, initial=0)) + 1):
+            # Child index of the node in this level (bit 0: x, bit 1: y, bit 2: z, see OcTree.create_grid)
+            in_level = levels >= level
+            child_index = (keys >> (3 * np.maximum(levels - level, 0))) & 7
+            offset = in_level * self.parameter['sidelength'] / 2. ** (level + 1)
+            for i_axis in range(3):
+                centers[:, i_axis] += (2 * ((child_index >> i_axis) & 1) - 1) * offset
+        if np.ndim(self.leaf_keys[leaves]) == 0:
+            return centers[0]
+        return centers
+
+    def get_quantity(self, quantity, leaves=slice(None)):
+        """Data of one quantity of the leaves.
+
+        Args:
+            quantity (str or int): Name or ID of the quantity (see get_columns).
+            leaves: Index, indices or slice of the leaves in the order of the grid file.
+
+        Returns:
+            ndarray: Data of the quantity (with the columns as last dimension, if the
+            quantity has multiple columns).
+        """
+        columns = self.get_columns(quantity)
+        if len(columns) == 1:
+            columns = columns[0]
+        return self.get_leaf_data(leaves)[..., columns]
+
+    def get_ascii_header(self):
+        """Values of the header in the ASCII format (see AsciiGridFile).
+
+        Returns:
+            List: Values of each line of the header.
+        """
+        return [[self.grid_ids['octree'], self.data_length] + list(self.quantity_ids),
+                [self.parameter['sidelength']]]
+
+    def get_ascii_chunks(self, chunk_size=65536):
+        """Formats the nodes as lines of the ASCII format chunk by chunk.
+
+        Notes:
+            Each line contains is_leaf and level of a node followed by the data of leaves.
+
+        Args:
+            chunk_size (int): Number of leaves (at most) that are formatted at once.
+
+        Returns:
+            Generator: Lines of consecutive nodes.
+        """
+        node_format = '%d %d\n'
+        leaf_format = '%d %d ' + ' '.join([self.ascii_float_format] * self.data_length) + '\n'
+        for is_leaf, levels, leaf_data in self.get_node_chunks(chunk_size):
+            nr_values = 2 + is_leaf * self.data_length
+            line_start = np.cumsum(nr_values) - nr_values
+            values = np.zeros(np.sum(nr_values))
+            values[line_start] = is_leaf
+            values[line_start + 1] = levels
+            values[line_start[is_leaf, np.newaxis] + 2 + np.arange(self.data_length)] = leaf_data
+            yield ''.join(np.where(is_leaf, leaf_format, node_format).tolist()) % tuple(values.tolist())
+
+
+class AsciiGridFile(GridFile):
+    """Reads spherical and cylindrical POLARIS grid files in the ASCII format chunk by chunk.
+
+    Notes:
+        The ASCII format contains the values of the binary format in the same order.
+        The first line contains grid_id, data_length and the quantity IDs, the following
+        lines contain the remaining header values (see GridFile.get_ascii_header) and each
+        further line contains the data of one cell. Only the line breaks in the cell
+        data are meaningful, the header is read as one sequence of values.
+    """
+
+    def __init__(self, filename):
+        """Initialisation of the ASCII grid file.
+
+        Args:
+            filename (str): Path to the ASCII grid file.
+        """
+        #: List: Values of the last header line that are not read yet
+        self.header_values = []
+        GridFile.__init__(self, filename, 'r')
+
+    @classmethod
+    def read_grid_type(cls, filename):
+        """Reads only the grid type of an ASCII grid file (to choose between AsciiGridFile and AsciiOcTreeFile).
+
+        Args:
+            filename (str): Path to the ASCII grid file.
+
+        Returns:
+            str: Name of the grid type (octree, spherical, cylindrical).
+        """
+        with open(filename, 'r') as ascii_file:
+            values = ascii_file.readline().split()
+        if len(values) == 0:
+            raise ValueError('The grid file ' + filename + ' ends within the header!')
+        return cls.get_grid_type(int(values[0]))
+
+    def read_file(self):
+        """Reads the header of the ASCII grid file (the cell data is read by get_cell_chunks).
+        """
+        with open(self.filename, 'r') as ascii_file:
+            self.read_header(ascii_file)
+            if len(self.header_values) > 0:
+                raise ValueError('Wrong number of header values in the grid file ' + self.filename + '!')
+            #: int: Position of the first line of cell data (position of the text file)
+            self.data_offset = ascii_file.tell()
+
+    def read_array(self, grid_file, dtype, count=1):
+        """Reads the next header values of the ASCII grid file.
+
+        Args:
+            grid_file: ASCII grid file.
+            dtype: Data type of the values in the binary grid file.
+            count (int): Number of values.
+
+        Returns:
+            ndarray: Values.
+        """
+        dtype = np.dtype(dtype)
+        nr_fields = 1 if dtype.names is None else len(dtype.names)
+        while len(self.header_values) < count * nr_fields:
+            line = grid_file.readline()
+            if line == '':
+                raise ValueError('The grid file ' + self.filename + ' ends within the header!')
+            self.header_values += line.split()
+        values = np.array(self.header_values[:count * nr_fields], dtype=float)
+        del self.header_values[:count * nr_fields]
+        if dtype.names is None:
+            return values.astype(dtype)
+        record = np.zeros(count, dtype=dtype)
+        for i_field, name in enumerate(dtype.names):
+            record[name] = values[i_field::nr_fields]
+        return record
+
+    @staticmethod
+    def parse_lines(lines):
+        """Parses many lines of numbers at once.
+
+        Args:
+            lines (List): Lines of the ASCII grid file.
+
+        Returns:
+            ndarray: Values of all lines.
+            ndarray: Number of values in each line (empty lines are left out).
+        """
+        text = ''.join(lines)
+        try:
+            values = np.fromstring(text, dtype=np.float64, sep=' ')
+        except ValueError:
+            raise ValueError('The grid file contains values that are no numbers!')
+        # A value starts with each character that is no whitespace and follows a whitespace
+        chars = np.frombuffer(text.encode(), dtype=np.uint8)
+        is_space = np.isin(chars, np.frombuffer(b' \t\n\r\v\f', dtype=np.uint8))
+        value_start = np.logical_not(is_space) & np.concatenate(([True], is_space[:-1]))
+        line_index = np.cumsum(chars == ord('\n'))
+        nr_values = np.bincount(line_index[value_start], minlength=len(lines))
+        if np.sum(nr_values) != len(values):
+            raise ValueError('The grid file contains values that are no numbers!')
+        return values, nr_values[nr_values > 0]
+
+    def read_lines(self, chunk_size=65536):
+        """Parses the lines after the header chunk by chunk.
+
+        Args:
+            chunk_size (int): Number of lines that are parsed at once.
+
+        Returns:
+            Generator: Values and number of values of each line (see parse_lines).
+        """
+        with open(self.filename, 'r') as ascii_file:
+            ascii_file.seek(self.data_offset)
+            while True:
+                lines = list(itertools.islice(ascii_file, chunk_size))
+                if len(lines) == 0:
+                    break
+                yield self.parse_lines(lines)
+
+    def get_cell_chunks(self, chunk_size=65536):
+        """Reads the data of the cells chunk by chunk.
+
+        Args:
+            chunk_size (int): Number of cells that are read at once.
+
+        Returns:
+            Generator: (N, data_length) data of consecutive cells.
+        """
+        nr_cells = 0
+        for values, nr_values in self.read_lines(chunk_size):
+            if np.any(nr_values != self.data_length):
+                raise ValueError('Wrong number of physical quantities in a cell of the grid file ' +
+                                 self.filename + '!')
+            nr_cells += len(nr_values)
+            yield values.reshape(len(nr_values), self.data_length)
+        if nr_cells != self.get_nr_cells():
+            raise ValueError('The grid file ' + self.filename + ' contains ' + str(nr_cells) +
+                             ' cells instead of ' + str(self.get_nr_cells()) + '!')
+
+    def write_binary(self, binary_file, chunk_size=65536):
+        """Writes the grid in the binary format.
+
+        Args:
+            binary_file: Binary grid file opened for writing.
+            chunk_size (int): Number of cells that are written at once.
+        """
+        writer = GridWriter(binary_file)
+        writer.write_grid_header(self)
+        for cell_data in self.get_cell_chunks(chunk_size):
+            writer.write_cell_data(cell_data)
+
+
+class AsciiOcTreeFile(AsciiGridFile):
+    """Reads octree POLARIS grid files in the ASCII format chunk by chunk.
+
+    Notes:
+        The header contains grid_id, data_length and the quantity IDs in the first line
+        and the sidelength in the second line. Each further line contains is_leaf and
+        level of one node (in the order of the binary format) and the data of leaves.
+    """
+
+    def read_header(self, grid_file):
+        """Reads the octree header.
+
+        Args:
+            grid_file: ASCII grid file.
+        """
+        self.read_general_header(grid_file)
+        if self.parameter['grid_type'] != 'octree':
+            raise ValueError('Spherical and cylindrical grids have to be read with AsciiGridFile!')
+        self.parameter['sidelength'] = self.read_array(grid_file, self.octree_header)[0]['sidelength'].item()
+
+    def get_cell_chunks(self, chunk_size=65536):
+        """Reads the nodes chunk by chunk.
+
+        Args:
+            chunk_size (int): Number of nodes that are read at once.
+
+        Returns:
+            Generator: is_leaf, level and (N_leaves, data_length) leaf data of consecutive nodes.
+        """
+        for values, nr_values in self.read_lines(chunk_size):
+            line_start = np.cumsum(nr_values) - nr_values
+            is_leaf = values[line_start] != 0
+            if np.any(nr_values != 2 + is_leaf * self.data_length):
+                raise ValueError('Wrong number of values of a node in the grid file ' + self.filename + '!')
+            yield is_leaf, values[line_start + 1].astype(np.uint16), \
+                values[line_start[is_leaf, np.newaxis] + 2 + np.arange(self.data_length)]
+
+    def write_binary(self, binary_file, chunk_size=65536):
+        """Writes the grid in the binary format.
+
+        Args:
+            binary_file: Binary grid file opened for writing.
+            chunk_size (int): Number of nodes that are written at once.
+        """
+        writer = GridWriter(binary_file)
+        writer.write_grid_header(self)
+        for is_leaf, levels, leaf_data in self.get_cell_chunks(chunk_size):
+            writer.write_octree_nodes(is_leaf, levels, leaf_data)
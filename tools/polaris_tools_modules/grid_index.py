@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from polaris_tools_modules.octree import LinearOcTree
+
+
+class GridIndex:
+    """Finds the cells of a grid file that contain many positions at once.
+
+    Notes:
+        The cells are located with searchsorted on the cell borders (spherical and
+        cylindrical grids) or on the Morton keys of the leaves (octree grids), so that
+        millions of positions can be located with a few vectorized operations.
+        The index of a cell is its position in the cell data of the grid file (the
+        leaves in the order of the grid file for octree grids). Positions outside of
+        the grid get the index -1.
+    """
+
+    def __init__(self, grid_file):
+        """Initialisation of the index.
+
+        Args:
+            grid_file (GridFile): Opened grid file with the cell data.
+        """
+        self.grid_file = grid_file
+
+    def locate(self, positions):
+        """Finds the cells that contain the positions.
+
+        Args:
+            positions (ndarray): (N, 3) cartesian positions.
+
+        Returns:
+            ndarray: Index of the cell of each position (-1 outside of the grid).
+        """
+        raise NotImplementedError
+
+    def get_cell_data(self, cells):
+        """Data of the cells.
+
+        Args:
+            cells (ndarray): Index of the cells in the order of the grid file.
+
+        Returns:
+            ndarray: (N, data_length) data of the cells.
+        """
+        return self.grid_file.data[cells]
+
+    def query(self, positions, quantity=None):
+        """Finds the cells that contain the positions and reads their data.
+
+        Args:
+            positions (ndarray): (N, 3) cartesian positions.
+            quantity (str or int): Name or ID of the quantity (see GridFile.get_columns)
+                instead of all data columns.
+
+        Returns:
+            ndarray: Index of the cell of each position (-1 outside of the grid).
+            ndarray: Data of the cell of each position (NaN outside of the grid).
+        """
+        cells = self.locate(positions)
+        columns = slice(None)
+        if quantity is not None:
+            columns = self.grid_file.get_columns(quantity)
+            if len(columns) == 1:
+                columns = columns[0]
+        inside = cells >= 0
+        data = np.full((len(cells), self.grid_file.data_length), np.nan)[:, columns]
+        if np.any(inside):
+            data[inside] = np.asarray(self.get_cell_data(cells[inside]))[:, columns]
+        return cells, data
+
+    @staticmethod
+    def search_borders(borders, values):
+        """Finds the cells between borders that contain the values.
+
+        Args:
+            borders (ndarray): Increasing cell borders.
+            values (ndarray): Values inside of the borders.
+
+        Returns:
+            ndarray: Index of the cell of each value (values on the outer border are in the last cell).
+        """
+        return np.clip(np.searchsorted(borders, values, side='right') - 1, 0, len(borders) - 2)
+
+    @staticmethod
+    def search_ring_borders(borders, offsets, rings, values):
+        """Finds the cells between borders that differ between the radial rings.
+
+        Notes:
+            The borders of each ring are shifted behind the borders of the previous
+            ring, so that all values are found with one searchsorted. The shift can
+            move a value across a border by rounding, which is corrected afterwards.
+
+        Args:
+            borders (ndarray): Increasing cell borders of all rings one after another.
+            offsets (ndarray): Position of the first border of each ring (and the end of the last ring).
+            rings (ndarray): Ring of each value.
+            values (ndarray): Values inside of the borders of their ring.
+
+        Returns:
+            ndarray: Index of the cell in the ring of each value.
+        """
+        nr_borders = np.diff(offsets)
+        span = 2. * (np.max(borders) - np.min(borders)) + 1.
+        shift = np.arange(len(nr_borders)) * span
+        cells = np.searchsorted(borders + np.repeat(shift, nr_borders), values + shift[rings], side='right') - 1
+        cells = np.clip(cells - offsets[rings], 0, nr_borders[rings] - 2)
+        cells -= np.logical_and(values < borders[offsets[rings] + cells], cells > 0)
+        cells += np.logical_and(values >= borders[offsets[rings] + cells + 1], cells < nr_borders[rings] - 2)
+        return cells
+
+
+class SphericalIndex(GridIndex):
+    """Finds the cells of a spherical grid file (see GridIndex).
+    """
+
+    def __init__(self, grid_file, cell_borders):
+        """Initialisation of the index.
+
+        Args:
+            grid_file (GridFile): Opened spherical grid file.
+            cell_borders (dict): Cell borders of the grid (see Spherical.init_cell_borders).
+        """
+        GridIndex.__init__(self, grid_file)
+        self.radius_list = cell_borders['radius_list']
+        self.theta_list = cell_borders['theta_list']
+        self.phi_list = cell_borders['phi_list']
+
+    def locate(self, positions):
+        """Finds the cells that contain the positions (see GridIndex.locate).
+
+        Notes:
+            The cells of each shell are ordered by phi and theta, the cell in the center
+            is the last cell of the grid file (see Spherical.get_chunk_cells).
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        radius = np.linalg.norm(positions, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            theta = np.arccos(np.clip(positions[:, 2] / radius, -1., 1.))
+        phi = np.mod(np.arctan2(positions[:, 1], positions[:, 0]), 2. * np.pi)
+        n_th = len(self.theta_list) - 1
+        n_ph = len(self.phi_list) - 1
+        cells = (self.search_borders(self.radius_list, radius) * n_ph +
+                 self.search_borders(self.phi_list, phi)) * n_th + self.search_borders(self.theta_list, theta)
+        cells[radius < self.radius_list[0]] = (len(self.radius_list) - 1) * n_ph * n_th
+        cells[np.logical_not(radius <= self.radius_list[-1])] = -1
+        return cells
+
+
+class CylindricalIndex(GridIndex):
+    """Finds the cells of a cylindrical grid file (see GridIndex).
+    """
+
+    def __init__(self, grid_file, cell_borders):
+        """Initialisation of the index.
+
+        Args:
+            grid_file (GridFile): Opened cylindrical grid file.
+            cell_borders (dict): Cell borders of the grid with the phi borders and the
+                vertical borders of each radial ring (see Cylindrical.init_cell_borders).
+        """
+        GridIndex.__init__(self, grid_file)
+        self.radius_list = cell_borders['radius_list']
+        self.phi_list = cell_borders['phi_list']
+        self.ph_offsets = cell_borders['ph_offsets']
+        self.z_list = cell_borders['z_list']
+        n_z = self.z_list.shape[1] - 1
+        #: ndarray: Position of the first cell of each radial ring (and of the cells in the center)
+        self.ring_offsets = np.concatenate(([0], np.cumsum(np.diff(self.ph_offsets) - 1))) * n_z
+
+    def locate(self, positions):
+        """Finds the cells that contain the positions (see GridIndex.locate).
+
+        Notes:
+            The cells of each ring are ordered by phi and z, the cells inside of the
+            inner radius are the last n_z cells of the grid file (see Cylindrical.get_chunk_cells).
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        radius = np.hypot(positions[:, 0], positions[:, 1])
+        phi = np.mod(np.arctan2(positions[:, 1], positions[:, 0]), 2. * np.pi)
+        n_r = len(self.radius_list) - 1
+        n_z = self.z_list.shape[1] - 1
+        in_center = radius < self.radius_list[0]
+        # The cells in the center use the vertical borders of the first ring
+        rings = np.where(in_center, 0, self.search_borders(self.radius_list, radius))
+        z_min = self.z_list[rings, 0]
+        z_max = self.z_list[rings, -1]
+        z = np.clip(positions[:, 2], z_min, z_max)
+        if np.all(self.z_list == self.z_list[0]):
+            i_z = self.search_borders(self.z_list[0], z)
+        else:
+            i_z = self.search_ring_borders(self.z_list.ravel(), np.arange(n_r + 1) * (n_z + 1), rings, z)
+        if np.all(np.diff(self.ph_offsets) == self.ph_offsets[1]):
+            i_p = self.search_borders(self.phi_list[:self.ph_offsets[1]], phi)
+        else:
+            i_p = self.search_ring_borders(self.phi_list, self.ph_offsets, rings, phi)
+        cells = self.ring_offsets[rings] + i_p * n_z + i_z
+        cells[in_center] = self.ring_offsets[-1] + i_z[in_center]
+        outside = np.logical_not(np.logical_and(radius <= self.radius_list[-1], positions[:, 2] >= z_min))
+        cells[np.logical_or(outside, np.logical_not(positions[:, 2] <= z_max))] = -1
+        return cells
+
+
+class OcTreeIndex(GridIndex):
+    """Finds the leaves of an octree grid file (see GridIndex).
+
+    Notes:
+        The leaves are located with the Morton keys of the linear octree of the grid
+        file (see LinearOcTree.locate).
+    """
+
+    def __init__(self, grid_file):
+        """Initialisation of the index.
+
+        Args:
+            grid_file (OcTreeFile): Opened octree grid file (with the leaf index).
+        """
+        GridIndex.__init__(self, grid_file)
+        #: LinearOcTree: Leaves of the grid file (without data)
+        self.tree = LinearOcTree(grid_file.parameter['sidelength'], grid_file.leaf_keys, grid_file.leaf_levels)
+
+    def locate(self, positions):
+        """Finds the leaves that contain the positions (see GridIndex.locate).
+        """
+        return self.tree.locate(positions)
+
+    def get_cell_data(self, cells):
+        """Data of the leaves (see GridIndex.get_cell_data).
+        """
+        return self.grid_file.get_leaf_data(cells)
@@ -39,6 +39,21 @@ class Math:
             'avg_gas_mass': 2.,                      # Average atomic mass unit per gas particle
         }
 
+    @staticmethod
+    def scalar_or_array(value):
+        """Returns a float for zero dimensional arrays to keep the results of the
+        math functions for one position as they are.
+
+        Args:
+            value (ndarray): Result of a function that handles one or many positions.
+
+        Returns:
+            float or ndarray: Value as float or array.
+        """
+        if np.ndim(value) == 0:
+            return float(value)
+        return value
+
     def length_conv(self, length, unit, distance=None):
         """Converted the length to various units if given in meters.
 
@@ -319,19 +334,17 @@ class Math:
         """Calculates cartesian coordinates from spherical ones.
 
         Args:
-            spherical_coord (List[float, float, float]): Spherical coordinates.
-                radius, theta, phi
+            spherical_coord (List[float, float, float] or ndarray): Spherical coordinates
+                (radius, theta, phi) or (N, 3) array of them.
 
         Returns:
-            List[float, float, float]: Cartesian coordinates
+            List[float, float, float] or ndarray: Cartesian coordinates
         """
-        cartesian_coord = np.zeros(3)
-        cartesian_coord[0] = spherical_coord[0] * \
-            np.sin(spherical_coord[1]) * np.cos(spherical_coord[2])
-        cartesian_coord[1] = spherical_coord[0] * \
-            np.sin(spherical_coord[1]) * np.sin(spherical_coord[2])
-        cartesian_coord[2] = spherical_coord[0] * \
-            np.cos(spherical_coord[1])
+        spherical_coord = np.asarray(spherical_coord, dtype=float)
+        cartesian_coord = np.stack([
+            spherical_coord[..., 0] * np.sin(spherical_coord[..., 1]) * np.cos(spherical_coord[..., 2]),
+            spherical_coord[..., 0] * np.sin(spherical_coord[..., 1]) * np.sin(spherical_coord[..., 2]),
+            spherical_coord[..., 0] * np.cos(spherical_coord[..., 1])], axis=-1)
         return cartesian_coord
 
     @staticmethod
@@ -339,37 +352,36 @@ class Math:
         """Calculates spherical coordinates from cartesian ones.
 
         Args:
-            cartesian_coord (List[float, float, float]): Cartesian coordinates.
-                x, y, z
+            cartesian_coord (List[float, float, float] or ndarray): Cartesian coordinates
+                (x, y, z) or (N, 3) array of them.
 
         Returns:
-            List[float, float, float]: Spherical coordinates
+            ndarray: Spherical coordinates (radius, theta, phi), zero at the center.
         """
-        spherical_coord = np.zeros(3)
-        if np.linalg.norm(cartesian_coord[:]) != 0:
-            spherical_coord[0] = np.linalg.norm(cartesian_coord[:])
-            spherical_coord[1] = np.arccos(cartesian_coord[2] / spherical_coord[0])
-            spherical_coord[2] = np.arctan2(
-                                    cartesian_coord[1], cartesian_coord[0])
-        return spherical_coord
+        cartesian_coord = np.asarray(cartesian_coord, dtype=float)
+        radius = np.linalg.norm(cartesian_coord, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spherical_coord = np.stack([
+                radius, np.arccos(np.clip(cartesian_coord[..., 2] / radius, -1., 1.)),
+                np.arctan2(cartesian_coord[..., 1], cartesian_coord[..., 0])], axis=-1)
+        return np.where((radius != 0)[..., np.newaxis], spherical_coord, 0.)
 
     @staticmethod
     def cylindrical_to_cartesian(cylindrical_coord):
         """Calculates cartesian coordinates from cylindrical ones.
 
         Args:
-            cylindrical_coord (List[float, float, float]): Cylindrical coordinates.
-                radius, phi, z
+            cylindrical_coord (List[float, float, float] or ndarray): Cylindrical coordinates
+                (radius, phi, z) or (N, 3) array of them.
 
         Returns:
-            List[float, float, float]: Cartesian coordinates
+            List[float, float, float] or ndarray: Cartesian coordinates
         """
-        cartesian_coord = np.zeros(3)
-        cartesian_coord[0] = cylindrical_coord[0] * \
-            np.cos(cylindrical_coord[1])
-        cartesian_coord[1] = cylindrical_coord[0] * \
-            np.sin(cylindrical_coord[1])
-        cartesian_coord[2] = cylindrical_coord[2]
+        cylindrical_coord = np.asarray(cylindrical_coord, dtype=float)
+        cartesian_coord = np.stack([
+            cylindrical_coord[..., 0] * np.cos(cylindrical_coord[..., 1]),
+            cylindrical_coord[..., 0] * np.sin(cylindrical_coord[..., 1]),
+            cylindrical_coord[..., 2]], axis=-1)
         return cartesian_coord
 
     @staticmethod
@@ -377,17 +389,17 @@ class Math:
         """Calculates cylindrical coordinates from cartesian ones.
 
         Args:
-            cartesian_coord (List[float, float, float]): Cartesian coordinates.
-                x, y, z
+            cartesian_coord (List[float, float, float] or ndarray): Cartesian coordinates
+                (x, y, z) or (N, 3) array of them.
 
         Returns:
-            List[float, float, float]: Cylindrical coordinates
+            ndarray: Cylindrical coordinates (radius, phi, z)
         """
-        cylindrical_coord = np.zeros(3)
-        cylindrical_coord[0] = np.linalg.norm(cartesian_coord[0:2])
-        cylindrical_coord[1] = np.arctan2(
-            cartesian_coord[1], cartesian_coord[0]) + np.pi
-        cylindrical_coord[2] = cartesian_coord[2]
+        cartesian_coord = np.asarray(cartesian_coord, dtype=float)
+        cylindrical_coord = np.stack([
+            np.sqrt(cartesian_coord[..., 0] ** 2 + cartesian_coord[..., 1] ** 2),
+            np.arctan2(cartesian_coord[..., 1], cartesian_coord[..., 0]) + np.pi,
+            cartesian_coord[..., 2]], axis=-1)
         return cylindrical_coord
 
     @staticmethod
@@ -430,14 +442,11 @@ class Math:
         Returns:
              number_list (list): Distributed numbers
         """
-        number_list = np.zeros(total_number + 1)
-        number_list[0] = start
-        number_list[total_number] = stop
-
         dx = (stop - start) / total_number
 
-        for i_x in range(1, total_number):
-            number_list[i_x] = start + i_x * dx
+        number_list = start + np.arange(total_number + 1) * dx
+        number_list[0] = start
+        number_list[total_number] = stop
         return number_list
 
     @staticmethod
@@ -508,19 +517,25 @@ class Math:
         """Calculates Kepler rotation velocity.
 
         Args:
-            position (List[float, float, float]): Position in model space.
+            position (List[float, float, float] or ndarray): Position in model space
+                or (N, 3) array of positions.
             stellar_mass (float): Mass of central stellar object [M_sun].
 
         Returns:
-            List[float, float, float]: Velocity at the given position.
+            List[float, float, float] or ndarray: Velocity at the given position(s).
         """
+        position = np.asarray(position, dtype=float)
         #: float: Cylindrical radius
-        radius_cy = np.sqrt(position[0] ** 2 + position[1] ** 2)
-        #: float: Kepler constant ( v=sqrt(GM/a) )
-        kepler_const = (self.const['G'] * stellar_mass *
-                        self.const['M_sun'] / radius_cy) ** 0.5
-        velocity = [-1.0 * position[1] / radius_cy * kepler_const,
-                    position[0] / radius_cy * kepler_const, 0.]
+        radius_cy = np.sqrt(position[..., 0] ** 2 + position[..., 1] ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            #: float: Kepler constant ( v=sqrt(GM/a) )
+            kepler_const = (self.const['G'] * stellar_mass *
+                            self.const['M_sun'] / radius_cy) ** 0.5
+            velocity = np.stack([-1.0 * position[..., 1] / radius_cy * kepler_const,
+                                 position[..., 0] / radius_cy * kepler_const,
+                                 np.zeros_like(radius_cy)], axis=-1)
+        if velocity.ndim == 1:
+            return velocity.tolist()
         return velocity
 
     @staticmethod
@@ -530,7 +545,8 @@ class Math:
         """Shakura and Sunyaev disk density profile.
 
         Args:
-            position (List[float, float, float]): Position in model space.
+            position (List[float, float, float] or ndarray): Position in model space
+                or (N, 3) array of positions.
             inner_radius (float): Inner radius of the disk.
             outer_radius (float): Outer radius of the disk.
             ref_scale_height (float): Reference scale height.
@@ -542,30 +558,30 @@ class Math:
             real_zero (bool): No minimum value for the density.
 
         Returns:
-            Float: Density at the given position.
+            Float or ndarray: Density at the given position(s).
         """
+        position = np.asarray(position, dtype=float)
         #: float: Cylindrical radius
-        radius_cy = np.sqrt(position[0] ** 2 + position[1] ** 2)
-        if outer_radius >= radius_cy >= inner_radius:
-            if column_dens_exp is not None:
-                alpha = beta + column_dens_exp
-            #: float: Vertical height
-            vert_height = abs(position[2])
+        radius_cy = np.sqrt(position[..., 0] ** 2 + position[..., 1] ** 2)
+        if column_dens_exp is not None:
+            alpha = beta + column_dens_exp
+        #: float: Vertical height
+        vert_height = np.abs(position[..., 2])
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
             #: float: Vertical scale height
             scale_height = ref_scale_height * (radius_cy / ref_radius) ** beta
             #: float: Shakura and Sunyaev density distribution
-            density = (radius_cy / ref_radius) ** (-alpha) * \
-                np.exp(-0.5 * (vert_height / scale_height) ** 2)
-        else:
-            density = 0.
+            density = np.where((outer_radius >= radius_cy) & (radius_cy >= inner_radius),
+                               (radius_cy / ref_radius) ** (-alpha) *
+                               np.exp(-0.5 * (vert_height / scale_height) ** 2), 0.)
 
         if tapered_gamma is not None:
             density *= np.exp(-(radius_cy / ref_radius)
                               ** (2 - tapered_gamma))
         if not real_zero:
-            density = max(density, 1e-200)
+            density = np.maximum(density, 1e-200)
 
-        return density
+        return Math.scalar_or_array(density)
 
     @staticmethod
     def default_disk_scale_height(radius, beta=0.8,
@@ -589,25 +605,24 @@ class Math:
         """Density profile with a sphere of constant density.
 
         Args:
-            position (List[float, float, float]): Position in model space.
+            position (List[float, float, float] or ndarray): Position in model space
+                or (N, 3) array of positions.
             outer_radius (float): Outer radius of the sphere.
             inner_radius (float): Inner radius of the sphere.
 
         Returns:
-            Float: Density at the given position.
+            Float or ndarray: Density at the given position(s).
         """
+        position = np.asarray(position, dtype=float)
         #: float: Radial distance from center
-        radius = np.sqrt(position[0] ** 2 + position[1]
-                         ** 2 + position[2] ** 2)
+        radius = np.sqrt(position[..., 0] ** 2 + position[..., 1]
+                         ** 2 + position[..., 2] ** 2)
         #: float: Constant density inside the Sphere
-        density = 0.
         if inner_radius is None:
-            if radius <= outer_radius:
-                density = 1.
+            density = np.where(radius <= outer_radius, 1., 0.)
         else:
-            if outer_radius >= radius >= inner_radius:
-                density = 1.
-        return density
+            density = np.where((outer_radius >= radius) & (radius >= inner_radius), 1., 0.)
+        return Math.scalar_or_array(density)
 
     @staticmethod
     def simple_mag_field(mag_field_strength, axis='z',
@@ -647,15 +662,18 @@ class Math:
 
         Args:
             mag_field_strength (float): Amplitude of the magnetic field strength.
-            position ([float, float, float]): Position in the grid
+            position ([float, float, float] or ndarray): Position in the grid
+                or (N, 3) array of positions.
 
         Returns:
-            List[float, float, float]: Magnetic field strength at any position.
+            List[float, float, float] or ndarray: Magnetic field strength at the given position(s).
         """
+        position = np.asarray(position, dtype=float)
+        #: float: Radial distance from center
+        radius = np.linalg.norm(position, axis=-1)[..., np.newaxis]
         #: List: Magnetic field strength
-        if np.linalg.norm(position) == 0:
-            return np.zeros(3)
-        return np.ones(3) * mag_field_strength * position[:] / np.linalg.norm(position)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(radius > 0, mag_field_strength * position / radius, 0.)
 
     @staticmethod
     def disturbed_mag_field(mag_field_strength, main_axis='z', rel_strength=0.1):
@@ -742,17 +760,21 @@ class Math:
         model space and pointing in the y-direction in the other half.
 
         Args:
-            position (List[float, float, float]): position in model space.
+            position (List[float, float, float] or ndarray): position in model space
+                or (N, 3) array of positions.
             mag_field_strength (float): Amplitude of the magnetic field strength.
 
         Returns:
-            List[float, float, float]: Magnetic field strength at the given
-            position.
+            List[float, float, float] or ndarray: Magnetic field strength at the given
+            position(s).
         """
-        if position[2] < 0:
-            mag = [0, 0, mag_field_strength]
-        else:
-            mag = [0, mag_field_strength, 0]
+        position = np.asarray(position, dtype=float)
+        lower_half = position[..., 2] < 0
+        mag = np.stack([np.zeros_like(position[..., 2]),
+                        np.where(lower_half, 0., mag_field_strength),
+                        np.where(lower_half, mag_field_strength, 0.)], axis=-1)
+        if mag.ndim == 1:
+            return mag.tolist()
         return mag
 
     def toroidal_mag_field(self, position, mag_field_strength):
@@ -762,20 +784,24 @@ class Math:
             Link: https://en.wikipedia.org/wiki/Toroidal_and_poloidal
 
         Args:
-            position (List[float, float, float]): position in model space.
+            position (List[float, float, float] or ndarray): position in model space
+                or (N, 3) array of positions.
             mag_field_strength (float): Amplitude of the magnetic field strength.
 
         Returns:
-            List[float, float, float]: Magnetic field strength at the given
-            position.
+            List[float, float, float] or ndarray: Magnetic field strength at the given
+            position(s).
         """
-        #: List(float, float, float): Spherical coordinates
-        spherical_coord = self.cartesian_to_spherical(position)
+        position = np.asarray(position, dtype=float)
+        #: float: Azimuthal angle of the position
+        phi = np.arctan2(position[..., 1], position[..., 0])
         # Only a field component in the xy-plane
-        mag = [mag_field_strength, mag_field_strength, 0]
         # Multiplication with the phi direction unit vectors
-        mag[0] *= -np.sin(spherical_coord[2])
-        mag[1] *= np.cos(spherical_coord[2])
+        mag = np.stack([-mag_field_strength * np.sin(phi),
+                        mag_field_strength * np.cos(phi),
+                        np.zeros_like(phi)], axis=-1)
+        if mag.ndim == 1:
+            return mag.tolist()
         return mag
 
     def poloidal_mag_field(self, position, mag_field_strength, torus_r_distance):
@@ -785,25 +811,25 @@ class Math:
             Link: https://en.wikipedia.org/wiki/Toroidal_and_poloidal
 
         Args:
-            position (List[float, float, float]): position in model space.
+            position (List[float, float, float] or ndarray): position in model space
+                or (N, 3) array of positions.
             mag_field_strength (float): Amplitude of the magnetic field strength.
             torus_r_distance (float): Radial distance of the centre of the poloidal torus
 
         Returns:
-            List[float, float, float]: Magnetic field strength at the given
-            position.
+            ndarray: Magnetic field strength at the given position(s).
         """
-        #: List(float, float, float): Spherical coordinates
+        position = np.asarray(position, dtype=float)
+        #: ndarray: Spherical coordinates
         spherical_coord = self.cartesian_to_spherical(position)
         #: float: Cylindrical radius
-        radius_cy = spherical_coord[0] * np.cos(spherical_coord[1])
+        radius_cy = spherical_coord[..., 0] * np.cos(spherical_coord[..., 1])
         #: float: Theta angle related to the radial distance
-        theta = np.arctan2(position[2], (radius_cy - torus_r_distance))
-        mag = np.zeros(3)
+        theta = np.arctan2(position[..., 2], (radius_cy - torus_r_distance))
         # Magnetic field is rotating around the radial ring
-        mag[0] = -np.sin(theta) * -np.cos(spherical_coord[2])
-        mag[1] = -np.sin(theta) * -np.sin(spherical_coord[2])
-        mag[2] = np.cos(theta)
+        mag = np.stack([-np.sin(theta) * -np.cos(spherical_coord[..., 2]),
+                        -np.sin(theta) * -np.sin(spherical_coord[..., 2]),
+                        np.cos(theta)], axis=-1)
         mag *= mag_field_strength
         return mag
 
@@ -811,32 +837,28 @@ class Math:
         """Hourglass magnetic field.
 
         Args:
-            position (List[float, float, float]): position in model space.
+            position (List[float, float, float] or ndarray): position in model space
+                or (N, 3) array of positions.
             mag_field_strength (float): Amplitude of the magnetic field strength.
             radius (float): Radial extent of the model space.
 
         Returns:
-            List[float, float, float]: Magnetic field strength at the given
-            position.
+            ndarray: Magnetic field strength at the given position(s).
         """
-        #: List(float, float, float): Spherical coordinates
+        #: ndarray: Spherical coordinates
         spherical_coord = self.cartesian_to_spherical(position)
         #: float: Weighting factor
         gamma = 5
         #: float: Radial component of the magnetic field
         mag_r = mag_field_strength * \
-            (gamma * radius ** 2 / (radius + spherical_coord[0]) ** 2)
+            (gamma * radius ** 2 / (radius + spherical_coord[..., 0]) ** 2)
         #: float: Z component of the magnetic field
         mag_z = mag_field_strength
-        mag = np.zeros(3)
         # Conversion to cartesian coordinates
-        mag[0] += mag_r * np.cos(spherical_coord[1]) * \
-            np.cos(spherical_coord[2])
-        mag[1] += mag_r * np.cos(spherical_coord[1]) * \
-            np.sin(spherical_coord[2])
-        mag[2] += mag_r * np.sin(spherical_coord[1])
+        mag = np.stack([mag_r * np.cos(spherical_coord[..., 1]) * np.cos(spherical_coord[..., 2]),
+                        mag_r * np.cos(spherical_coord[..., 1]) * np.sin(spherical_coord[..., 2]),
+                        mag_r * np.sin(spherical_coord[..., 1])], axis=-1)
         # The field should point into the same direction above and below the xy-plane
-        if spherical_coord[1] < 0:
-            mag *= -1
-        mag[2] += mag_z
+        mag = np.where((spherical_coord[..., 1] < 0)[..., np.newaxis], -mag, mag)
+        mag[..., 2] += mag_z
         return mag
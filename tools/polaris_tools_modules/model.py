@@ -88,6 +88,8 @@ class ModelChooser:
                 model.spherical_parameter['sf_th'] = self.parse_args.sf_th
             if self.parse_args.sf_z is not None:
                 model.cylindrical_parameter['sf_z'] = self.parse_args.sf_z
+            if self.parse_args.refinement_limit is not None:
+                model.octree_parameter['refinement_limit'] = self.parse_args.refinement_limit
         elif 'distance' in vars(self.parse_args).keys():
             if self.parse_args.distance is not None:
                 model.parameter['distance'] = self.math.parse(
@@ -175,6 +177,11 @@ class Disk(Model):
         self.parameter['ref_scale_height'] = 10. * self.math.const['au']
         self.parameter['alpha'] = 0.9 # Andrews et al. 2010, https://ui.adsabs.harvard.edu/abs/2010ApJ...723.1241A/abstract
         self.parameter['beta'] = 1.1 # Woitke et al. 2019, http://adsabs.harvard.edu/abs/2019PASP..131f4301W
+        # The model functions can calculate many positions at once
+        self.vectorized = True
+        # The disk is symmetric around the z-axis and to the midplane
+        self.axisymmetric = True
+        self.mirror_symmetric = True
 
     def update_parameter(self, extra_parameter):
         """Use this function to set model parameter with the extra parameters.
@@ -245,6 +252,11 @@ class Sphere(Model):
         self.spherical_parameter['sf_r'] = 1.03
         self.parameter['gas_mass'] = 1e-4 * self.math.const['M_sun']
         self.tmp_parameter['mag_field_geometry'] = 'toroidal'
+        # The model functions can calculate many positions at once
+        self.vectorized = True
+        # The sphere and its magnetic fields are symmetric around the z-axis and to the midplane
+        self.axisymmetric = True
+        self.mirror_symmetric = True
 
     def gas_density_distribution(self):
         """Calculates the gas density at a given position.
@@ -287,6 +299,8 @@ class Sphere(Model):
                     print('HINT: The toroidal magnetic field is used (change with --extra)!')
                 elif extra_parameter[0] == 'vertical_mag_field':
                     self.tmp_parameter['mag_field_geometry'] = 'vertical'
+                    # The vertical field points in the same direction on both sides of the midplane
+                    self.mirror_signs['magnetic_field'] = [1., 1., 1.]
                     print('HINT: The vertical magnetic field is used (change with --extra)!')
                 elif extra_parameter[0] == 'radial_mag_field':
                     self.tmp_parameter['mag_field_geometry'] = 'radial'
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from polaris_tools_modules.grid_file import GridWriter
+
+
+class LinearOcTree:
+    """Octree stored as the Morton keys and levels of its leaves (linear octree).
+
+    Notes:
+        The Morton key of a node is the path of child indices from the root (3 bits per
+        level, bit 0: x, bit 1: y, bit 2: z of the child index, see OcTree.create_grid),
+        as in the leaf index of OcTreeFile. Shifted to the deepest level, the key of a
+        node is the key of its first descendant. The leaves are kept sorted by this
+        first key, which is their depth-first order in the grid file. Therefore, the
+        refinement, the lookup of positions and neighbours and the serialization are
+        operations on arrays instead of a tree of nodes.
+    """
+
+    #: int: Maximum level of the Morton keys (3 bits per level in uint64)
+    max_level = 21
+
+    def __init__(self, sidelength, keys, levels, data=None):
+        """Initialisation of the linear octree.
+
+        Args:
+            sidelength (float): Width of the root node (centered at the origin).
+            keys (ndarray): Morton key of each leaf.
+            levels (ndarray): Level of each leaf.
+            data (ndarray): (N_leaves, data_length) data of the leaves.
+        """
+        self.sidelength = sidelength
+        keys = np.asarray(keys, dtype=np.uint64)
+        levels = np.asarray(levels, dtype=np.uint8)
+        #: int: Deepest level of the leaves
+        self.level = int(np.max(levels, initial=0))
+        if self.level > self.max_level:
+            raise ValueError('Octrees with more than ' + str(self.max_level) + ' levels are not supported!')
+        order = np.argsort(self.get_first_keys(keys, levels, self.level), kind='stable')
+        #: ndarray: Morton key of each leaf in depth-first order
+        self.keys = keys[order]
+        #: ndarray: Level of each leaf in depth-first order
+        self.levels = levels[order]
+        #: ndarray: Data of each leaf in depth-first order
+        self.data = None if data is None else np.asarray(data)[order]
+        #: ndarray: First key of each leaf at the deepest level (see locate)
+        self.first_keys = self.get_first_keys(self.keys, self.levels, self.level)
+
+    @classmethod
+    def from_grid_file(cls, grid_file):
+        """Creates the linear octree of an octree grid file.
+
+        Args:
+            grid_file (OcTreeFile): Opened octree grid file (with the leaf index).
+
+        Returns:
+            LinearOcTree: Leaves of the grid file (in the same order).
+        """
+        return cls(grid_file.parameter['sidelength'], grid_file.leaf_keys, grid_file.leaf_levels,
+                   grid_file.get_leaf_data())
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def get_first_keys(keys, levels, level):
+        """Key of the first descendant of nodes at a deeper level.
+
+        Args:
+            keys (ndarray): Morton key of each node.
+            levels (ndarray): Level of each node.
+            level (int): Level of the descendants (at least the level of the nodes).
+
+        Returns:
+            ndarray: Morton key of the first descendant of each node.
+        """
+        return np.asarray(keys, dtype=np.uint64) << (np.uint64(3) * (
+            np.uint64(level) - np.asarray(levels).astype(np.uint64)))
+
+    @classmethod
+    def get_depth_first_order(cls, keys, levels):
+        """Order of nodes (leaves and inner nodes) in depth-first order with one sort.
+
+        Notes:
+            A parent has the same first key as its first child and a lower level.
+            Therefore, sorting by first key and level puts each parent in front of
+            its children and the children in the order of their index.
+
+        Args:
+            keys (ndarray): Morton key of each node.
+            levels (ndarray): Level of each node.
+
+        Returns:
+            ndarray: Index of the nodes in depth-first order.
+        """
+        return np.lexsort((levels, cls.get_first_keys(keys, levels, int(np.max(levels, initial=0)))))
+
+    #: List: Shifts and masks to spread the bits of a coordinate to every third bit (see encode_keys)
+    spread_masks = [(32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                    (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)]
+
+    @classmethod
+    def encode_keys(cls, coords, level):
+        """Morton keys of integer cell coordinates.
+
+        Args:
+            coords (ndarray): (N, 3) integer coordinates of cells of one level.
+            level (int): Level of the cells.
+
+        Returns:
+            ndarray: Morton key of each cell.
+        """
+        coords = np.asarray(coords).astype(np.uint64)
+        coords &= np.uint64(2 ** level - 1)
+        keys = np.zeros(len(coords), dtype=np.uint64)
+        shifted = np.empty(len(coords), dtype=np.uint64)
+        for i_axis in range(3):
+            # In place operations, since the keys of many positions are encoded at once
+            bits = np.ascontiguousarray(coords[:, i_axis])
+            for shift, mask in cls.spread_masks:
+                np.left_shift(bits, np.uint64(shift), out=shifted)
+                bits |= shifted
+                bits &= np.uint64(mask)
+            bits <<= np.uint64(i_axis)
+            keys |= bits
+        return keys
+
+    @classmethod
+    def decode_keys(cls, keys, level):
+        """Integer cell coordinates of Morton keys.
+
+        Args:
+            keys (ndarray): Morton key of each cell.
+            level (int): Level of the cells.
+
+        Returns:
+            ndarray: (N, 3) integer coordinates of each cell.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        coords = np.zeros((len(keys), 3), dtype=np.int64)
+        # The steps of encode_keys in reverse order (the mask of each step is the one of the step before)
+        masks = [mask for _, mask in cls.spread_masks[-2::-1]] + [2 ** level - 1]
+        for i_axis in range(3):
+            bits = (keys >> np.uint64(i_axis)) & np.uint64(cls.spread_masks[-1][1])
+            for (shift, _), mask in zip(cls.spread_masks[::-1], masks):
+                bits = (bits | (bits >> np.uint64(shift))) & np.uint64(mask)
+            coords[:, i_axis] = bits.astype(np.int64)
+        return coords
+
+    def get_leaf_sizes(self, leaves=slice(None)):
+        """Width of the leaves.
+
+        Args:
+            leaves: Index, indices or slice of the leaves.
+
+        Returns:
+            ndarray: Sidelength of each leaf.
+        """
+        return self.sidelength / 2. ** self.levels[leaves]
+
+    def get_leaf_centers(self, leaves=slice(None)):
+        """Center positions of the leaves.
+
+        Args:
+            leaves: Index, indices or slice of the leaves.
+
+        Returns:
+            ndarray: (N, 3) cartesian positions of the leaves.
+        """
+        first_keys = np.atleast_1d(self.first_keys[leaves])
+        widths = 2. ** (self.level - np.atleast_1d(self.levels[leaves]).astype(int))
+        return ((self.decode_keys(first_keys, self.level) + widths[:, np.newaxis] / 2.) /
+                2 ** self.level - 0.5) * self.sidelength
+
+    def get_position_keys(self, positions):
+        """Morton keys of positions at the deepest level of the tree.
+
+        Args:
+            positions (ndarray): (N, 3) cartesian positions (clipped into the root node).
+
+        Returns:
+            ndarray: Morton key of each position.
+        """
+        nr_cells = 2 ** self.level
+        coords = np.floor((np.asarray(positions, dtype=float).reshape(-1, 3) / self.sidelength + 0.5) * nr_cells)
+        return self.encode_keys(np.clip(coords, 0, nr_cells - 1), self.level)
+
+    def find_keys(self, keys):
+        """Finds the leaves that contain cells of the deepest level.
+
+        Args:
+            keys (ndarray): Morton keys at the deepest level.
+
+        Returns:
+            ndarray: Index of the leaf of each key.
+        """
+        return np.searchsorted(self.first_keys, keys, side='right') - 1
+
+    def locate(self, positions):
+        """Finds the leaves that contain the positions.
+
+        Args:
+            positions (ndarray): (N, 3) cartesian positions.
+
+        Returns:
+            ndarray: Index of the leaf of each position (-1 outside of the root node).
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        leaves = self.find_keys(self.get_position_keys(positions))
+        leaves[np.logical_not(np.all(np.abs(positions) <= self.sidelength / 2., axis=1))] = -1
+        return leaves
+
+    def get_neighbours(self, axis, direction, leaves=slice(None)):
+        """Finds the neighbour of leaves across one face.
+
+        Notes:
+            The neighbour is the leaf that touches the face at its lower corner, which
+            is the only neighbour if it is at least as large as the leaf.
+
+        Args:
+            axis (int): Axis of the face (0: x, 1: y, 2: z).
+            direction (int): Side of the face (-1 or 1).
+            leaves: Index, indices or slice of the leaves.
+
+        Returns:
+            ndarray: Index of the neighbour of each leaf (-1 at the border of the root node).
+        """
+        coords = self.decode_keys(np.atleast_1d(self.first_keys[leaves]), self.level)
+        widths = 2 ** (self.level - np.atleast_1d(self.levels[leaves]).astype(np.int64))
+        coords[:, axis] += widths if direction > 0 else -1
+        outside = np.logical_or(coords[:, axis] < 0, coords[:, axis] >= 2 ** self.level)
+        neighbours = self.find_keys(self.encode_keys(np.clip(coords, 0, 2 ** self.level - 1), self.level))
+        neighbours[outside] = -1
+        return neighbours
+
+    def refine(self, leaves, child_data=None):
+        """Splits leaves into their 8 children.
+
+        Args:
+            leaves (ndarray): Index or boolean mask of the leaves that are refined.
+            child_data (ndarray): (8 * N_refined, data_length) data of the children in the
+                order of the refined leaves and the child index (data of the parent if None).
+
+        Returns:
+            LinearOcTree: Refined octree.
+        """
+        refined = np.zeros(len(self), dtype=bool)
+        refined[leaves] = True
+        child_keys = (self.keys[refined, np.newaxis] << np.uint64(3)) + np.arange(8, dtype=np.uint64)
+        child_levels = np.repeat(self.levels[refined] + 1, 8)
+        data = None
+        if self.data is not None:
+            if child_data is None:
+                child_data = np.repeat(self.data[refined], 8, axis=0)
+            data = np.concatenate((self.data[np.logical_not(refined)], child_data))
+        return LinearOcTree(self.sidelength, np.concatenate((self.keys[np.logical_not(refined)], child_keys.ravel())),
+                            np.concatenate((self.levels[np.logical_not(refined)], child_levels)), data)
+
+    def get_nodes(self):
+        """All nodes of the octree (leaves and inner nodes) in depth-first order.
+
+        Notes:
+            The inner nodes are the parents of the nodes of each level, from the deepest
+            level up to the root. Afterwards, all nodes are ordered with one sort
+            (see get_depth_first_order).
+
+        Returns:
+            is_leaf, level and the index of the leaf (-1 for inner nodes) of each node.
+        """
+        keys = [self.keys]
+        levels = [self.levels]
+        level_keys = self.keys[self.levels == self.level]
+        for level in range(self.level, 0, -1):
+            parent_keys = np.unique(level_keys >> np.uint64(3))
+            if len(level_keys) != 8 * len(parent_keys):
+                raise ValueError('The leaves of level ' + str(level) + ' do not fit to the octree structure!')
+            keys.append(parent_keys)
+            levels.append(np.full(len(parent_keys), level - 1, dtype=np.uint8))
+            level_keys = np.concatenate((parent_keys, self.keys[self.levels == level - 1]))
+        keys = np.concatenate(keys)
+        levels = np.concatenate(levels)
+        order = self.get_depth_first_order(keys, levels)
+        leaf_index = np.concatenate((np.arange(len(self)), np.full(len(keys) - len(self), -1)))[order]
+        return leaf_index >= 0, levels[order], leaf_index
+
+    def write_grid(self, grid_file, quantity_ids, chunk_size=1048576):
+        """Writes the octree as POLARIS grid file (grid ID 20).
+
+        Args:
+            grid_file: Binary grid file opened for writing.
+            quantity_ids (List): ID of each data column.
+            chunk_size (int): Number of nodes that are written at once.
+        """
+        if self.data is None or np.shape(self.data)[1] != len(quantity_ids):
+            raise ValueError('The leaves need one data column per quantity ID!')
+        is_leaf, levels, leaf_index = self.get_nodes()
+        writer = GridWriter(grid_file)
+        writer.write_general_header('octree', quantity_ids)
+        writer.write_array(self.sidelength, np.float64)
+        for i_node in range(0, len(is_leaf), chunk_size):
+            nodes = slice(i_node, i_node + chunk_size)
+            writer.write_octree_nodes(is_leaf[nodes], levels[nodes],
+                                      self.data[leaf_index[nodes][is_leaf[nodes]]])